@@ -0,0 +1,272 @@
+#!/home/pscripts/venv/bin/python
+
+"""
+Offline benchmarks of the pipeline hot paths.
+
+Runs transform_post_details, generate_report, allow_request and
+insert_to_postgres on synthetic data of increasing size, reporting
+throughput and peak memory.  Results can be saved as a baseline and later
+runs compared against it:
+
+    python benchmarks/bench_ct.py --save-baseline
+    python benchmarks/bench_ct.py --compare
+
+insert_to_postgres needs a real database and only runs with --with-postgres.
+Point the PG* environment variables at a scratch database first!
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import pandas as pd
+
+from ctetl.ct_redis import allow_request
+from ctetl.ct_reporting import compact_report_dtypes, generate_report
+from ctetl.ct_synthetic import make_posts_response, make_post_details_response
+from ctetl.ct_tl import transform_post_details, queries_for_insert, insert_to_postgres
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# (posts, history length) of each benchmark run
+SIZES = [(10, 10), (50, 50), (200, 100)]
+
+
+### Synthetic data
+
+
+def make_post_details_payloads(posts, history_length):
+    """
+    Build post details payloads like the ones saved by ct_post_details_to_minio.
+    """
+    start = datetime(2023, 12, 10, 5)
+    posts_js = make_posts_response(
+        "", "", start, start + timedelta(hours=1), count=posts, posts_per_hour=posts
+    )
+    return [
+        make_post_details_response(post["platformId"], history_length)
+        for post in posts_js["result"]["posts"]
+    ]
+
+
+def get_object_name(payload):
+    """
+    Name payload like ct_post_details_to_minio does.
+    """
+    platform_id = payload["result"]["posts"][0]["platformId"]
+    return f"{platform_id}_2023-12-13T05:00:00_.txt"
+
+
+def make_report_df(posts, history_length):
+    """
+    Build a DataFrame like the one returned by query_report_data_from_db,
+    with every third timestep missing so generate_report has gaps to fill.
+    """
+    rows = []
+    for post_index in range(posts):
+        for timestep in range(history_length):
+            if timestep % 3 == 2:
+                continue
+            rows.append(
+                {
+                    "account_name": f"Account {post_index % 50}",
+                    "account_id": 1000 + post_index % 50,
+                    "platform_id": f"{1000 + post_index % 50}_{post_index}",
+                    "post_message": "Message " * 20,
+                    "post_url": f"https://www.facebook.com/{post_index}",
+                    "sgt_posting_date": datetime(2023, 12, 10, 13),
+                    "sgt_as_of": datetime(2023, 12, 13, 13),
+                    "score": 1.0 + timestep / 10,
+                    "metric_timestep": timestep,
+                }
+            )
+    return compact_report_dtypes(pd.DataFrame(rows))
+
+
+class InMemoryRedis:
+    """
+    Implements the list commands used by allow_request so the limiter logic
+    can be timed without a Redis server.  Network round trips are not included.
+    """
+
+    def __init__(self):
+        self.lists = {}
+
+    def lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return [str(v).encode() for v in values[start : None if end == -1 else end + 1]]
+
+    def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value)
+
+    def rpop(self, key):
+        return self.lists.get(key, []).pop()
+
+    def lpop(self, key):
+        return self.lists.get(key, []).pop(0)
+
+
+### Benchmarks
+
+
+def measure(func, units, repeat=5, min_seconds=0.2):
+    """
+    Return seconds taken by func, units per second and peak memory in MiB.
+
+    func is run once to warm up, then timed repeat times and until
+    min_seconds have passed, and the fastest run is reported, so runs of a
+    few milliseconds are comparable between benchmarks.  Peak memory is
+    measured in one more run, as tracing memory allocations slows it down
+    heavily.
+    """
+    func()
+
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < repeat or time.perf_counter() - started < min_seconds:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    seconds = min(timings)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": seconds,
+        "throughput": units / seconds,
+        "peak_mib": peak / 2**20,
+        "runs": len(timings),
+    }
+
+
+def bench_transform(posts, history_length):
+    # Raw JSON, as read from MinIO or received from CrowdTangle
+    objects = [
+        (json.dumps(payload).encode(), get_object_name(payload))
+        for payload in make_post_details_payloads(posts, history_length)
+    ]
+
+    def run():
+        # transform_post_details prints every object name
+        with patch("builtins.print"):
+            for data, object_name in objects:
+                transform_post_details(data, object_name)
+
+    return measure(run, posts)
+
+
+def bench_report(posts, history_length):
+    df = make_report_df(posts, history_length)
+    return measure(lambda: generate_report(df), len(df))
+
+
+def bench_allow_request(posts, history_length):
+    # A negative time_limit means requests are never denied.  rate_limit is the
+    # number of stored timestamps each call has to read.
+    redis_client = InMemoryRedis()
+    calls = posts * history_length
+
+    def run():
+        for _ in range(calls):
+            allow_request(redis_client, "bench", history_length, -2)
+
+    with patch("time.sleep"):
+        return measure(run, calls)
+
+
+def bench_insert(posts, history_length):
+    with patch("builtins.print"):
+        rows = [
+            transform_post_details(payload, get_object_name(payload))
+            for payload in make_post_details_payloads(posts, history_length)
+        ]
+    accounts = [row for r in rows for row in r[0]]
+    posts_rows = [row for r in rows for row in r[1]]
+    post_metrics = [row for r in rows for row in r[2]]
+
+    return measure(
+        lambda: insert_to_postgres(
+            *queries_for_insert(), accounts, posts_rows, post_metrics
+        ),
+        len(post_metrics),
+    )
+
+
+BENCHMARKS = {
+    "transform_post_details": (bench_transform, "posts/s"),
+    "generate_report": (bench_report, "rows/s"),
+    "allow_request": (bench_allow_request, "calls/s"),
+    "insert_to_postgres": (bench_insert, "metric rows/s"),
+}
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Print throughput change against baseline.  Returns False if any benchmark
+    is slower than baseline by more than tolerance.
+    """
+    passed = True
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"{key}: no baseline")
+            continue
+        change = result["throughput"] / baseline[key]["throughput"] - 1
+        regressed = change < -tolerance
+        passed = passed and not regressed
+        print(f"{key}: {change:+.1%} throughput{'  REGRESSION' if regressed else ''}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--save-baseline", action="store_true", help="Save results as the baseline.")
+    parser.add_argument("--compare", action="store_true", help="Compare results to the baseline.")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed throughput drop against the baseline (default 0.2).",
+    )
+    parser.add_argument("--with-postgres", action="store_true", help="Also benchmark insert_to_postgres.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (bench, unit) in BENCHMARKS.items():
+        if name == "insert_to_postgres" and not args.with_postgres:
+            continue
+        for posts, history_length in SIZES:
+            key = f"{name}[{posts}x{history_length}]"
+            result = bench(posts, history_length)
+            results[key] = result
+            print(
+                f"{key}: {result['throughput']:,.0f} {unit}, "
+                f"best of {result['runs']} {result['seconds']:.3f}s, "
+                f"peak {result['peak_mib']:.1f} MiB"
+            )
+
+    if args.compare:
+        if not os.path.exists(BASELINE_PATH):
+            print(f"No baseline at {BASELINE_PATH}, run with --save-baseline first.")
+            sys.exit(1)
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        if not compare_to_baseline(results, baseline, args.tolerance):
+            sys.exit(1)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
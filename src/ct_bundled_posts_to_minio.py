@@ -1,75 +1,69 @@
 #!/home/pscripts/venv/bin/python
 
-from datetime import datetime, timezone
+import argparse
+import sys
 
-from ctetl.ct_helpers import get_request_parameters, create_minio_client
-from ctetl.ct_helpers import create_redis_client, allow_request
-from ctetl.ct_helpers import check_minio_buckets
-from ctetl.ct_helpers import isoformat_to_seconds
-from ctetl.ct_extract import get_initial_start_and_end
-from ctetl.ct_extract import get_and_save_ct_post_aggregates, get_posts_next_page_url
+from ctetl.ct_helpers import get_request_parameters, get_rate_limiter_backend
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_minio import BackgroundUploader
+from ctetl.ct_redis import create_redis_client
+from ctetl.ct_extract import extract_post_aggregates, create_rate_limiter
+from ctetl.ct_profile import add_profile_argument, profile_run
 
 
-def main():
+def run(args):
     # Load request parameters to use
     REQUEST_HEADERS, CT_KEY = get_request_parameters()
 
-    # Create redis client
-    redis_client = create_redis_client()
-    redis_key = CT_KEY
+    # Create redis client, unless requests are rate limited in PostgreSQL
+    redis_client = None
+    if get_rate_limiter_backend() == "redis":
+        redis_client = create_redis_client()
 
     # Bundled post objects are saved in 'ct-posts' that must already exist
     posts_bucket = "ct-posts"
 
+    # platformIds of saved posts are published here for ct_post_details_from_stream
+    details_stream = "ct-post-details-stream"
+
     # Create MinIO client
     minio_client = create_minio_client()
 
     # Output will be to posts_bucket
     check_minio_buckets(minio_client, posts_bucket)
 
-    # Determine start and end times of bundled posts to get from CrowdTangle.
-    # Also 'get' now to save as part of with object name
-    now = datetime.now(timezone.utc).replace(tzinfo=None)
-    start, end = get_initial_start_and_end(now, minio_client, posts_bucket)
-
-    # Convert times to string format compatible with API call
-    # requirements and object naming
-
-    start_str, end_str, as_of = isoformat_to_seconds(start, end, now)
-
-    # Set number of API calls to track and limit calls to CrowdTangle
-    # num_calls = 0
-
-    # Set page counter in case request returns multiple pages
-    page = 1
-
-    # Set initial URL to the first page.
-    # URL of any subsequent pages are determined from the response(s)
-    url = f"https://api.crowdtangle.com/posts?token={CT_KEY}&sortBy=date&endDate={end_str}&startDate={start_str}&count=100"
-
-    while url:
-        allowed = False
-        while not allowed:
-            # Keep looping until allowed by the rate limiter
-            # CrowdTangle's limit is 6 requests in 60 seconds
-            allowed = allow_request(
-                redis_client, redis_key, 6, 60
-            )  # 6 requests in 60 seconds
-        request_response = get_and_save_ct_post_aggregates(
-            url,
+    rate_limiter = create_rate_limiter(redis_client, CT_KEY)
+    # Pages are saved in the background while the next page is requested
+    uploader = BackgroundUploader(minio_client)
+    try:
+        extracted = extract_post_aggregates(
             REQUEST_HEADERS,
+            CT_KEY,
+            redis_client,
             minio_client,
             posts_bucket,
-            as_of,
-            end_str,
-            start_str,
-            page,
+            details_stream,
+            rate_limiter,
+            uploader,
         )
+    finally:
+        # Finish saving pages already requested, even on errors
+        uploader.close()
+        if rate_limiter is not None:
+            rate_limiter.close()
+
+    # Exit this run normally if it is too early for new posts
+    if not extracted:
+        sys.exit(0)
 
-        page += 1
 
-        # Find subsequent page if it exists, else empty url exits the loop
-        url = get_posts_next_page_url(request_response)
+def main():
+    parser = argparse.ArgumentParser(description="Save bundled posts from CrowdTangle to MinIO.")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile_run(args.profile):
+        run(args)
 
 
 if __name__ == "__main__":
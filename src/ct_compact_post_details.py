@@ -0,0 +1,43 @@
+#!/home/pscripts/venv/bin/python
+
+import argparse
+
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_compact import get_closed_days, compact_day
+from ctetl.ct_profile import add_profile_argument, profile_run
+
+
+def run(args):
+    # Create MinIO client
+    minio_client = create_minio_client()
+
+    # Input from details_bucket, output to archive_bucket
+    details_bucket = "ct-post-details"
+    archive_bucket = "ct-post-details-archive"
+
+    # Proceed only if both bucket are found
+    check_minio_buckets(minio_client, details_bucket, archive_bucket)
+
+    days = args.days or get_closed_days(minio_client, details_bucket)
+    for day in days:
+        compact_day(minio_client, details_bucket, archive_bucket, day)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack processed post details of closed days into daily segments."
+    )
+    parser.add_argument(
+        "days",
+        nargs="*",
+        help="Days to compact as YYYY/MM/DD (default: every day before today).",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile_run(args.profile):
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
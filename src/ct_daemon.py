@@ -0,0 +1,94 @@
+#!/home/pscripts/venv/bin/python
+
+import argparse
+import threading
+
+from ctetl.ct_helpers import get_request_parameters, get_rate_limiter_backend
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_minio import create_minio_tags, BackgroundUploader
+from ctetl.ct_minio import add_since_hours_argument
+from ctetl.ct_redis import create_redis_client
+from ctetl.ct_extract import create_rate_limiter
+from ctetl.ct_daemon import DaemonState, STAGES, handle_stop_signals, run_daemon
+from ctetl.ct_profile import add_profile_argument, profile_run
+
+
+def run(args):
+    # load request parameters to use
+    REQUEST_HEADERS, CT_KEY = get_request_parameters()
+
+    # Clients are created once and reused by every stage
+    minio_client = create_minio_client()
+    # Redis isn't used if requests are rate limited in PostgreSQL
+    redis_client = None
+    if get_rate_limiter_backend() == "redis":
+        redis_client = create_redis_client()
+    rate_limiter = create_rate_limiter(redis_client, CT_KEY, args.lease_permits)
+
+    state = DaemonState(
+        REQUEST_HEADERS,
+        CT_KEY,
+        minio_client,
+        redis_client,
+        create_minio_tags(),
+        since_hours=args.since_hours,
+        rate_limiter=rate_limiter,
+        uploader=BackgroundUploader(minio_client),
+    )
+
+    # Proceed only if both bucket are found
+    check_minio_buckets(minio_client, state.posts_bucket, state.details_bucket)
+
+    intervals = {
+        name: getattr(args, f"{name}_interval")
+        for name in STAGES
+        if name in args.stages
+    }
+
+    stop_event = threading.Event()
+    handle_stop_signals(stop_event)
+    try:
+        run_daemon(state, intervals, stop_event)
+    finally:
+        # Finish uploads already requested
+        state.uploader.close()
+        # Give back unused permits for other processes
+        if rate_limiter is not None:
+            rate_limiter.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline stages on internal schedules in one long-running process."
+    )
+    parser.add_argument(
+        "--stages",
+        default=",".join(STAGES),
+        type=lambda stages: stages.split(","),
+        help="Comma separated stages to run (default: %(default)s).",
+    )
+    parser.add_argument("--extract-interval", type=int, default=300, help="Seconds between extract runs.")
+    parser.add_argument("--details-interval", type=int, default=300, help="Seconds between details runs.")
+    parser.add_argument("--load-interval", type=int, default=300, help="Seconds between load runs.")
+    parser.add_argument("--report-interval", type=int, default=86400, help="Seconds between reports.")
+    parser.add_argument(
+        "--lease-permits",
+        type=int,
+        default=0,
+        help="Lease this many rate limiter permits from Redis at a time rather "
+        "than checking Redis before every request (default 0, check every request).",
+    )
+    add_since_hours_argument(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    unknown_stages = set(args.stages).difference(STAGES)
+    if unknown_stages:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown_stages))}")
+
+    with profile_run(args.profile):
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/home/pscripts/venv/bin/python
+
+import argparse
+import sys
+
+from minio.commonconfig import CopySource
+from minio.error import S3Error
+
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_minio import get_legacy_object_names, get_partitioned_object_name
+
+# Position of as_of in the object names of each bucket when split on "_".
+# See ct_extract.get_and_save_ct_post_aggregates and get_details_object_name.
+AS_OF_POSITIONS = {"ct-posts": 0, "ct-post-details": 2}
+
+
+def migrate_bucket(minio_client, bucket, as_of_position, dry_run):
+    """
+    Move objects of the previous layout at the root of bucket to their
+    partitions.  Objects are copied with their tags before being removed, so
+    an interrupted migration can be run again.  Objects whose name has no
+    fetch time are skipped and left at the root.
+    """
+    object_names = get_legacy_object_names(minio_client, bucket)
+    print(f"{len(object_names)} objects to migrate in {bucket}.")
+
+    num_skipped = 0
+    for object_name in object_names:
+        try:
+            as_of = object_name.split("_")[as_of_position]
+            new_object_name = get_partitioned_object_name(object_name, as_of)
+        except (IndexError, ValueError):
+            # Not named by the scripts, e.g. uploaded by hand.  Left in place.
+            print(f"No fetch time in {object_name}, skipping.")
+            num_skipped += 1
+            continue
+        if dry_run:
+            print(f"{object_name} -> {new_object_name}")
+            continue
+
+        try:
+            # Tags are copied along with the object by default
+            minio_client.copy_object(
+                bucket, new_object_name, CopySource(bucket, object_name)
+            )
+            minio_client.remove_object(bucket, object_name)
+        except S3Error as e:
+            print(f"S3 Error migrating {object_name}: {e}")
+            sys.exit(1)
+
+    if num_skipped:
+        print(f"Skipped {num_skipped} objects in {bucket} without a fetch time.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="One-time migration of objects to date-partitioned names."
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the new name of each object without moving it.",
+    )
+    args = parser.parse_args()
+
+    minio_client = create_minio_client()
+
+    # Proceed only if both bucket are found
+    check_minio_buckets(minio_client, *AS_OF_POSITIONS)
+
+    for bucket, as_of_position in AS_OF_POSITIONS.items():
+        migrate_bucket(minio_client, bucket, as_of_position, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
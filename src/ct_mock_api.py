@@ -0,0 +1,129 @@
+#!/home/pscripts/venv/bin/python
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from ctetl.ct_synthetic import make_posts_response, make_post_details_response
+
+
+class MockCrowdTangleHandler(BaseHTTPRequestHandler):
+    """
+    Serve synthetic /posts and /post/{platformId} responses.  Settings are
+    attributes of the server, see main.
+    """
+
+    def do_GET(self):
+        settings = self.server.settings
+        time.sleep(settings.latency + random.uniform(0, settings.jitter))
+
+        if not self.server.allow_request():
+            self.send_json(
+                429,
+                {"status": 429, "message": "Rate limit exceeded"},
+                {"Retry-After": str(settings.rate_window)},
+            )
+            return
+
+        if random.random() < settings.error_rate:
+            self.send_json(503, {"status": 503, "message": "Injected error"})
+            return
+
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/posts":
+            base_url = f"http://{self.headers['Host']}"
+            response_js = make_posts_response(
+                base_url,
+                query.get("token", ""),
+                datetime.fromisoformat(query["startDate"]),
+                datetime.fromisoformat(query["endDate"]),
+                count=int(query.get("count", 100)),
+                offset=int(query.get("offset", 0)),
+                posts_per_hour=settings.posts_per_hour,
+            )
+        elif url.path.startswith("/post/"):
+            response_js = make_post_details_response(
+                url.path[len("/post/") :], settings.history_length
+            )
+        else:
+            response_js = None
+
+        if response_js is None:
+            self.send_json(404, {"status": 404, "message": "Not found"})
+        else:
+            self.send_json(200, response_js)
+
+    def send_json(self, status, response_js, headers=None):
+        body = json.dumps(response_js).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.settings.verbose:
+            super().log_message(format, *args)
+
+
+class MockCrowdTangleServer(ThreadingHTTPServer):
+    def __init__(self, address, settings):
+        super().__init__(address, MockCrowdTangleHandler)
+        self.settings = settings
+        self.request_times = deque()
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Enforce settings.rate_limit requests in settings.rate_window seconds
+        like CrowdTangle.  A rate_limit of 0 disables the limit.
+        """
+        if not self.settings.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            while self.request_times and self.request_times[0] <= now - self.settings.rate_window:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.settings.rate_limit:
+                return False
+            self.request_times.append(now)
+            return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the CrowdTangle API serving synthetic data. "
+        "Point the extract scripts at it with CT_API_URL=http://HOST:PORT."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many random seconds added to latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--rate-limit", type=int, default=6, help="Requests allowed per window, 0 for no limit.")
+    parser.add_argument("--rate-window", type=int, default=60, help="Rate limit window in seconds.")
+    parser.add_argument("--posts-per-hour", type=int, default=100, help="Posts per hour of posting dates, below 1000.")
+    parser.add_argument("--history-length", type=int, default=51, help="History entries per post detail.")
+    parser.add_argument("--verbose", action="store_true", help="Log every request.")
+    settings = parser.parse_args()
+
+    server = MockCrowdTangleServer((settings.host, settings.port), settings)
+    print(f"Serving mock CrowdTangle API on http://{settings.host}:{settings.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/home/pscripts/venv/bin/python
+
+import argparse
+import os
+import socket
+
+from ctetl.ct_helpers import get_request_parameters
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_minio import create_minio_tags, BackgroundUploader
+from ctetl.ct_redis import create_redis_client, create_redis_consumer_group
+from ctetl.ct_extract import process_details_stream, create_rate_limiter
+from ctetl.ct_profile import add_profile_argument, profile_run
+
+
+def run(args):
+    # load request parameters to use
+    REQUEST_HEADERS, CT_KEY = get_request_parameters()
+
+    # Input from details_stream, output to details_bucket
+    details_stream = "ct-post-details-stream"
+    details_group = "ct-post-details-fetchers"
+    details_bucket = "ct-post-details"
+
+    # Consumer names must be unique across every process and node
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+
+    redis_client = create_redis_client()
+    minio_client = create_minio_client()
+
+    # Proceed only if the bucket is found
+    check_minio_buckets(minio_client, details_bucket)
+
+    create_redis_consumer_group(redis_client, details_stream, details_group)
+
+    # Post details are uploaded in the background while the next post is
+    # requested, also when the batcher loads them
+    uploader = BackgroundUploader(minio_client)
+
+    details_batcher = None
+    if args.load:
+        # Imported here so the default mode doesn't need the load dependencies
+        from ctetl.ct_tl import PostDetailsBatcher, create_known_keys_caches
+
+        known_accounts, known_posts = create_known_keys_caches()
+        details_batcher = PostDetailsBatcher(
+            minio_client,
+            details_bucket,
+            create_minio_tags(),
+            known_accounts=known_accounts,
+            known_posts=known_posts,
+            uploader=uploader,
+        )
+
+    rate_limiter = create_rate_limiter(redis_client, CT_KEY, args.lease_permits)
+
+    try:
+        process_details_stream(
+            REQUEST_HEADERS,
+            CT_KEY,
+            redis_client,
+            minio_client,
+            details_bucket,
+            details_stream,
+            details_group,
+            consumer,
+            details_batcher=details_batcher,
+            rate_limiter=rate_limiter,
+            uploader=uploader,
+        )
+    finally:
+        # Finish uploads already requested, even on errors
+        uploader.close()
+        # Give back unused permits for other processes
+        if rate_limiter is not None:
+            rate_limiter.close()
+
+    if details_batcher is not None:
+        details_batcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fetch details of posts queued in Redis from CrowdTangle."
+    )
+    parser.add_argument(
+        "--load",
+        action="store_true",
+        help="Also transform and load post details to PostgreSQL in this process.",
+    )
+    parser.add_argument(
+        "--lease-permits",
+        type=int,
+        default=0,
+        help="Lease this many rate limiter permits from Redis at a time rather "
+        "than checking Redis before every request (default 0, check every request).",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile_run(args.profile):
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 #!/home/pscripts/venv/bin/python
 
-from ctetl.ct_helpers import get_request_parameters
-from ctetl.ct_helpers import get_request_parameters, create_minio_client
-from ctetl.ct_helpers import create_minio_client, check_minio_buckets
-from ctetl.ct_helpers import create_minio_tags, get_minio_object_names
-from ctetl.ct_extract import process_post_object
+import argparse
 
+from ctetl.ct_helpers import get_request_parameters, get_rate_limiter_backend
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_minio import create_minio_tags, get_minio_object_names
+from ctetl.ct_minio import add_since_hours_argument, BackgroundUploader
+from ctetl.ct_redis import create_redis_client
+from ctetl.ct_extract import process_post_object, process_post_objects
+from ctetl.ct_extract import create_rate_limiter, PostDetailsScheduler
+from ctetl.ct_extract import FETCH_SCHEDULES
+from ctetl.ct_profile import add_profile_argument, profile_run
 
-def main():
+
+def run(args):
     # load request parameters to use
     REQUEST_HEADERS, CT_KEY = get_request_parameters()
 
@@ -26,20 +32,127 @@ def main():
     # Set number of API calls to track and limit calls to CrowdTangle
     num_calls = 0
 
-    # Get post object names saved in posts_bucket and loop through each to process
-    post_object_names = get_minio_object_names(minio_client, posts_bucket)
-    for post_object_name in post_object_names:
-        process_post_object(
-            tags,
-            num_calls,
-            REQUEST_HEADERS,
-            CT_KEY,
+    # Post details are uploaded in the background while the next post is
+    # requested, also when the batcher loads them
+    uploader = BackgroundUploader(minio_client)
+
+    details_batcher = None
+    if args.load:
+        # Imported here so the default mode doesn't need the load dependencies
+        from ctetl.ct_tl import PostDetailsBatcher, create_known_keys_caches
+
+        known_accounts, known_posts = create_known_keys_caches()
+        details_batcher = PostDetailsBatcher(
             minio_client,
-            posts_bucket,
             details_bucket,
-            post_object_name,
+            tags,
+            known_accounts=known_accounts,
+            known_posts=known_posts,
+            uploader=uploader,
         )
 
+    # Redis isn't used if requests are rate limited in PostgreSQL
+    redis_client = None
+    if get_rate_limiter_backend() == "redis":
+        redis_client = create_redis_client()
+    rate_limiter = create_rate_limiter(redis_client, CT_KEY, args.lease_permits)
+
+    # Get post object names saved in posts_bucket and loop through each to process
+    post_object_names = get_minio_object_names(
+        minio_client, posts_bucket, args.since_hours
+    )
+    try:
+        if args.schedule == "fifo":
+            for post_object_name in post_object_names:
+                process_post_object(
+                    tags,
+                    num_calls,
+                    REQUEST_HEADERS,
+                    CT_KEY,
+                    minio_client,
+                    posts_bucket,
+                    details_bucket,
+                    post_object_name,
+                    details_batcher,
+                    redis_client,
+                    rate_limiter,
+                    uploader,
+                )
+        else:
+            # Fetch posts of all post objects in order of priority
+            scheduler = PostDetailsScheduler(
+                args.schedule, args.report_start_hours, args.report_end_hours
+            )
+            process_post_objects(
+                tags,
+                REQUEST_HEADERS,
+                CT_KEY,
+                minio_client,
+                posts_bucket,
+                details_bucket,
+                post_object_names,
+                scheduler,
+                details_batcher,
+                redis_client,
+                rate_limiter,
+                uploader,
+            )
+    finally:
+        # Finish uploads already requested, even on errors
+        uploader.close()
+        # Give back unused permits for other processes
+        if rate_limiter is not None:
+            rate_limiter.close()
+
+    if details_batcher is not None:
+        details_batcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fetch details of posts in MinIO from CrowdTangle."
+    )
+    parser.add_argument(
+        "--load",
+        action="store_true",
+        help="Also transform and load post details to PostgreSQL in this process.",
+    )
+    add_since_hours_argument(parser)
+    parser.add_argument(
+        "--lease-permits",
+        type=int,
+        default=0,
+        help="Lease this many rate limiter permits from Redis at a time rather "
+        "than checking Redis before every request (default 0, check every request).",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=FETCH_SCHEDULES,
+        default="fifo",
+        help="Order to fetch post details in: as listed (fifo, the default), "
+        "most recently posted first (freshest), or posts of the report window "
+        "first (report-window).",
+    )
+    parser.add_argument(
+        "--report-start-hours",
+        type=int,
+        default=96,
+        help="Start of the report window for --schedule report-window, in hours "
+        "before now (default 96).",
+    )
+    parser.add_argument(
+        "--report-end-hours",
+        type=int,
+        default=72,
+        help="End of the report window for --schedule report-window, in hours "
+        "before now (default 72).",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with profile_run(args.profile):
+        run(args)
+
 
 if __name__ == "__main__":
     main()
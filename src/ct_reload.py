@@ -0,0 +1,82 @@
+#!/home/pscripts/venv/bin/python
+
+import argparse
+from datetime import datetime
+
+from ctetl.ct_minio import create_minio_client, check_minio_buckets
+from ctetl.ct_reload import reload_post_details
+from ctetl.ct_profile import add_profile_argument, profile_run
+
+
+def run(args):
+    # Create MinIO client
+    minio_client = create_minio_client()
+
+    # Input from details_bucket and segments compacted into archive_bucket
+    details_bucket = "ct-post-details"
+    archive_bucket = "ct-post-details-archive"
+
+    # Proceed only if both bucket are found
+    check_minio_buckets(minio_client, details_bucket, archive_bucket)
+
+    reload_post_details(
+        minio_client,
+        details_bucket,
+        archive_bucket,
+        args.from_date,
+        args.to_date,
+        workers=args.workers,
+        apply=not args.no_apply,
+    )
+
+
+def valid_date(date_str):
+    """
+    argparse type of YYYY-MM-DD dates.
+    """
+    datetime.strptime(date_str, "%Y-%m-%d")
+    return date_str
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reload post details fetched between two dates from MinIO, "
+        "ignoring tags, and replace their rows in PostgreSQL."
+    )
+    parser.add_argument(
+        "--from",
+        dest="from_date",
+        type=valid_date,
+        required=True,
+        help="First day to reload, YYYY-MM-DD.",
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_date",
+        type=valid_date,
+        required=True,
+        help="Last day to reload, YYYY-MM-DD.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="Number of worker processes (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--no-apply",
+        action="store_true",
+        help="Leave the reloaded data in the *_reload tables without applying it.",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    if args.from_date > args.to_date:
+        parser.error("--from must not be after --to")
+
+    with profile_run(args.profile):
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,65 @@
 #!/home/pscripts/venv/bin/python
 
-from ctetl.ct_helpers import create_sqlalchemy_engine
-from ctetl.ct_reporting import query_report_data_from_db, generate_report
-from ctetl.ct_reporting import save_report_to_csv
+import argparse
+from functools import partial
 
+from ctetl.ct_db import create_sqlalchemy_engine
+from ctetl.ct_reporting import create_score_report
+from ctetl.ct_reporting import query_report_data_from_db
+from ctetl.ct_reporting import query_report_data_from_parquet
+from ctetl.ct_reporting import query_report_load_watermark
+from ctetl.ct_profile import add_profile_argument, profile_run
 
-def main():
-    engine = create_sqlalchemy_engine()
 
-    start_hours = 96
-    end_hours = 72
+def run(args):
+    # Reports are only cached for PostgreSQL, where the loader records watermarks
+    query_load_watermark = None
+    if args.parquet:
+        query_report_data = partial(query_report_data_from_parquet, args.parquet)
+    else:
+        engine = create_sqlalchemy_engine()
+        query_report_data = partial(query_report_data_from_db, engine)
+        if not args.no_cache:
+            query_load_watermark = partial(query_report_load_watermark, engine)
+
+    create_score_report(
+        query_report_data,
+        start=args.start_hours,
+        end=args.end_hours,
+        query_load_watermark=query_load_watermark,
+    )
 
-    df = query_report_data_from_db(engine, start=start_hours, end=end_hours)
 
-    # Need to drop duplicates since only querying for scores
-    df.drop_duplicates(inplace=True)
+def main():
+    parser = argparse.ArgumentParser(description="Generate a CSV report of CrowdTangle scores from PostgreSQL.")
+    parser.add_argument(
+        "--parquet",
+        metavar="DATASET",
+        help="Read from the Parquet copy written by ct_transform_and_load.py "
+        "--parquet, a local directory or s3://bucket/prefix, instead of PostgreSQL.",
+    )
+    parser.add_argument(
+        "--start-hours",
+        type=int,
+        default=96,
+        help="Report on posts posted from this many hours ago (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--end-hours",
+        type=int,
+        default=72,
+        help="Report on posts posted up to this many hours ago (default: %(default)s).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always query and generate the report, without the report cache.",
+    )
+    add_profile_argument(parser)
+    args = parser.parse_args()
 
-    report_df = generate_report(df)
-    save_report_to_csv(report_df)
+    with profile_run(args.profile):
+        run(args)
 
 
 if __name__ == "__main__":
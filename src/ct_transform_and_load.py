@@ -1,11 +1,19 @@
 #!/home/pscripts/venv/bin/python
 
-from ctetl.ct_helpers import create_minio_client, check_minio_buckets, create_minio_tags
-from ctetl.ct_helpers import get_minio_object_names, get_minio_response_js
-from ctetl.ct_tl import transform_post_details, queries_for_insert, insert_to_postgres
+import argparse
+import os
+import socket
+import sys
 
+from ctetl.ct_minio import create_minio_client, check_minio_buckets, create_minio_tags
+from ctetl.ct_minio import get_minio_object_names
+from ctetl.ct_minio import add_since_hours_argument
+from ctetl.ct_tl import load_detail_objects, listen_and_load
+from ctetl.ct_tl import create_known_keys_caches, print_known_keys_stats
+from ctetl.ct_profile import add_profile_argument, profile_run
 
-def main():
+
+def run(args):
     # Create MinIO client
     minio_client = create_minio_client()
 
@@ -18,22 +26,106 @@ def main():
     # Prepare to tag post details to keep from processing them more than once
     tags = create_minio_tags()
 
-    # Get post detail object names saved in MinIO and loop through each to process
-    detail_object_names = get_minio_object_names(minio_client, details_bucket)
+    parquet_sink = None
+    if args.parquet:
+        # Import here so pyarrow is only needed with --parquet
+        from ctetl.ct_parquet import ParquetSink
 
-    for detail_object_name in detail_object_names:
-        tagged = minio_client.get_object_tags(details_bucket, detail_object_name)
-        if not tagged:
-            minio_response_js = get_minio_response_js(
-                detail_object_name, details_bucket, minio_client
-            )
-            insert_to_postgres(
-                *queries_for_insert(),
-                *transform_post_details(minio_response_js, detail_object_name)
+        parquet_sink = ParquetSink(args.parquet, minio_client)
+
+    try:
+        if args.listen:
+            listen_and_load(
+                minio_client, details_bucket, tags, parquet_sink=parquet_sink
             )
+        else:
+            load_untagged_objects(args, minio_client, details_bucket, tags, parquet_sink)
+    finally:
+        # Write rows still buffered, also when stopped in --listen mode
+        if parquet_sink is not None:
+            parquet_sink.close()
+
+
+def load_untagged_objects(args, minio_client, details_bucket, tags, parquet_sink):
+    # Get post detail object names saved in MinIO and process each untagged one
+    detail_object_names = get_minio_object_names(
+        minio_client, details_bucket, args.since_hours
+    )
+    known_accounts, known_posts = create_known_keys_caches()
+    if args.shards:
+        # Import here so a single node never needs Redis
+        from ctetl.ct_redis import create_redis_client
+        from ctetl.ct_shard import load_detail_shards
+
+        redis_client = create_redis_client()
+        if redis_client is None:
+            print("Redis is required to load in shards.  Is it running?")
+            sys.exit(1)
+
+        load_detail_shards(
+            minio_client,
+            redis_client,
+            details_bucket,
+            tags,
+            detail_object_names,
+            args.shards,
+            f"{socket.gethostname()}-{os.getpid()}",
+            lease_ttl_ms=args.lease_ttl * 1000,
+            known_accounts=known_accounts,
+            known_posts=known_posts,
+            parquet_sink=parquet_sink,
+        )
+    else:
+        load_detail_objects(
+            minio_client,
+            details_bucket,
+            tags,
+            detail_object_names,
+            known_accounts=known_accounts,
+            known_posts=known_posts,
+            parquet_sink=parquet_sink,
+        )
+    print_known_keys_stats(known_accounts, known_posts)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Transform post details in MinIO and load them to PostgreSQL."
+    )
+    parser.add_argument(
+        "--listen",
+        action="store_true",
+        help="Keep running and load objects as MinIO reports them created.",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="Split objects into this many shards and load only those leased "
+        "from Redis, so copies on several nodes share the work.  All copies "
+        "must use the same number.",
+    )
+    parser.add_argument(
+        "--lease-ttl",
+        type=int,
+        default=60,
+        help="Seconds a shard lease lasts if its worker stops renewing it.",
+    )
+    parser.add_argument(
+        "--parquet",
+        metavar="DESTINATION",
+        help="Also write loaded rows as Parquet to this directory, "
+        "or to s3://bucket/prefix in MinIO.",
+    )
+    add_since_hours_argument(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    if args.listen and args.shards:
+        parser.error("--shards cannot be used with --listen")
 
-            # Tag the object to prevent reprocessing
-            minio_client.set_object_tags(details_bucket, detail_object_name, tags)
+    with profile_run(args.profile):
+        run(args)
 
 
 if __name__ == "__main__":
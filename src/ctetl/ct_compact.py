@@ -0,0 +1,321 @@
+# ct_compact.py
+
+import gzip
+import hashlib
+import io
+import json
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from minio.deleteobjects import DeleteObject
+from minio.error import S3Error
+
+from .ct_minio import OBJECT_LAYOUT
+
+
+### Compaction of post details into daily segments
+#
+# A segment is a concatenation of gzip members, one per post details object,
+# saved as segments/YYYY/MM/DD.<sha256 prefix>.gz.  As a multi-member gzip
+# file it can be decompressed in one go, and each member can also be read on
+# its own with a range request.  segments/YYYY/MM/DD.index.json names the
+# segment and lists the name, offset, length and sha256 of each member.
+#
+# A segment is never overwritten by a different one.  Compacting a day again
+# writes a new segment and publishes it by writing the index last, so the
+# index always matches the segment it names.
+
+
+def get_index_name(day):
+    """
+    Used by compact_day and the segment readers.
+
+    Return the index object name of day, a 'YYYY/MM/DD' string.
+    """
+    return f"segments/{day}.index.json"
+
+
+def get_segment_name(day, index):
+    """
+    Used by compact_day and the segment readers.
+
+    Return the name of the segment of day listed by index.  Segments written
+    before they were named after their content are all segments/YYYY/MM/DD.gz.
+    """
+    return index.get("segment", f"segments/{day}.gz")
+
+
+def get_closed_days(minio_client, details_bucket):
+    """
+    Used by ct_compact_post_details.
+
+    Return the 'YYYY/MM/DD' days with partitioned objects in details_bucket
+    before the current UTC day.  Only prefixes are listed, not objects.
+    """
+    today = datetime.now(timezone.utc).strftime("%Y/%m/%d")
+
+    prefixes = [f"{OBJECT_LAYOUT}/"]
+    # Walk down YYYY/, MM/ and DD/
+    for _ in range(3):
+        prefixes = [
+            obj.object_name
+            for prefix in prefixes
+            for obj in minio_client.list_objects(details_bucket, prefix=prefix)
+            if obj.is_dir
+        ]
+
+    days = [prefix[len(OBJECT_LAYOUT) + 1 : -1] for prefix in prefixes]
+    return sorted(day for day in days if day < today)
+
+
+def read_segment_index(minio_client, archive_bucket, day):
+    """
+    Return the index of the segment of day, or None if there is none.
+    """
+    try:
+        with minio_client.get_object(archive_bucket, get_index_name(day)) as response:
+            return json.loads(response.data.decode())
+    except S3Error as e:
+        if e.code == "NoSuchKey":
+            return None
+        raise
+
+
+def iter_segment_data(minio_client, archive_bucket, day):
+    """
+    Yield (object_name, raw bytes) of every post details object in the
+    segment of day, reading the whole segment with one GET.
+    """
+    index = read_segment_index(minio_client, archive_bucket, day)
+    if index is None:
+        return
+
+    segment_name = get_segment_name(day, index)
+    with minio_client.get_object(archive_bucket, segment_name) as response:
+        segment = response.data
+
+    for entry in index["objects"]:
+        member = segment[entry["offset"] : entry["offset"] + entry["length"]]
+        yield entry["name"], gzip.decompress(member)
+
+
+def iter_segment_objects(minio_client, archive_bucket, day):
+    """
+    Yield (object_name, minio_response_js) of every post details object in
+    the segment of day, see iter_segment_data.  The results are the same as
+    get_minio_response_js of the original objects.
+    """
+    for object_name, data in iter_segment_data(minio_client, archive_bucket, day):
+        yield object_name, json.loads(data.decode())
+
+
+def read_segment_member(minio_client, archive_bucket, segment_name, entry):
+    """
+    Used by read_segment_object and iter_day_objects.
+
+    Return the raw bytes of the member of segment_name listed by entry, an
+    entry of its index, with a range request.
+    """
+    with minio_client.get_object(
+        archive_bucket,
+        segment_name,
+        offset=entry["offset"],
+        length=entry["length"],
+    ) as response:
+        return gzip.decompress(response.data)
+
+
+def read_segment_object(minio_client, archive_bucket, day, object_name):
+    """
+    Return minio_response_js of a single object of the segment of day with a
+    range request, or None if it is not in the segment.
+    """
+    index = read_segment_index(minio_client, archive_bucket, day) or {"objects": []}
+    for entry in index["objects"]:
+        if entry["name"] == object_name:
+            segment_name = get_segment_name(day, index)
+            data = read_segment_member(minio_client, archive_bucket, segment_name, entry)
+            return json.loads(data.decode())
+    return None
+
+
+def iter_day_objects(
+    minio_client, details_bucket, archive_bucket, day, object_names, index
+):
+    """
+    Used by compact_day.
+
+    Yield (object_name, raw bytes) of object_names in details_bucket and of
+    the objects of the segment of day listed by index, so a day compacted
+    again keeps the objects already compacted.  Objects are yielded in name
+    order and only read when yielded, one at a time.  An object both in
+    details_bucket and in the segment is read from details_bucket.
+    """
+    # {object_name: segment index entry, or None if in details_bucket}
+    entries = {}
+    if index is not None:
+        segment_name = get_segment_name(day, index)
+        entries.update((entry["name"], entry) for entry in index["objects"])
+    entries.update((object_name, None) for object_name in object_names)
+
+    for object_name in sorted(entries):
+        entry = entries[object_name]
+        if entry is None:
+            with minio_client.get_object(details_bucket, object_name) as response:
+                data = response.data
+        else:
+            data = read_segment_member(minio_client, archive_bucket, segment_name, entry)
+        yield object_name, data
+
+
+def write_segment(segment_file, objects):
+    """
+    Used by compact_day.
+
+    Write objects, an iterable of (object_name, raw bytes), to segment_file
+    as gzip members, compressing each object as it is read from objects.
+    Returns the index, with the sha256 of the segment.
+    """
+    entries = []
+    segment_hash = hashlib.sha256()
+    for object_name, data in objects:
+        # mtime=0 so the same objects always make the same segment
+        member = gzip.compress(data, mtime=0)
+        entries.append(
+            {
+                "name": object_name,
+                "offset": segment_file.tell(),
+                "length": len(member),
+                "sha256": hashlib.sha256(data).hexdigest(),
+            }
+        )
+        segment_file.write(member)
+        segment_hash.update(member)
+    return {"sha256": segment_hash.hexdigest(), "objects": entries}
+
+
+def read_exactly(response, length):
+    """
+    Used by verify_segment.
+
+    Return the next length bytes of response, or fewer at its end.
+    """
+    chunks = []
+    while length > 0:
+        chunk = response.read(length)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+def verify_segment(minio_client, archive_bucket, day, index):
+    """
+    Used by compact_day.
+
+    Read back the saved segment of day named by index and check every member
+    against index.  Returns True if all members decompress to their original
+    data.  The segment is streamed a member at a time, as members are listed
+    in the order of their offsets.
+    """
+    segment_name = get_segment_name(day, index)
+    with minio_client.get_object(archive_bucket, segment_name) as response:
+        offset = 0
+        for entry in index["objects"]:
+            if entry["offset"] != offset:
+                return False
+            member = read_exactly(response, entry["length"])
+            offset += len(member)
+            try:
+                data = gzip.decompress(member)
+            except (OSError, EOFError):
+                return False
+            if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+                return False
+    return True
+
+
+def compact_day(minio_client, details_bucket, archive_bucket, day):
+    """
+    Used by ct_compact_post_details.
+
+    Pack the post details objects of day into a new segment in
+    archive_bucket, verify it, publish it by writing its index and remove the
+    originals and the segment it replaces.  A failure at any step leaves the
+    previous index and segment readable.  The day is skipped if any of its
+    objects is not yet tagged as processed.
+
+    Returns the number of objects removed from details_bucket.
+    """
+    prefix = f"{OBJECT_LAYOUT}/{day}/"
+    object_names = [
+        obj.object_name
+        for obj in minio_client.list_objects(
+            details_bucket, prefix=prefix, recursive=True
+        )
+    ]
+    if not object_names:
+        return 0
+
+    for object_name in object_names:
+        if not minio_client.get_object_tags(details_bucket, object_name):
+            print(f"{object_name} is not processed yet, skipping {day}.")
+            return 0
+
+    # Keep objects of an earlier compaction of the same day, e.g. one that
+    # was interrupted before all originals were removed.  Objects are
+    # streamed into the segment file, so only one is held in memory.
+    previous_index = read_segment_index(minio_client, archive_bucket, day)
+    objects = iter_day_objects(
+        minio_client, details_bucket, archive_bucket, day, object_names, previous_index
+    )
+
+    with tempfile.TemporaryFile() as segment_file:
+        index = write_segment(segment_file, objects)
+        segment_name = f"segments/{day}.{index['sha256'][:16]}.gz"
+        index["segment"] = segment_name
+        segment_length = segment_file.tell()
+        segment_file.seek(0)
+        minio_client.put_object(
+            archive_bucket,
+            segment_name,
+            segment_file,
+            segment_length,
+            content_type="application/gzip",
+        )
+
+    # The new segment is only published once it reads back intact
+    if not verify_segment(minio_client, archive_bucket, day, index):
+        print(f"Segment of {day} failed verification, keeping originals.")
+        sys.exit(1)
+
+    index_bytes = json.dumps(index).encode()
+    minio_client.put_object(
+        archive_bucket,
+        get_index_name(day),
+        io.BytesIO(index_bytes),
+        len(index_bytes),
+        content_type="application/json",
+    )
+
+    errors = list(
+        minio_client.remove_objects(
+            details_bucket, [DeleteObject(object_name) for object_name in object_names]
+        )
+    )
+    for error in errors:
+        print(f"S3 Error removing object: {error}")
+
+    if previous_index is not None:
+        previous_segment_name = get_segment_name(day, previous_index)
+        if previous_segment_name != segment_name:
+            minio_client.remove_object(archive_bucket, previous_segment_name)
+
+    print(
+        f"Compacted {len(object_names)} objects of {day} into {segment_name} "
+        f"({segment_length} bytes, {len(index['objects'])} objects in total)."
+    )
+    return len(object_names) - len(errors)
+
@@ -0,0 +1,234 @@
+# ct_daemon.py
+
+import signal
+import time
+from functools import partial
+
+from .ct_extract import extract_post_aggregates, process_post_object
+from .ct_minio import get_minio_object_names
+
+
+### Long-running supervisor of the pipeline stages
+
+
+class DaemonState:
+    """
+    Clients and in-memory state kept warm between ticks of the stages.
+
+    Object names already processed are remembered so their tags are not looked
+    up again on every tick.  The sets are cleared every reset_interval seconds
+    to bound memory and pick up objects that were untagged by hand.
+
+    rate_limiter, if given, is shared by the extract and details stages, see
+    ct_extract.create_rate_limiter.  redis_client is None if Redis isn't used.
+    uploader, a ct_minio.BackgroundUploader, if given, saves the responses of
+    both stages in the background.
+    """
+
+    def __init__(
+        self,
+        request_headers,
+        ct_key,
+        minio_client,
+        redis_client,
+        tags,
+        posts_bucket="ct-posts",
+        details_bucket="ct-post-details",
+        details_stream="ct-post-details-stream",
+        reset_interval=86400,
+        since_hours=0,
+        rate_limiter=None,
+        uploader=None,
+    ):
+        self.request_headers = request_headers
+        self.ct_key = ct_key
+        self.minio_client = minio_client
+        self.redis_client = redis_client
+        self.tags = tags
+        self.posts_bucket = posts_bucket
+        self.details_bucket = details_bucket
+        self.details_stream = details_stream
+        self.reset_interval = reset_interval
+        self.since_hours = since_hours
+        self.rate_limiter = rate_limiter
+        self.uploader = uploader
+
+        # Created by the stages that need them on first use
+        self.engine = None
+        self.known_accounts = None
+        self.known_posts = None
+        self.metric_watermarks = None
+
+        self.processed_post_objects = set()
+        self.loaded_detail_objects = set()
+        self.next_reset = time.monotonic() + self.reset_interval
+
+    def reset_processed_objects(self):
+        self.processed_post_objects.clear()
+        self.loaded_detail_objects.clear()
+        self.next_reset = time.monotonic() + self.reset_interval
+
+    def get_new_object_names(self, bucket, seen_object_names):
+        """
+        List bucket and return names not in seen_object_names.
+        """
+        if time.monotonic() >= self.next_reset:
+            self.reset_processed_objects()
+        return [
+            object_name
+            for object_name in get_minio_object_names(
+                self.minio_client, bucket, self.since_hours
+            )
+            if object_name not in seen_object_names
+        ]
+
+
+def run_extract_stage(state, stop_event):
+    """
+    Used by ct_daemon.  Same as ct_bundled_posts_to_minio.
+    """
+    extract_post_aggregates(
+        state.request_headers,
+        state.ct_key,
+        state.redis_client,
+        state.minio_client,
+        state.posts_bucket,
+        state.details_stream,
+        state.rate_limiter,
+        state.uploader,
+    )
+
+
+def run_details_stage(state, stop_event):
+    """
+    Used by ct_daemon.  Same as ct_post_details_to_minio.
+    """
+    post_object_names = state.get_new_object_names(
+        state.posts_bucket, state.processed_post_objects
+    )
+    for post_object_name in post_object_names:
+        if stop_event.is_set():
+            return
+        process_post_object(
+            state.tags,
+            0,
+            state.request_headers,
+            state.ct_key,
+            state.minio_client,
+            state.posts_bucket,
+            state.details_bucket,
+            post_object_name,
+            redis_client=state.redis_client,
+            rate_limiter=state.rate_limiter,
+            uploader=state.uploader,
+        )
+        state.processed_post_objects.add(post_object_name)
+
+
+def run_load_stage(state, stop_event, batch_size=50):
+    """
+    Used by ct_daemon.  Same as ct_transform_and_load.
+    """
+    from .ct_tl import load_detail_objects, create_known_keys_caches
+    from .ct_tl import MetricWatermarksCache
+
+    if state.known_accounts is None:
+        state.known_accounts, state.known_posts = create_known_keys_caches()
+        state.metric_watermarks = MetricWatermarksCache()
+
+    detail_object_names = state.get_new_object_names(
+        state.details_bucket, state.loaded_detail_objects
+    )
+    # Load a batch at a time to check for shutdown in between
+    for i in range(0, len(detail_object_names), batch_size):
+        if stop_event.is_set():
+            return
+        batch_object_names = detail_object_names[i : i + batch_size]
+        load_detail_objects(
+            state.minio_client,
+            state.details_bucket,
+            state.tags,
+            batch_object_names,
+            batch_size,
+            state.metric_watermarks,
+            state.known_accounts,
+            state.known_posts,
+        )
+        state.loaded_detail_objects.update(batch_object_names)
+
+
+def run_report_stage(state, stop_event, start=96, end=72):
+    """
+    Used by ct_daemon.  Same as ct_score_report.
+    """
+    from .ct_db import create_sqlalchemy_engine
+    from .ct_reporting import create_score_report, query_report_data_from_db
+
+    if state.engine is None:
+        state.engine = create_sqlalchemy_engine()
+
+    create_score_report(
+        partial(query_report_data_from_db, state.engine), start=start, end=end
+    )
+
+
+STAGES = {
+    "extract": run_extract_stage,
+    "details": run_details_stage,
+    "load": run_load_stage,
+    "report": run_report_stage,
+}
+
+
+def handle_stop_signals(stop_event):
+    """
+    Used by ct_daemon.
+
+    Set stop_event on SIGTERM or SIGINT.  The running stage stops at the next
+    object or batch and the daemon exits.
+    """
+
+    def handler(signum, frame):
+        print(f"Received {signal.Signals(signum).name}, stopping after current step.")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+
+def run_stage(name, stage, state, stop_event):
+    """
+    Used by run_daemon.
+
+    Run one tick of a stage.  Errors, including the sys.exit calls of the
+    helpers, are reported and the stage is retried on its next tick.
+    """
+    start = time.monotonic()
+    try:
+        stage(state, stop_event)
+    except SystemExit as e:
+        print(f"Stage {name} exited with code {e.code}, retrying next tick.")
+    except Exception as e:
+        print(f"Stage {name} failed, retrying next tick.  Error: {e!r}")
+    else:
+        print(f"Stage {name} finished in {time.monotonic() - start:.1f}s.")
+
+
+def run_daemon(state, intervals, stop_event):
+    """
+    Used by ct_daemon.
+
+    Run each stage in intervals, {stage name: seconds}, every interval seconds
+    until stop_event is set.  Stages run one at a time in pipeline order.
+    """
+    next_runs = {name: time.monotonic() for name in intervals}
+
+    while not stop_event.is_set():
+        for name, interval in intervals.items():
+            if stop_event.is_set():
+                break
+            if time.monotonic() >= next_runs[name]:
+                run_stage(name, STAGES[name], state, stop_event)
+                next_runs[name] = time.monotonic() + interval
+
+        stop_event.wait(max(0, min(next_runs.values()) - time.monotonic()))
@@ -0,0 +1,200 @@
+# ct_db.py
+
+import threading
+import time
+
+import psycopg2
+
+from . import ct_metrics
+from .ct_helpers import load_db_credentials, get_paused_window
+from .ct_profile import traced
+
+
+#### Database functions
+
+# Shared by every query of the process, see get_psycopg2_connection
+PSYCOPG2_CONNECTION = None
+
+
+def create_sqlalchemy_engine():
+    """
+    Used by ct_score_report.
+
+    SQLAlchemy is only imported here as no other script needs it.
+    """
+    from sqlalchemy import create_engine
+
+    PGUSER, PGPASSWD, PGHOST, PGPORT, PGDB = load_db_credentials()
+    engine_string = f"postgresql://{PGUSER}:{PGPASSWD}@{PGHOST}:{PGPORT}/{PGDB}"
+    return create_engine(engine_string)
+
+
+def create_psycopg2_connection():
+    """
+    Used by get_psycopg2_connection.
+
+    Connect to PostgreSQL with credentials from the environment.
+    """
+    PGUSER, PGPASSWD, PGHOST, PGPORT, PGDB = load_db_credentials()
+    return psycopg2.connect(
+        database=PGDB,
+        user=PGUSER,
+        password=PGPASSWD,
+        host=PGHOST,
+        port=PGPORT,
+    )
+
+
+def get_psycopg2_connection():
+    """
+    Used by functions in ct_tl.
+
+    Return the process-wide PostgreSQL connection, connecting on first use and
+    reconnecting if the connection was closed.  Use as "with connection:" to
+    commit or roll back a transaction without closing the connection.
+    """
+    global PSYCOPG2_CONNECTION
+
+    if PSYCOPG2_CONNECTION is None or PSYCOPG2_CONNECTION.closed:
+        PSYCOPG2_CONNECTION = create_psycopg2_connection()
+
+    return PSYCOPG2_CONNECTION
+
+
+def create_load_watermarks_table(cursor):
+    """
+    Used by ct_tl.insert_to_postgres and ct_reload.
+
+    load_watermarks records when rows of posts of each posting day were last
+    loaded, so cached reports of a window are invalidated by new loads.
+    """
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS load_watermarks ("
+        "posting_day DATE PRIMARY KEY, loaded_at TIMESTAMPTZ NOT NULL)"
+    )
+
+
+#### Sliding window
+
+
+class SQLSlidingWindowRateLimiter:
+    """
+    Used by ct_extract when the rate limiter is kept in PostgreSQL rather than
+    Redis, see ct_extract.create_rate_limiter.
+
+    Allow max_requests requests in any interval_seconds for key, shared by
+    every process and node using the same database.  The timestamps of the
+    requests in the window are kept in a single row of rate_limit_windows per
+    key and pruned on every request, so storage stays bounded.  Requests lock
+    the row, so concurrent processes are serialized.  Time is taken from the
+    database clock, so nodes need not have their clocks in sync.
+
+    Connects with db_params if given, or with credentials from the environment.
+    Has the acquire and close of ct_redis.PermitLease.
+    """
+
+    def __init__(self, max_requests, interval_seconds, db_params=None, key="default"):
+        self.max_requests = max_requests
+        self.interval_seconds = interval_seconds
+        self.key = key
+        # lock is held while waiting in acquire, connection_lock while querying
+        self.lock = threading.Lock()
+        self.connection_lock = threading.Lock()
+
+        if db_params is None:
+            self.connection = create_psycopg2_connection()
+        else:
+            self.connection = psycopg2.connect(**db_params)
+        self.create_table()
+
+    def create_table(self):
+        with self.connection, self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit_windows ("
+                "key TEXT PRIMARY KEY, "
+                "timestamps DOUBLE PRECISION[] NOT NULL DEFAULT '{}')"
+            )
+            cursor.execute(
+                "INSERT INTO rate_limit_windows (key) VALUES (%s) "
+                "ON CONFLICT (key) DO NOTHING",
+                (self.key,),
+            )
+
+    def try_acquire(self):
+        """
+        Take a request of the window if one is free.
+
+        Returns 0 if taken, otherwise the seconds until the oldest request of
+        the window leaves it.
+        """
+        with self.connection_lock, self.connection, self.connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT timestamps, extract(epoch FROM clock_timestamp())::float8 "
+                "FROM rate_limit_windows WHERE key = %s FOR UPDATE",
+                (self.key,),
+            )
+            timestamps, now = cursor.fetchone()
+
+            window = sorted(t for t in timestamps if t > now - self.interval_seconds)
+            if len(window) >= self.max_requests:
+                # Nothing to write, the row lock is released on commit
+                return window[-self.max_requests] + self.interval_seconds - now
+
+            window.append(now)
+            cursor.execute(
+                "UPDATE rate_limit_windows SET timestamps = %s WHERE key = %s",
+                (window, self.key),
+            )
+            return 0
+
+    def pause(self, seconds, slowdown=2):
+        """
+        Stop every process sharing key from requesting for seconds, then slow
+        them down for a while, see ct_helpers.get_paused_window.  Used when the
+        API throttles requests.
+        """
+        with self.connection_lock, self.connection, self.connection.cursor() as cursor:
+            cursor.execute("SELECT extract(epoch FROM clock_timestamp())::float8")
+            (now,) = cursor.fetchone()
+            window = get_paused_window(
+                now, self.max_requests, self.interval_seconds, seconds, slowdown
+            )
+            cursor.execute(
+                "UPDATE rate_limit_windows SET timestamps = %s WHERE key = %s",
+                (window, self.key),
+            )
+
+    def is_allowed(self):
+        """
+        Returns True if a request was taken, without waiting.
+        """
+        return self.try_acquire() == 0
+
+    @traced("rate_limit")
+    def acquire(self):
+        """
+        Return once a request is allowed, sleeping until a request of the
+        window is free if none are.
+        """
+        with self.lock:
+            while True:
+                wait_seconds = self.try_acquire()
+                if not wait_seconds:
+                    ct_metrics.increment(
+                        "ct_rate_limiter_requests_total", result="allowed"
+                    )
+                    return
+                ct_metrics.increment("ct_rate_limiter_requests_total", result="denied")
+                ct_metrics.increment(
+                    "ct_rate_limiter_sleep_seconds_total", wait_seconds
+                )
+                time.sleep(wait_seconds)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
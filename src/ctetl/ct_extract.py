@@ -1,27 +1,239 @@
 # ct_extract.py
 
+import hashlib
+import heapq
+import itertools
 import sys
 
 from datetime import datetime, timedelta, timezone
 import time
-from time import sleep
 
 from minio.error import S3Error
 
-from .ct_helpers import create_redis_client, allow_request
-from .ct_helpers import get_minio_object_names, request_with_backoff
-from .ct_helpers import minio_put_text_object
-from .ct_helpers import get_minio_response_js, isoformat_to_seconds
+from .ct_helpers import isoformat_to_seconds, get_api_base_url
+from .ct_helpers import get_rate_limiter_backend
+from .ct_minio import get_latest_object_name, minio_put_text_object
+from .ct_minio import get_minio_response_js, get_object_basename
+from .ct_minio import get_partitioned_object_name
+from .ct_redis import create_redis_client, allow_request, PermitLease
+from .ct_redis import publish_platform_ids
+from .ct_redis import read_platform_ids, reclaim_platform_ids
+from .ct_redis import acknowledge_platform_id, pause_rate_limit
+from .ct_web import request_with_backoff, get_endpoint_health
+from .ct_web import REJECTED, THROTTLED
+from .ct_profile import traced
+
+
+### Rate limiting of CrowdTangle requests
+
+# CrowdTangle's limit is 6 requests in 60 seconds
+RATE_LIMIT = 6
+TIME_LIMIT = 60
+
+
+def wait_for_rate_limit(redis_client, redis_key, rate_limiter=None):
+    """
+    Used by request_when_healthy.
+
+    Return once a request to CrowdTangle is allowed.  If rate_limiter (see
+    create_rate_limiter) is given, the request is allowed by it.  Otherwise
+    allow_request is checked on every call.
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+        return
+
+    allowed = False
+    while not allowed:
+        # Keep looping until allowed by the rate limiter
+        allowed = allow_request(redis_client, redis_key, RATE_LIMIT, TIME_LIMIT)
+
+
+def create_rate_limiter(redis_client, ct_key, lease_permits=0):
+    """
+    Used by the scripts that request from CrowdTangle and ct_daemon.
+
+    Return the rate_limiter of wait_for_rate_limit, with the same rate limit
+    as allow_request, or None to use allow_request.  Close it when done.
+
+    If get_rate_limiter_backend is 'postgres', a
+    ct_db.SQLSlidingWindowRateLimiter and redis_client isn't needed.  The
+    API key is stored hashed.  Otherwise a ct_redis.PermitLease leasing
+    lease_permits permits at a time, if lease_permits is given.
+    """
+    if get_rate_limiter_backend() == "postgres":
+        # Imported here so the extract scripts don't import psycopg2 with Redis
+        from .ct_db import SQLSlidingWindowRateLimiter
+
+        key = hashlib.sha256(ct_key.encode()).hexdigest()
+        return SQLSlidingWindowRateLimiter(RATE_LIMIT, TIME_LIMIT, key=key)
+    if lease_permits:
+        return PermitLease(redis_client, ct_key, RATE_LIMIT, TIME_LIMIT, lease_permits)
+    return None
+
+
+def pause_requests(redis_client, redis_key, rate_limiter, seconds):
+    """
+    Used by request_when_healthy.
+
+    Pause the requests of every process sharing the rate limit for seconds,
+    then let them resume at a lower rate, see ct_redis.pause_rate_limit.
+    """
+    if rate_limiter is not None:
+        rate_limiter.pause(seconds)
+    else:
+        pause_rate_limit(redis_client, redis_key, RATE_LIMIT, TIME_LIMIT, seconds)
+
+
+def request_when_healthy(
+    url,
+    request_headers,
+    redis_client,
+    redis_key,
+    rate_limiter=None,
+    max_pause_seconds=3600,
+):
+    """
+    Used by get_and_save_ct_post_aggregates and fetch_and_upload_post_details.
+
+    Request url from CrowdTangle once allowed by the rate limiter, see
+    wait_for_rate_limit.  Rather than failing, a throttled (429) request
+    pauses every process sharing the rate limit for the Retry-After of
+    CrowdTangle, or a whole window without one, and is retried.  Requests to
+    an endpoint whose circuit breaker is open wait until it lets a trial
+    request through, see ct_web.EndpointHealth.
+
+    Returns the response, or None if the request was rejected or requests
+    were paused for longer than max_pause_seconds in total.
+    """
+    health = get_endpoint_health(url)
+    paused_seconds = 0
+
+    while True:
+        wait_seconds = health.wait_seconds()
+        if not wait_seconds:
+            wait_for_rate_limit(redis_client, redis_key, rate_limiter)
+            request_response = request_with_backoff(url, request_headers)
+            if request_response is not None:
+                return request_response
+            if health.last_failure == REJECTED:
+                return None
+            if health.last_failure != THROTTLED:
+                # Unavailable.  Retry until the circuit breaker opens.
+                continue
+
+            wait_seconds = health.retry_after
+            if wait_seconds is None:
+                wait_seconds = TIME_LIMIT
+            print(
+                f"Throttled by CrowdTangle, pausing requests for {wait_seconds:.0f}s."
+            )
+            pause_requests(redis_client, redis_key, rate_limiter, wait_seconds)
+            # The rate limiter waits out the pause
+            paused_seconds += wait_seconds
+        else:
+            print(
+                f"Endpoint {health.endpoint} is unavailable, "
+                f"pausing requests for {wait_seconds:.0f}s."
+            )
+            time.sleep(wait_seconds)
+            paused_seconds += wait_seconds
+
+        if paused_seconds > max_pause_seconds:
+            print(
+                f"Giving up on {health.endpoint} after pausing for "
+                f"{paused_seconds:.0f}s."
+            )
+            return None
 
 
 ### Functions of ct_bundled_posts_to_minio
+def extract_post_aggregates(
+    request_headers,
+    ct_key,
+    redis_client,
+    minio_client,
+    posts_bucket,
+    details_stream,
+    rate_limiter=None,
+    uploader=None,
+):
+    """
+    Used by ct_bundled_posts_to_minio and ct_daemon.
+
+    Get the next window of bundled posts from CrowdTangle, page by page, and save
+    each page to posts_bucket.  The platformIds of saved posts are published to
+    details_stream for ct_post_details_from_stream, unless redis_client is None
+    as Redis isn't used.  See wait_for_rate_limit for rate_limiter.  If
+    uploader, a ct_minio.BackgroundUploader, is given, pages are saved in the
+    background and waited for before returning.
+
+    Returns False if it is too early to get the next window, True otherwise.
+
+    """
+    redis_key = ct_key
+
+    # Determine start and end times of bundled posts to get from CrowdTangle.
+    # Also 'get' now to save as part of with object name
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    start, end = get_initial_start_and_end(now, minio_client, posts_bucket)
+    if start is None:
+        return False
+
+    # Convert times to string format compatible with API call
+    # requirements and object naming
+    start_str, end_str, as_of = isoformat_to_seconds(start, end, now)
+
+    # Set page counter in case request returns multiple pages
+    page = 1
+
+    # Set initial URL to the first page.
+    # URL of any subsequent pages are determined from the response(s)
+    url = f"{get_api_base_url()}/posts?token={ct_key}&sortBy=date&endDate={end_str}&startDate={start_str}&count=100"
+
+    while url:
+        request_response = get_and_save_ct_post_aggregates(
+            url,
+            request_headers,
+            minio_client,
+            posts_bucket,
+            as_of,
+            end_str,
+            start_str,
+            page,
+            redis_client,
+            redis_key,
+            rate_limiter,
+            uploader,
+        )
+
+        # Queue the posts of this page for detail fetching
+        if redis_client is not None:
+            publish_platform_ids(
+                redis_client, details_stream, get_post_platform_ids(request_response)
+            )
+
+        page += 1
+
+        # Find subsequent page if it exists, else empty url exits the loop
+        url = get_posts_next_page_url(request_response)
+
+    # The window is only done once its last page is saved
+    if uploader is not None:
+        uploader.wait()
+
+    return True
+
+
 def get_initial_start_and_end(now, minio_client, posts_bucket):
     """
-    Used by ct_bundled_posts_to_minio.
+    Used by extract_post_aggregates.
 
     Start from maiden start if posts_bucket is empty.  Otherwise, start from
     end of latest post in posts_bucket.
 
+    Returns None, None if it is too early to get the next window.
+
     """
 
     # Define chosen maiden start in case posts_bucket is empty
@@ -48,10 +260,10 @@ def get_initial_start_and_end(now, minio_client, posts_bucket):
     # the latest post in posts_bucket
     start = set_start(minio_client, posts_bucket, MAIDEN_START_STR)
 
-    # Exit this run normally if start > start_limit
+    # Skip this run if start > start_limit
     if start > start_limit:
         print("Too early to get new post data!")
-        sys.exit(0)
+        return None, None
 
     end = start + TIME_WINDOW
 
@@ -69,15 +281,15 @@ def set_start(minio_client, posts_bucket, MAIDEN_START_STR):
 
     """
 
-    post_object_names = get_minio_object_names(minio_client, posts_bucket)
+    latest_post_object_name = get_latest_object_name(minio_client, posts_bucket)
 
-    if post_object_names:
-        post_object_names.sort()
-        # Get end timestamp from last element of the sorted post_obj_names.
+    if latest_post_object_name:
+        # Get end timestamp from the latest post object.
         # End timestamp index position is dependent on object naming convention
         # of ct_bundled_posts_to_minio!
         start = datetime.strptime(
-            post_object_names[-1].split("_")[1], "%Y-%m-%dT%H:%M:%S"
+            get_object_basename(latest_post_object_name).split("_")[1],
+            "%Y-%m-%dT%H:%M:%S",
         )
     else:
         start = datetime.strptime(MAIDEN_START_STR, "%Y-%m-%d %H:%M:%S")
@@ -86,16 +298,31 @@ def set_start(minio_client, posts_bucket, MAIDEN_START_STR):
 
 
 def get_and_save_ct_post_aggregates(
-    url, REQUEST_HEADERS, minio_client, posts_bucket, as_of, end_str, start_str, page
+    url,
+    REQUEST_HEADERS,
+    minio_client,
+    posts_bucket,
+    as_of,
+    end_str,
+    start_str,
+    page,
+    redis_client,
+    redis_key,
+    rate_limiter=None,
+    uploader=None,
 ):
     """
     Used by ct_bundled_posts_to_minio.
 
-    Get bundled posts data from CrowdTangle and save to posts_bucket.
+    Get bundled posts data from CrowdTangle and save to posts_bucket, in the
+    background if uploader is given.  See request_when_healthy for the rate
+    limiting arguments.
 
     """
 
-    request_response = request_with_backoff(url, REQUEST_HEADERS)
+    request_response = request_when_healthy(
+        url, REQUEST_HEADERS, redis_client, redis_key, rate_limiter
+    )
 
     if request_response is None:
         # request_with_backoff prints the error message.
@@ -103,9 +330,15 @@ def get_and_save_ct_post_aggregates(
     else:
         # Naming convention important in determining start times with set_start
         # Use caution if modifying!
-        post_object_name = (
-            as_of + "_" + end_str + "_" + start_str + "_" + str(page) + ".txt"
+        post_object_name = get_partitioned_object_name(
+            as_of + "_" + end_str + "_" + start_str + "_" + str(page) + ".txt", as_of
         )
+        if uploader is not None:
+            # set_start takes the latest saved page as the end of the saved
+            # windows, so the previous page must be saved before this one
+            uploader.wait()
+            uploader.put(posts_bucket, post_object_name, request_response.content)
+            return request_response
         try:
             minio_put_text_object(
                 minio_client, posts_bucket, post_object_name, request_response
@@ -131,6 +364,18 @@ def get_posts_next_page_url(request_response):
         return None
 
 
+def get_post_platform_ids(request_response):
+    """
+    Used by ct_bundled_posts_to_minio.
+
+    Return the platformId of every post in a bundled posts response.
+
+    """
+
+    request_response_js = request_response.json()
+    return [post["platformId"] for post in request_response_js["result"]["posts"]]
+
+
 ### Functions of ct_post_details_to_minio.
 
 
@@ -143,6 +388,10 @@ def process_post_object(
     posts_bucket,
     details_bucket,
     post_object_name,
+    details_batcher=None,
+    redis_client=None,
+    rate_limiter=None,
+    uploader=None,
 ):
     """
     Used by ct_post_details_to_minio.
@@ -167,9 +416,14 @@ def process_post_object(
             details_bucket,
             post_object_name,
             minio_response_js,
+            details_batcher,
+            redis_client,
+            rate_limiter,
+            uploader,
         )
 
 
+@traced("post_object")
 def get_and_save_post_details(
     tags,
     num_calls,
@@ -180,6 +434,10 @@ def get_and_save_post_details(
     details_bucket,
     post_object_name,
     minio_response_js,
+    details_batcher=None,
+    redis_client=None,
+    rate_limiter=None,
+    uploader=None,
 ):
     """
     Used by ct_post_details_to_minio.
@@ -188,46 +446,117 @@ def get_and_save_post_details(
     that request_headers and ct_key are defined globally. Call downstream process.  Tag
     the aggregate post object as processed once all post details of the aggregate
     are uploaded.
+
+    If details_batcher (a ct_tl.PostDetailsBatcher) is given, post details are
+    also loaded to PostgreSQL without being read back from MinIO.
+
+    A Redis client is created for the rate limiter unless redis_client or
+    rate_limiter is given.  See wait_for_rate_limit for rate_limiter.
+
+    If uploader, a ct_minio.BackgroundUploader, is given, post details are
+    uploaded in the background and waited for before tagging.
     """
 
-    redis_client = create_redis_client()
-    redis_key = ct_key
+    if redis_client is None and rate_limiter is None:
+        redis_client = create_redis_client()
 
     # Post details are uniquely identified by platformId
     # Number of posts in minio_response_js is half the count of platformId
     for i in range(str(minio_response_js).count("platformId") // 2):
         platform_id = minio_response_js["result"]["posts"][i]["platformId"]
 
-        # URL for specific posts
-        url = f"https://api.crowdtangle.com/post/{platform_id}?token={ct_key}&includeHistory=True"
-        allowed = False
-        while not allowed:
-            # Keep looping until allowed by the rate limiter
-            # CrowdTangle's limit is 6 requests in 60 seconds
-            allowed = allow_request(redis_client, redis_key, 6, 60)
-        request_response = request_with_backoff(url, request_headers)
+        fetch_and_upload_post_details(
+            request_headers,
+            ct_key,
+            redis_client,
+            minio_client,
+            details_bucket,
+            platform_id,
+            details_batcher,
+            rate_limiter,
+            uploader,
+        )
 
-        if request_response is None:
-            sys.exit(1)
-        else:
-            upload_post_details(
-                minio_client, details_bucket, platform_id, request_response
-            )
+    # Post details must be uploaded before post_object is tagged
+    if details_batcher is not None:
+        details_batcher.flush()
+    if uploader is not None:
+        uploader.wait()
 
     # Tag post_object after processing to prevent reprocessing
     minio_client.set_object_tags(posts_bucket, post_object_name, tags)
 
 
-def upload_post_details(minio_client, details_bucket, platform_id, request_response):
+@traced("post_details")
+def fetch_and_upload_post_details(
+    request_headers,
+    ct_key,
+    redis_client,
+    minio_client,
+    details_bucket,
+    platform_id,
+    details_batcher=None,
+    rate_limiter=None,
+    uploader=None,
+):
     """
-    Used by ct_post_details_to_minio.
+    Used by ct_post_details_to_minio and ct_post_details_from_stream.
+
+    Request details of a single post from CrowdTangle, waiting on the rate
+    limiter first, and upload them to details_bucket, in the background if
+    uploader is given.  If details_batcher is given, hand the details to it
+    instead, which uploads them in the background and loads them to
+    PostgreSQL.  See wait_for_rate_limit for rate_limiter.
+    """
+    redis_key = ct_key
+
+    # URL for specific posts
+    url = f"{get_api_base_url()}/post/{platform_id}?token={ct_key}&includeHistory=True"
+    request_response = request_when_healthy(
+        url, request_headers, redis_client, redis_key, rate_limiter
+    )
+
+    if request_response is None:
+        sys.exit(1)
+    elif details_batcher is not None:
+        details_batcher.add(
+            request_response.content,
+            get_details_object_name(platform_id),
+            request_response,
+        )
+    else:
+        upload_post_details(
+            minio_client, details_bucket, platform_id, request_response, uploader
+        )
+
 
-    Upload post details to MinIO bucket.
+def get_details_object_name(platform_id):
+    """
+    Used by fetch_and_upload_post_details and upload_post_details.
+
+    Name post details objects after platform_id and the time of fetching, in
+    the partition of the time of fetching.
+    ct_tl.transform_post_details depends on this naming convention!
     """
     # as_of will form part of the name of the post_details object
     now = datetime.now(timezone.utc).replace(tzinfo=None)
     as_of = isoformat_to_seconds(now)
-    details_object_name = f"{platform_id}_{as_of}_.txt"
+    return get_partitioned_object_name(f"{platform_id}_{as_of}_.txt", as_of)
+
+
+def upload_post_details(
+    minio_client, details_bucket, platform_id, request_response, uploader=None
+):
+    """
+    Used by ct_post_details_to_minio.
+
+    Upload post details to MinIO bucket, or queue them on uploader.
+    """
+    details_object_name = get_details_object_name(platform_id)
+
+    if uploader is not None:
+        uploader.put(details_bucket, details_object_name, request_response.content)
+        return
 
     try:
         minio_put_text_object(
@@ -236,3 +565,227 @@ def upload_post_details(minio_client, details_bucket, platform_id, request_respo
     except S3Error as e:
         print(f"S3 Error putting object:{e}")
         sys.exit(1)
+
+
+### Scheduling of post details fetches
+
+# Orders in which post details are fetched, see get_fetch_priority
+FETCH_SCHEDULES = ("fifo", "freshest", "report-window")
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def get_fetch_priority(schedule, posting_date, window_start, window_end):
+    """
+    Used by PostDetailsScheduler.
+
+    Return the sort key of a post posted at posting_date, lowest first, for
+    schedule.  window_start and window_end are the posting dates of the
+    report, see ct_reporting.create_score_report.
+
+    fifo: the order of post objects and their posts, as listed.
+    freshest: the most recently posted first.
+    report-window: posts of the report window first, the closest to leaving
+    it first.  Then posts yet to enter it, the closest first, and last those
+    that left it, the most recent first.
+    """
+    if schedule == "fifo":
+        return (0, 0)
+
+    seconds = (posting_date - EPOCH).total_seconds()
+    if schedule == "freshest":
+        return (0, -seconds)
+    if posting_date < window_start:
+        return (2, -seconds)
+    if posting_date <= window_end:
+        return (0, seconds)
+    return (1, seconds)
+
+
+class PostDetailsScheduler:
+    """
+    Used by ct_post_details_to_minio.
+
+    Priority queue of the posts whose details are to be fetched, in the order
+    of schedule, one of FETCH_SCHEDULES.  The report window is from
+    report_start_hours to report_end_hours before now.  Posts are added a post
+    object at a time, and popped across post objects.
+    """
+
+    def __init__(self, schedule="fifo", report_start_hours=96, report_end_hours=72):
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.schedule = schedule
+        self.window_start = now - timedelta(hours=report_start_hours)
+        self.window_end = now - timedelta(hours=report_end_hours)
+        self.heap = []
+        # Breaks ties in the order posts were added
+        self.counter = itertools.count()
+        self.remaining_posts = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def add(self, post_object_name, posts):
+        """
+        Add posts, the posts of a bundled posts response, of post_object_name.
+        """
+        for post in posts:
+            priority = get_fetch_priority(
+                self.schedule,
+                datetime.fromisoformat(post["date"]),
+                self.window_start,
+                self.window_end,
+            )
+            heapq.heappush(
+                self.heap,
+                (priority, next(self.counter), post["platformId"], post_object_name),
+            )
+        self.remaining_posts[post_object_name] = self.remaining_posts.get(
+            post_object_name, 0
+        ) + len(posts)
+
+    def pop(self):
+        """
+        Return (platform_id, post_object_name) of the next post to fetch.
+        """
+        _, _, platform_id, post_object_name = heapq.heappop(self.heap)
+        return platform_id, post_object_name
+
+    def done(self, post_object_name):
+        """
+        Record the details of a post of post_object_name as fetched.
+
+        Returns True once those of all its posts are.
+        """
+        self.remaining_posts[post_object_name] -= 1
+        if self.remaining_posts[post_object_name]:
+            return False
+        del self.remaining_posts[post_object_name]
+        return True
+
+
+def process_post_objects(
+    tags,
+    request_headers,
+    ct_key,
+    minio_client,
+    posts_bucket,
+    details_bucket,
+    post_object_names,
+    scheduler,
+    details_batcher=None,
+    redis_client=None,
+    rate_limiter=None,
+    uploader=None,
+):
+    """
+    Used by ct_post_details_to_minio.
+
+    Fetch the details of the posts of every untagged post object of
+    post_object_names in the order of scheduler, a PostDetailsScheduler,
+    rather than a post object at a time as process_post_object does.  A post
+    object is tagged once the details of all its posts are uploaded.  Unless
+    the schedule is fifo, the posts of many post objects are interleaved, so
+    a run that is stopped leaves more post objects to be fetched again.
+
+    details_batcher, redis_client, rate_limiter and uploader are as for
+    get_and_save_post_details.
+    """
+    if redis_client is None and rate_limiter is None:
+        redis_client = create_redis_client()
+
+    for post_object_name in post_object_names:
+        if minio_client.get_object_tags(posts_bucket, post_object_name):
+            continue
+        minio_response_js = get_minio_response_js(
+            post_object_name, posts_bucket, minio_client
+        )
+        posts = minio_response_js["result"].get("posts", [])
+        if posts:
+            scheduler.add(post_object_name, posts)
+        else:
+            minio_client.set_object_tags(posts_bucket, post_object_name, tags)
+
+    while scheduler:
+        platform_id, post_object_name = scheduler.pop()
+        fetch_and_upload_post_details(
+            request_headers,
+            ct_key,
+            redis_client,
+            minio_client,
+            details_bucket,
+            platform_id,
+            details_batcher,
+            rate_limiter,
+            uploader,
+        )
+        if not scheduler.done(post_object_name):
+            continue
+
+        # Post details must be uploaded before post_object is tagged
+        if details_batcher is not None:
+            details_batcher.flush()
+        if uploader is not None:
+            uploader.wait()
+        minio_client.set_object_tags(posts_bucket, post_object_name, tags)
+
+
+### Functions of ct_post_details_from_stream.
+
+
+def process_details_stream(
+    request_headers,
+    ct_key,
+    redis_client,
+    minio_client,
+    details_bucket,
+    stream,
+    group,
+    consumer,
+    min_idle_ms=600000,
+    details_batcher=None,
+    rate_limiter=None,
+    uploader=None,
+):
+    """
+    Used by ct_post_details_from_stream.
+
+    Fetch post details for platformIds published to stream by
+    ct_bundled_posts_to_minio.  Entries abandoned by other consumers for longer
+    than min_idle_ms are reclaimed first.  Each entry is acknowledged only after
+    its details are uploaded, so an entry is never lost if a consumer dies.
+    details_batcher, rate_limiter and uploader are as for
+    get_and_save_post_details.
+
+    Returns once no pending or new entries are left.
+    """
+    while True:
+        entries = reclaim_platform_ids(
+            redis_client, stream, group, consumer, min_idle_ms
+        )
+        if not entries:
+            entries = read_platform_ids(redis_client, stream, group, consumer)
+        if not entries:
+            break
+
+        for _, platform_id in entries:
+            fetch_and_upload_post_details(
+                request_headers,
+                ct_key,
+                redis_client,
+                minio_client,
+                details_bucket,
+                platform_id,
+                details_batcher,
+                rate_limiter,
+                uploader,
+            )
+
+        # Post details must be uploaded before entries are acknowledged
+        if details_batcher is not None:
+            details_batcher.flush()
+        if uploader is not None:
+            uploader.wait()
+
+        for entry_id, _ in entries:
+            acknowledge_platform_id(redis_client, stream, group, entry_id)
@@ -0,0 +1,211 @@
+# ct_metrics.py
+
+import atexit
+import os
+import socket
+import sys
+import threading
+
+
+### Pipeline metrics
+#
+# Metrics are only collected if at least one output is configured in the
+# environment.  Otherwise every function returns after a single check.
+#
+#   CT_METRICS_TEXTFILE_DIR  Directory of the node_exporter textfile collector.
+#                            Each script writes <script name>.prom on exit.
+#   CT_METRICS_PUSHGATEWAY   Prometheus Pushgateway URL.  Each script pushes its
+#                            metrics on exit with the script name as job.
+#   CT_METRICS_STATSD        host:port of a StatsD server.  Metrics are sent as
+#                            they are recorded, with DogStatsD style tags.
+#   CT_METRICS_FLUSH_INTERVAL  Seconds between writes to the textfile collector
+#                            and Pushgateway while a script runs (default 60),
+#                            so long-running scripts publish metrics before
+#                            they exit and little is lost if they are killed.
+
+# Upper bounds of histogram buckets in seconds
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRICS_TEXTFILE_DIR = os.environ.get("CT_METRICS_TEXTFILE_DIR")
+METRICS_PUSHGATEWAY = os.environ.get("CT_METRICS_PUSHGATEWAY")
+METRICS_STATSD = os.environ.get("CT_METRICS_STATSD")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("CT_METRICS_FLUSH_INTERVAL", 60))
+
+METRICS_ENABLED = bool(METRICS_TEXTFILE_DIR or METRICS_PUSHGATEWAY or METRICS_STATSD)
+
+# {(name, labels): value} and {(name, labels): [bucket counts..., sum, count]}
+counters = {}
+histograms = {}
+metrics_lock = threading.Lock()
+# Serializes writes of the periodic flush and the flush at exit
+write_lock = threading.Lock()
+
+statsd_socket = None
+statsd_address = None
+
+
+def increment(name, value=1, **labels):
+    """
+    Add value to counter name.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+    send_statsd(name, value, "c", labels)
+
+
+def observe(name, seconds, **labels):
+    """
+    Record a duration of seconds in histogram name.
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        histogram = histograms.setdefault(key, [0] * (len(HISTOGRAM_BUCKETS) + 2))
+        for i, bucket in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bucket:
+                histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    send_statsd(name, seconds * 1000, "ms", labels)
+
+
+def send_statsd(name, value, metric_type, labels):
+    """
+    Used by increment and observe.
+
+    Send one metric to StatsD if configured.  Errors are ignored, metrics must
+    never break the pipeline.
+    """
+    global statsd_socket, statsd_address
+
+    if not METRICS_STATSD:
+        return
+    if statsd_socket is None:
+        host, port = METRICS_STATSD.rsplit(":", 1)
+        statsd_address = (host, int(port))
+        statsd_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    message = f"{name}:{value:g}|{metric_type}"
+    if labels:
+        message += "|#" + ",".join(f"{k}:{v}" for k, v in sorted(labels.items()))
+    try:
+        statsd_socket.sendto(message.encode(), statsd_address)
+    except OSError:
+        pass
+
+
+def format_labels(labels, extra=()):
+    """
+    Used by format_prometheus_text.
+    """
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def format_prometheus_text():
+    """
+    Return all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with metrics_lock:
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{format_labels(labels)} {value:g}")
+
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                for bucket, count in zip(HISTOGRAM_BUCKETS, histogram):
+                    le = format_labels(labels, [("le", f"{bucket:g}")])
+                    lines.append(f"{name}_bucket{le} {count}")
+                le = format_labels(labels, [("le", "+Inf")])
+                lines.append(f"{name}_bucket{le} {histogram[-1]}")
+                lines.append(f"{name}_sum{format_labels(labels)} {histogram[-2]:g}")
+                lines.append(f"{name}_count{format_labels(labels)} {histogram[-1]}")
+
+    return "\n".join(lines) + "\n"
+
+
+def get_job_name():
+    """
+    Name metrics of a run after the script, e.g. ct_transform_and_load.
+    """
+    return os.path.splitext(os.path.basename(sys.argv[0]))[0] or "ct"
+
+
+def write_metrics():
+    """
+    Write metrics to the textfile collector directory and Pushgateway if
+    configured.  Run every METRICS_FLUSH_INTERVAL seconds and at exit.
+    """
+    if not (METRICS_TEXTFILE_DIR or METRICS_PUSHGATEWAY):
+        return
+
+    with write_lock:
+        write_metrics_text(format_prometheus_text())
+
+
+def write_metrics_text(text):
+    """
+    Used by write_metrics.
+    """
+    job_name = get_job_name()
+
+    if METRICS_TEXTFILE_DIR:
+        # Write then rename so the collector never reads a partial file
+        path = os.path.join(METRICS_TEXTFILE_DIR, f"{job_name}.prom")
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+    if METRICS_PUSHGATEWAY:
+        import requests
+
+        url = f"{METRICS_PUSHGATEWAY.rstrip('/')}/metrics/job/{job_name}"
+        try:
+            requests.put(url, data=text.encode(), timeout=10)
+        except requests.exceptions.RequestException as e:
+            print(f"Error pushing metrics: {e}")
+
+
+def flush_metrics_periodically(stop_event, interval):
+    """
+    Used by start_metrics_flush.
+    """
+    while not stop_event.wait(interval):
+        write_metrics()
+
+
+def start_metrics_flush(interval=METRICS_FLUSH_INTERVAL):
+    """
+    Write metrics every interval seconds in a daemon thread, which never keeps
+    a script from exiting.  Returns an event that stops the thread when set.
+    """
+    stop_event = threading.Event()
+    threading.Thread(
+        target=flush_metrics_periodically,
+        args=(stop_event, interval),
+        name="ct-metrics-flush",
+        daemon=True,
+    ).start()
+    return stop_event
+
+
+if METRICS_ENABLED:
+    # The flush at exit is the final write
+    atexit.register(write_metrics)
+    if (METRICS_TEXTFILE_DIR or METRICS_PUSHGATEWAY) and METRICS_FLUSH_INTERVAL > 0:
+        start_metrics_flush()
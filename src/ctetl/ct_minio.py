@@ -0,0 +1,382 @@
+# ct_minio.py
+
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from minio import Minio
+from minio.commonconfig import Tags
+from minio.error import MinioException, S3Error
+from urllib3.exceptions import HTTPError
+
+from . import ct_metrics
+from .ct_profile import span, traced
+
+
+### MinIO functions
+
+
+def create_minio_client():
+    """
+    Used by ct_bundled_posts_to_minio and ct_post_details_to_minio.
+
+    Create MinIO client from access and secret key.
+
+    """
+    # Load values of MinIO parameters from environment
+    MINIO_HOST = os.environ.get("MINIO_HOST")
+    MINIO_ACCESS = os.environ.get("MINIO_ACCESS")
+    MINIO_SECRET = os.environ.get("MINIO_SECRET")
+
+    if any(P is None for P in (MINIO_HOST, MINIO_ACCESS, MINIO_SECRET)):
+        print(
+            "At least one of the MinIO parameters is empty.  Are they defined in the environment?"
+        )
+        sys.exit(1)
+    else:
+        # Modify 'secure' to your configuration
+        return Minio(MINIO_HOST, MINIO_ACCESS, MINIO_SECRET, secure=False)
+
+
+def check_minio_buckets(minio_client, *buckets):
+    """
+    Used by ct_bundled_posts_to_minio and ct_post_details_to_minio.
+
+    Find buckets otherwise exit. Buckets entered as individual arguments.
+
+    """
+    for bucket in buckets:
+        # Proceed only if the bucket exists
+        found = minio_client.bucket_exists(bucket)
+        if not found:
+            print(f"Cannot find bucket '{bucket}', exiting.")
+            # Exit if any bucket not found
+            sys.exit(1)
+
+
+def create_minio_tags():
+    """
+    Used by ct_post_details_to_minio and ct_transform_and_load.
+
+    Prepare tags to tag objects to keep from processing more than once.
+    Using "processed" as a tag but modify as desired:
+    ct_post_details_to_minio and ct_transform_and_load only check for presence of a tags,
+    not the content of the actual tag.
+
+    """
+
+    tags = Tags.new_object_tags()
+    tags["processed"] = "true"
+
+    return tags
+
+
+# Objects are saved under OBJECT_LAYOUT/YYYY/MM/DD/HH/ of the time they were
+# fetched, e.g. v2/2023/12/13/05/.  Objects of the previous layout are saved
+# at the root of the bucket with the same name and are still read.
+OBJECT_LAYOUT = "v2"
+
+
+def get_partition_prefix(as_of):
+    """
+    Used by get_partitioned_object_name and get_minio_object_names.
+
+    Return the prefix of the hourly partition of as_of, a datetime or a
+    string in the '%Y-%m-%dT%H:%M:%S' format of isoformat_to_seconds.  Raises
+    ValueError if as_of is a string in another format.
+    """
+    if isinstance(as_of, str):
+        as_of = datetime.strptime(as_of, "%Y-%m-%dT%H:%M:%S")
+    return f"{OBJECT_LAYOUT}/{as_of:%Y/%m/%d/%H}/"
+
+
+def get_partitioned_object_name(object_name, as_of):
+    """
+    Used by ct_extract and ct_migrate_object_names.
+
+    Return object_name in the hourly partition of as_of.
+    """
+    return get_partition_prefix(as_of) + object_name
+
+
+def get_object_basename(object_name):
+    """
+    Return object_name without its partition prefix.  Names of objects of
+    the previous layout are returned unchanged.
+    """
+    return object_name.rsplit("/", 1)[-1]
+
+
+def get_legacy_object_names(minio_client, bucket):
+    """
+    Used by get_minio_object_names, get_latest_object_name and
+    ct_migrate_object_names.
+
+    Get names of objects of the previous layout, saved at the root of bucket.
+    """
+    return [
+        obj.object_name
+        for obj in minio_client.list_objects(bucket)
+        if not obj.is_dir
+    ]
+
+
+def get_minio_object_names(minio_client, bucket, since_hours=None):
+    """
+    Used by ct_bundled_posts_to_minio, ct_post_details_to_minio,
+    and ct_transform_and_load.
+
+    Get all object names in the MinIO bucket.  If since_hours is given, only
+    partitions of the last since_hours hours are listed, along with any
+    objects of the previous layout not yet migrated.
+    """
+    if not since_hours:
+        return [
+            obj.object_name
+            for obj in minio_client.list_objects(bucket, recursive=True)
+        ]
+
+    object_names = get_legacy_object_names(minio_client, bucket)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    for hours in range(since_hours, -1, -1):
+        prefix = get_partition_prefix(now - timedelta(hours=hours))
+        object_names.extend(
+            obj.object_name
+            for obj in minio_client.list_objects(bucket, prefix=prefix, recursive=True)
+        )
+    return object_names
+
+
+def add_since_hours_argument(parser):
+    """
+    Used by ct_post_details_to_minio, ct_transform_and_load and ct_daemon.
+
+    Add --since-hours to an argparse parser, see get_minio_object_names.  The
+    whole bucket is listed by default, as objects left untagged in older
+    partitions, e.g. after an outage, would otherwise never be processed.
+    """
+    parser.add_argument(
+        "--since-hours",
+        type=int,
+        default=0,
+        help="Only list objects saved in the last this many hours, skipping "
+        "older untagged objects (default: 0, list the whole bucket).",
+    )
+
+
+def get_latest_object_name(minio_client, bucket):
+    """
+    Used by ct_bundled_posts_to_minio.
+
+    Get the name of the latest object in bucket by the time it was fetched,
+    or None if bucket is empty.  Only the latest partition at each level is
+    listed, so the cost does not grow with the size of the bucket.  Objects
+    of the previous layout are only considered if there are no others.
+    """
+    prefix = f"{OBJECT_LAYOUT}/"
+    # Walk down YYYY/, MM/, DD/, HH/ taking the latest at each level
+    for _ in range(4):
+        partitions = [
+            obj.object_name
+            for obj in minio_client.list_objects(bucket, prefix=prefix)
+            if obj.is_dir
+        ]
+        if not partitions:
+            break
+        prefix = max(partitions)
+    else:
+        object_names = [
+            obj.object_name for obj in minio_client.list_objects(bucket, prefix=prefix)
+        ]
+        if object_names:
+            return max(object_names)
+
+    object_names = get_legacy_object_names(minio_client, bucket)
+    return max(object_names) if object_names else None
+
+
+def get_minio_object_data(object_name, bucket, client):
+    """
+    Used by get_minio_response_js, ct_tl.load_detail_objects and ct_reload.
+
+    Return the raw bytes of a MinIO object.
+    """
+    start = time.perf_counter()
+    try:
+        with span("minio_get", object_name=object_name):
+            with client.get_object(bucket, object_name) as minio_response:
+                data = minio_response.data
+    except S3Error as e:
+        print(f"S3 Error getting object: {e}")
+        ct_metrics.increment("ct_minio_errors_total", operation="get", bucket=bucket)
+        sys.exit(1)
+
+    ct_metrics.observe(
+        "ct_minio_seconds", time.perf_counter() - start, operation="get", bucket=bucket
+    )
+    ct_metrics.increment(
+        "ct_minio_bytes_total", len(data), operation="get", bucket=bucket
+    )
+
+    return data
+
+
+def get_minio_response_js(object_name, bucket, client):
+    """
+    Process a MinIO object.
+    """
+    data = get_minio_object_data(object_name, bucket, client)
+    with span("decode"):
+        return json.loads(data.decode())
+
+
+def put_minio_object_data(minio_client, bucket, object_name, data):
+    """
+    Used by minio_put_text_object and BackgroundUploader.
+
+    Save data, bytes, as object_name in bucket using minio_client.  Errors are
+    raised to the caller.
+    """
+    start = time.perf_counter()
+    try:
+        minio_client.put_object(
+            bucket_name=bucket,
+            object_name=object_name,
+            data=io.BytesIO(data),
+            length=len(data),
+            content_type="text/plain",
+        )
+    except (MinioException, HTTPError):
+        ct_metrics.increment("ct_minio_errors_total", operation="put", bucket=bucket)
+        raise
+
+    ct_metrics.observe(
+        "ct_minio_seconds", time.perf_counter() - start, operation="put", bucket=bucket
+    )
+    ct_metrics.increment(
+        "ct_minio_bytes_total", len(data), operation="put", bucket=bucket
+    )
+
+
+@traced("minio_put")
+def minio_put_text_object(minio_client, bucket, object_name, request_response):
+    """
+    Used by ct_bundled_posts_to_minio and ct_post_details_to_minio.
+
+    Save the body of request_response as object_name in bucket using
+    minio_client.  The body is saved as received, without decoding.
+    """
+    try:
+        put_minio_object_data(
+            minio_client, bucket, object_name, request_response.content
+        )
+    except S3Error as e:
+        print(f"S3 Error putting object: {e}")
+        sys.exit(1)
+
+
+class BackgroundUploader:
+    """
+    Used by ct_extract and ct_daemon.
+
+    Upload objects to MinIO in workers background threads, so the next request
+    to CrowdTangle can go out while the last response is saved.  At most
+    max_pending uploads are queued or running, bounding the responses held in
+    memory, and put waits for a free slot beyond that.
+
+    A failed upload is retried retries times with exponential backoff.  If it
+    still fails, uploads queued after it are skipped and the next put, wait or
+    close exits.  Objects must only be tagged, acknowledged or otherwise
+    marked as saved after wait returns.
+    """
+
+    def __init__(
+        self, minio_client, workers=4, max_pending=16, retries=3, backoff_seconds=1
+    ):
+        self.minio_client = minio_client
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.failed = threading.Event()
+
+    def put(self, bucket, object_name, data):
+        """
+        Queue data, bytes, to be saved as object_name in bucket.
+        """
+        if self.failed.is_set():
+            self.wait()
+
+        self.slots.acquire()
+        future = self.executor.submit(self.upload, bucket, object_name, data)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.upload_done)
+
+    def upload(self, bucket, object_name, data):
+        """
+        Run by the workers.  Save data, retrying on errors.
+        """
+        for attempt in range(self.retries + 1):
+            if self.failed.is_set():
+                return
+            try:
+                put_minio_object_data(self.minio_client, bucket, object_name, data)
+                return
+            except (MinioException, HTTPError) as e:
+                if attempt == self.retries:
+                    print(f"S3 Error putting object {object_name}: {e}")
+                    self.failed.set()
+                    return
+                seconds = self.backoff_seconds * 2**attempt
+                print(
+                    f"S3 Error putting object {object_name}, "
+                    f"retrying in {seconds}s: {e}"
+                )
+                ct_metrics.increment(
+                    "ct_minio_retries_total", operation="put", bucket=bucket
+                )
+                time.sleep(seconds)
+
+    def upload_done(self, future):
+        if future.exception() is not None:
+            print(f"Error putting object: {future.exception()!r}")
+            self.failed.set()
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+    def wait(self):
+        """
+        Wait for every queued upload.  Exits if any of them failed, after which
+        the uploader can be used again, e.g. by the next tick of ct_daemon.
+        """
+        with self.lock:
+            pending = list(self.pending)
+        concurrent.futures.wait(pending)
+
+        if self.failed.is_set():
+            self.failed.clear()
+            sys.exit(1)
+
+    def close(self):
+        """
+        Wait for every queued upload and stop the workers.
+        """
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
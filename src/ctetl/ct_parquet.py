@@ -0,0 +1,249 @@
+# ct_parquet.py
+
+import io
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from .ct_tl import load_columns_to_extract, load_column_remaps
+from .ct_tl import KnownKeysCache, filter_known_rows, filter_post_metrics
+from .ct_tl import MetricWatermarksCache
+
+
+### Parquet copy of loaded rows for analysis
+
+
+def get_parquet_columns():
+    """
+    Used by ParquetSink.
+
+    Return {table: column names} in the order of the rows of
+    ct_tl.transform_post_details.
+    """
+    return {
+        table: [remap.get(column, column) for column in columns]
+        for table, columns, remap in zip(
+            ("accounts", "posts", "post_metrics"),
+            load_columns_to_extract(),
+            load_column_remaps(),
+        )
+    }
+
+
+def get_parquet_schemas(pa):
+    """
+    Used by ParquetSink.
+
+    Return {table: pyarrow schema} of the columns of get_parquet_columns, with
+    the types of ct_schema, so every file of a table has the same schema
+    whatever rows it holds, e.g. only null page categories.  Timestamps are
+    naive UTC in nanoseconds like the PostgreSQL columns read by ct_reporting.
+    """
+    timestamp = pa.timestamp("ns")
+    types = {
+        "accounts": [
+            pa.int64(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.int64(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            timestamp,
+            pa.string(),
+            pa.bool_(),
+        ],
+        "posts": [
+            pa.string(),
+            pa.string(),
+            timestamp,
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.string(),
+            pa.int64(),
+            pa.int64(),
+        ],
+        "post_metrics": [
+            pa.string(),
+            timestamp,
+            pa.float64(),
+            pa.string(),
+            pa.int64(),
+            timestamp,
+            pa.int64(),
+        ],
+    }
+    return {
+        table: pa.schema(list(zip(columns, types[table])))
+        for table, columns in get_parquet_columns().items()
+    }
+
+
+class ParquetSink:
+    """
+    Write rows loaded to PostgreSQL as Parquet files under destination, a
+    local directory or s3://bucket/prefix of a MinIO bucket.
+
+    posts and post_metrics are partitioned Hive style by the posting date of
+    their post, e.g. posts/posting_day=2023-12-13/part-....parquet.  The key
+    is not posting_date as posts already have a posting_date column.  accounts
+    are not partitioned.  Rows are buffered per partition and written once
+    row_group_size rows are buffered, or every flush_interval seconds, so
+    files are not written per batch.  Call close to write what is left.
+
+    Rows are deduplicated against those already written by this sink, not
+    against PostgreSQL, so rows loaded without a sink still reach Parquet.
+    Accounts and posts written by another process may be written again, which
+    query_report_data_from_parquet allows for.
+
+    pyarrow is only needed, and imported, when a sink is used.
+    """
+
+    def __init__(
+        self,
+        destination,
+        minio_client=None,
+        row_group_size=100000,
+        flush_interval=600,
+        known_keys_maxsize=100000,
+    ):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            print("pyarrow is required for Parquet output.  Is it installed?")
+            sys.exit(1)
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+
+        if destination.startswith("s3://"):
+            self.bucket, _, self.prefix = destination[len("s3://") :].partition("/")
+        else:
+            self.bucket, self.prefix = None, destination
+        self.minio_client = minio_client
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.schemas = get_parquet_schemas(pyarrow)
+
+        # Keys and metric watermarks of rows already buffered or written
+        self.written_accounts = KnownKeysCache(known_keys_maxsize)
+        self.written_posts = KnownKeysCache(known_keys_maxsize)
+        self.metric_watermarks = MetricWatermarksCache(known_keys_maxsize)
+        # as_of of the latest fetch written of each post
+        self.written_as_of = MetricWatermarksCache(known_keys_maxsize)
+
+        # {(table, partition): [rows]}, partition is None for accounts
+        self.buffers = {}
+        self.last_flush = time.monotonic()
+
+    def add(self, accounts, posts, post_metrics, posting_dates):
+        """
+        Buffer rows as returned by ct_tl.transform_post_details, except those
+        already written.  posting_dates maps the platform_id of every post to
+        its posting_date.
+        """
+        accounts = filter_known_rows(accounts, self.written_accounts)
+        posts = filter_known_rows(posts, self.written_posts)
+        # Fetches already written would repeat their latest timestep, which
+        # PostgreSQL drops on conflict but Parquet has no constraint for.
+        # as_of is the second column of post_metrics.
+        post_metrics = [
+            row
+            for row in post_metrics
+            if self.written_as_of.get(row[0]) is None
+            or row[1] > self.written_as_of.get(row[0])
+        ]
+        post_metrics, kept_watermarks = filter_post_metrics(
+            post_metrics, self.metric_watermarks
+        )
+        self.written_accounts.add(*(row[0] for row in accounts))
+        self.written_posts.add(*(row[0] for row in posts))
+        self.metric_watermarks.update(kept_watermarks)
+        latest_as_of = {}
+        for row in post_metrics:
+            latest_as_of[row[0]] = max(row[1], latest_as_of.get(row[0], row[1]))
+        self.written_as_of.update(latest_as_of)
+
+        self.buffer_rows("accounts", accounts, lambda row: None)
+        # platform_id is the first column of posts and post_metrics
+        self.buffer_rows(
+            "posts", posts, lambda row: f"{posting_dates[row[0]]:%Y-%m-%d}"
+        )
+        self.buffer_rows(
+            "post_metrics", post_metrics, lambda row: f"{posting_dates[row[0]]:%Y-%m-%d}"
+        )
+
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def buffer_rows(self, table, rows, get_partition):
+        for row in rows:
+            key = (table, get_partition(row))
+            buffer = self.buffers.setdefault(key, [])
+            buffer.append(row)
+            if len(buffer) >= self.row_group_size:
+                self.write_partition(key, self.buffers.pop(key))
+
+    def flush(self):
+        """
+        Write every buffered partition.
+        """
+        for key in list(self.buffers):
+            self.write_partition(key, self.buffers.pop(key))
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+
+    def write_partition(self, key, rows):
+        """
+        Write rows as one Parquet file with a single row group, with the
+        schema of their table.
+        """
+        table, partition = key
+        schema = self.schemas[table]
+        arrow_table = self.pa.Table.from_arrays(
+            [
+                self.pa.array(column, type=field.type)
+                for column, field in zip(zip(*rows), schema)
+            ],
+            schema=schema,
+        )
+
+        as_of = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        path_parts = [table]
+        if partition is not None:
+            path_parts.append(f"posting_day={partition}")
+        path_parts.append(f"part-{as_of}-{uuid.uuid4().hex[:8]}.parquet")
+
+        data = io.BytesIO()
+        self.pq.write_table(
+            arrow_table, data, row_group_size=len(rows), compression="zstd"
+        )
+
+        if self.bucket is None:
+            path = os.path.join(self.prefix, *path_parts)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as parquet_file:
+                parquet_file.write(data.getvalue())
+        else:
+            path = "/".join(part for part in [self.prefix.strip("/"), *path_parts] if part)
+            data_length = data.tell()
+            data.seek(0)
+            self.minio_client.put_object(
+                self.bucket,
+                path,
+                data,
+                data_length,
+                content_type="application/vnd.apache.parquet",
+            )
+        print(f"Wrote {len(rows)} {table} rows to {path}")
@@ -0,0 +1,155 @@
+# ct_profile.py
+
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+
+### Tracing spans
+#
+# Spans time the stages of a run and are logged to stderr as one JSON object
+# per line when they end.  They are only recorded during profile_run, otherwise
+# span returns a shared no-op context manager.
+
+SPANS_ENABLED = False
+
+NULL_SPAN = nullcontext()
+
+span_stacks = threading.local()
+
+
+class Span:
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        stack = getattr(span_stacks, "stack", None)
+        if stack is None:
+            stack = span_stacks.stack = []
+        self.path = "/".join([s.name for s in stack] + [self.name])
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        span_stacks.stack.pop()
+        record = {
+            "span": self.name,
+            "path": self.path,
+            "duration_ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+            "error": exc_type.__name__ if exc_type else None,
+        }
+        record.update(self.fields)
+        print(json.dumps(record, default=str), file=sys.stderr)
+        return False
+
+
+def span(name, **fields):
+    """
+    Time the enclosed block as stage name, nested in any enclosing span of the
+    same thread.  fields are added to the log record, e.g. an object name.
+    """
+    if not SPANS_ENABLED:
+        return NULL_SPAN
+    return Span(name, fields)
+
+
+def traced(name):
+    """
+    Decorator running every call of the function in span(name).
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not SPANS_ENABLED:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+### Profiling of entry scripts
+
+
+def add_profile_argument(parser):
+    """
+    Used by the entry scripts.
+
+    Add the --profile option to an argparse parser.
+    """
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="all",
+        choices=["cpu", "memory", "all"],
+        help="Log stage timings as JSON to stderr and save cProfile (cpu) "
+        "and/or tracemalloc (memory) results.  Defaults to all.",
+    )
+
+
+@contextmanager
+def profile_run(mode):
+    """
+    Used by the entry scripts.
+
+    Profile the enclosed block if mode is "cpu", "memory" or "all", and do
+    nothing if mode is None.  Results are saved in the current directory
+    with the run timestamp and script name in the filename:
+
+        <timestamp>-<script>.prof             cProfile stats, read with pstats
+        <timestamp>-<script>.tracemalloc      tracemalloc snapshot
+        <timestamp>-<script>-memory.txt       top memory allocations by line
+
+    """
+    global SPANS_ENABLED
+
+    if mode is None:
+        yield
+        return
+
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    run_timestamp = datetime.now().isoformat(timespec="seconds").replace(":", "-")
+    prefix = f"{run_timestamp}-{script}"
+
+    profiler = cProfile.Profile() if mode in ("cpu", "all") else None
+    trace_memory = mode in ("memory", "all")
+
+    SPANS_ENABLED = True
+    if trace_memory:
+        tracemalloc.start(25)
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        with span("run", script=script):
+            yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(f"{prefix}.prof")
+            print(f"CPU profile saved to {prefix}.prof")
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            snapshot.dump(f"{prefix}.tracemalloc")
+            with open(f"{prefix}-memory.txt", "w") as f:
+                f.write(f"Peak traced memory: {peak / 2**20:.1f} MiB\n\n")
+                for stat in snapshot.statistics("lineno")[:50]:
+                    f.write(f"{stat}\n")
+            print(f"Memory profile saved to {prefix}.tracemalloc and {prefix}-memory.txt")
+        SPANS_ENABLED = False
@@ -0,0 +1,461 @@
+# ct_redis.py
+
+import threading
+import time
+
+import redis
+
+from . import ct_metrics
+from .ct_helpers import get_paused_window
+from .ct_profile import traced
+
+
+### Redis functions
+
+def create_redis_client():
+    """
+    Create a Redis client using standard parameters.
+    Redis server must already be running.
+    """
+    host = 'localhost'
+    port = 6379
+    db = 0
+    try:
+        # Attempt to create a Redis client
+        redis_client = redis.StrictRedis(host=host, port=port, db=db)
+        redis_client.ping()
+        return redis_client
+    except Exception as e:
+        # Handle exceptions, such as connection errors
+        print(f"Error creating Redis client: {e}")
+        return None
+
+
+def create_redis_consumer_group(redis_client, stream, group):
+    """
+    Used by ct_post_details_from_stream.
+
+    Create consumer group on stream, creating the stream if it doesn't exist.
+    Creating a group that already exists is not an error.
+    """
+    try:
+        redis_client.xgroup_create(stream, group, id="0", mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        # BUSYGROUP means another consumer already created the group
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def publish_platform_ids(redis_client, stream, platform_ids, maxlen=1000000):
+    """
+    Used by ct_bundled_posts_to_minio.
+
+    Add each platform_id to stream as a work item for the detail fetchers.
+    The stream is trimmed approximately to maxlen entries so it cannot grow
+    without bound if no consumer is running.
+    """
+    pipe = redis_client.pipeline()
+    for platform_id in platform_ids:
+        pipe.xadd(
+            stream, {"platform_id": platform_id}, maxlen=maxlen, approximate=True
+        )
+    pipe.execute()
+
+
+def read_platform_ids(redis_client, stream, group, consumer, count=10, block_ms=5000):
+    """
+    Used by ct_post_details_from_stream.
+
+    Read up to count new entries for consumer from group.  Blocks for block_ms
+    if there are no new entries.
+
+    Returns a list of (entry_id, platform_id) tuples.
+    """
+    response = redis_client.xreadgroup(
+        group, consumer, {stream: ">"}, count=count, block=block_ms
+    )
+    entries = []
+    for _, stream_entries in response or []:
+        for entry_id, fields in stream_entries:
+            entries.append((entry_id, fields[b"platform_id"].decode()))
+    return entries
+
+
+def reclaim_platform_ids(redis_client, stream, group, consumer, min_idle_ms, count=10):
+    """
+    Used by ct_post_details_from_stream.
+
+    Claim entries that were delivered to any consumer of group but not
+    acknowledged within min_idle_ms, e.g. because the consumer died.  The
+    pending entries of group are scanned from the start until count entries
+    are claimed or none are left.  Entries deleted from stream while pending
+    are acknowledged, so they leave the pending entries list.
+
+    Returns a list of (entry_id, platform_id) tuples.
+    """
+    entries = []
+    start_id = "0-0"
+    while len(entries) < count:
+        response = redis_client.xautoclaim(
+            stream,
+            group,
+            consumer,
+            min_idle_time=min_idle_ms,
+            start_id=start_id,
+            count=count - len(entries),
+        )
+        # response is [next_start_id, claimed_entries], plus deleted_ids
+        # from Redis 7, which removes them from the pending entries itself
+        start_id, claimed_entries = response[0], response[1]
+        # Before Redis 7, deleted entries are claimed without fields
+        deleted_ids = [entry_id for entry_id, fields in claimed_entries if not fields]
+        if deleted_ids:
+            redis_client.xack(stream, group, *deleted_ids)
+        entries.extend(
+            (entry_id, fields[b"platform_id"].decode())
+            for entry_id, fields in claimed_entries
+            if fields
+        )
+        if start_id in (b"0-0", "0-0"):
+            break
+    return entries
+
+
+def acknowledge_platform_id(redis_client, stream, group, entry_id):
+    """
+    Used by ct_post_details_from_stream.
+
+    Acknowledge entry_id as processed and remove it from stream.
+    """
+    pipe = redis_client.pipeline()
+    pipe.xack(stream, group, entry_id)
+    pipe.xdel(stream, entry_id)
+    pipe.execute()
+
+
+# Extend or delete a lease only if it is still held by the caller.  A lease
+# that expired and was acquired by another worker is left alone.
+RENEW_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def acquire_lease(redis_client, lease_key, owner, ttl_ms):
+    """
+    Used by ct_shard.
+
+    Acquire lease_key for owner if no one holds it.  The lease expires after
+    ttl_ms unless renewed, so a worker that dies cannot hold it forever.
+
+    Returns True if acquired.
+    """
+    return bool(redis_client.set(lease_key, owner, nx=True, px=ttl_ms))
+
+
+def renew_lease(redis_client, lease_key, owner, ttl_ms):
+    """
+    Used by LeaseRenewer.
+
+    Extend lease_key by ttl_ms if owner still holds it.
+
+    Returns False if the lease was lost.
+    """
+    return bool(redis_client.eval(RENEW_LEASE_SCRIPT, 1, lease_key, owner, ttl_ms))
+
+
+def release_lease(redis_client, lease_key, owner):
+    """
+    Used by ct_shard.
+
+    Delete lease_key if owner still holds it.
+    """
+    redis_client.eval(RELEASE_LEASE_SCRIPT, 1, lease_key, owner)
+
+
+class LeaseRenewer:
+    """
+    Used by ct_shard.
+
+    Renew a lease every third of ttl_ms in a background thread until stopped.
+    If a renewal fails, lost is set and renewing stops.  The holder should
+    check lost between units of work and stop working on the leased resource.
+    """
+
+    def __init__(self, redis_client, lease_key, owner, ttl_ms):
+        self.redis_client = redis_client
+        self.lease_key = lease_key
+        self.owner = owner
+        self.ttl_ms = ttl_ms
+        self.lost = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.renew, daemon=True)
+
+    def renew(self):
+        while not self.stopped.wait(self.ttl_ms / 3000):
+            try:
+                renewed = renew_lease(
+                    self.redis_client, self.lease_key, self.owner, self.ttl_ms
+                )
+            except redis.exceptions.RedisError as e:
+                print(f"Error renewing lease {self.lease_key}: {e}")
+                renewed = False
+            if not renewed:
+                self.lost.set()
+                return
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+
+@traced("rate_limit")
+def allow_request(redis_client, redis_key, rate_limit, time_limit):
+    """
+    Check data at redis_key if request is allowed within rate_limit and time_limit.
+    Function will sleep if rate if above rate limit and will return False.  Use within
+    a while loop until function return True.
+    
+    Assumes redis_key is only used for this function and the data are timestamps.  
+    No checks are made to validate this assumption.  If using this function to limit
+    API calls, using the API key as the redis_key is recommended.
+    
+    """
+    request_time = int(time.time())
+    
+    # Retrieve the current list of timestamps from Redis
+    timestamps_bytes = redis_client.lrange(redis_key, 0, -1)
+    
+    # Convert timestamps from bytes to floats
+    timestamps = [int(round(float(ts))) for ts in timestamps_bytes]
+  
+    # If more timestamps than rate_limit, trim to rate_limit elements
+    if len(timestamps) > rate_limit:
+        for _ in range(len(timestamps) - rate_limit):
+            # Popping from right to keep earliest request time
+            redis_client.rpop(redis_key)    
+
+    # Assign current_window.  If timestamps is empty make current_window bigger than time_limit
+    current_window = request_time - timestamps[0] if timestamps else time_limit + 1
+
+    if len(timestamps) < rate_limit:  
+        redis_client.rpush(redis_key, request_time)
+        ct_metrics.increment("ct_rate_limiter_requests_total", result="allowed")
+        return True
+    else:
+        # May want to buffering with an additional time_buffer
+        time_buffer = 1
+        if current_window - time_buffer  < time_limit: # Not enough time has passed.  Deny and sleep.
+            # sleep_time = time_limit - current_window + time_buffer
+            sleep_time = time_limit - current_window + time_buffer
+            # Deny and sleep for sleep_time
+            ct_metrics.increment("ct_rate_limiter_requests_total", result="denied")
+            ct_metrics.increment("ct_rate_limiter_sleep_seconds_total", sleep_time)
+            time.sleep(sleep_time)
+            return False
+        else: # Enough time has passed.  Allow request.  
+            # Pop the previous oldest timestamp
+            redis_client.lpop(redis_key)
+            # Push current time into timestamps
+            redis_client.rpush(redis_key, request_time)
+            ct_metrics.increment("ct_rate_limiter_requests_total", result="allowed")
+            return True
+
+
+def pause_rate_limit(
+    redis_client, redis_key, rate_limit, time_limit, seconds, slowdown=2
+):
+    """
+    Used by PermitLease and ct_extract.
+
+    Stop every process sharing the allow_request rate limit at redis_key from
+    requesting for seconds, then slow them down for a while, by replacing the
+    window with get_paused_window.  Used when the API throttles requests.
+    Permits leased from the window are lost.
+    """
+    # One second less for the 1 second buffer of allow_request
+    window = get_paused_window(
+        time.time() - 1, rate_limit, time_limit, seconds, slowdown
+    )
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(redis_key)
+    pipe.rpush(redis_key, *window)
+    pipe.execute()
+
+
+# Lease up to ARGV[4] slots of the allow_request window at KEYS[1] in one
+# call.  Leased slots are stored as ARGV[5], the time the lease expires, as
+# they may be used until then.  Returns {granted, seconds to wait if none}.
+# Floats are returned as strings as Redis truncates Lua numbers.
+LEASE_PERMITS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate_limit = tonumber(ARGV[2])
+-- Same 1 second buffer as allow_request
+local time_limit = tonumber(ARGV[3]) + 1
+local oldest = redis.call('lindex', KEYS[1], 0)
+while oldest and now - tonumber(oldest) >= time_limit do
+    redis.call('lpop', KEYS[1])
+    oldest = redis.call('lindex', KEYS[1], 0)
+end
+local granted = math.min(tonumber(ARGV[4]), rate_limit - redis.call('llen', KEYS[1]))
+if granted <= 0 then
+    if not oldest then
+        return {0, tostring(time_limit)}
+    end
+    return {0, tostring(tonumber(oldest) + time_limit - now)}
+end
+for i = 1, granted do
+    redis.call('rpush', KEYS[1], ARGV[5])
+end
+return {granted, '0'}
+"""
+
+
+def lease_permits(
+    redis_client, redis_key, rate_limit, time_limit, permits, now, expires_at
+):
+    """
+    Used by PermitLease.
+
+    Atomically lease up to permits requests of the allow_request rate limit
+    at redis_key, to be used before expires_at.
+
+    Returns (permits granted, seconds until one is free if none were).
+    """
+    granted, wait_seconds = redis_client.eval(
+        LEASE_PERMITS_SCRIPT,
+        1,
+        redis_key,
+        now,
+        rate_limit,
+        time_limit,
+        permits,
+        expires_at,
+    )
+    return int(granted), float(wait_seconds)
+
+
+def return_permits(redis_client, redis_key, permits, expires_at):
+    """
+    Used by PermitLease.
+
+    Give back permits unused of a lease that expires at expires_at.
+    """
+    redis_client.lrem(redis_key, -permits, expires_at)
+
+
+class PermitLease:
+    """
+    Used by ct_extract.
+
+    Share the allow_request rate limit at redis_key between the threads of a
+    process with a single Redis call per batch_size requests.  Permits are
+    leased from Redis in bulk and handed out locally until they run out or
+    their lease expires after lease_seconds.  Callers that have to wait sleep
+    until the oldest request leaves the window, instead of polling Redis.
+    Permits left unused are given back when their lease expires and on close.
+
+    Processes that don't lease permits can keep calling allow_request on the
+    same redis_key.  A leased permit counts towards the limit until its lease
+    expires plus time_limit, so a long lease_seconds leaves part of the limit
+    unused.  Every process sharing redis_key can hold a lease at once, so keep
+    batch_size well under rate_limit.
+    """
+
+    def __init__(
+        self,
+        redis_client,
+        redis_key,
+        rate_limit,
+        time_limit,
+        batch_size=3,
+        lease_seconds=5,
+    ):
+        self.redis_client = redis_client
+        self.redis_key = redis_key
+        self.rate_limit = rate_limit
+        self.time_limit = time_limit
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.lock = threading.Lock()
+        self.permits = 0
+        self.expires_at = 0.0
+
+    @traced("rate_limit")
+    def acquire(self):
+        """
+        Return once a request is allowed.
+        """
+        with self.lock:
+            while True:
+                now = time.time()
+                if self.permits and now < self.expires_at:
+                    self.permits -= 1
+                    ct_metrics.increment(
+                        "ct_rate_limiter_requests_total", result="allowed"
+                    )
+                    return
+
+                self.give_back()
+                expires_at = now + self.lease_seconds
+                granted, wait_seconds = lease_permits(
+                    self.redis_client,
+                    self.redis_key,
+                    self.rate_limit,
+                    self.time_limit,
+                    self.batch_size,
+                    now,
+                    expires_at,
+                )
+                if granted:
+                    self.permits = granted
+                    self.expires_at = expires_at
+                else:
+                    ct_metrics.increment(
+                        "ct_rate_limiter_requests_total", result="denied"
+                    )
+                    ct_metrics.increment(
+                        "ct_rate_limiter_sleep_seconds_total", wait_seconds
+                    )
+                    time.sleep(wait_seconds)
+
+    def pause(self, seconds):
+        """
+        Pause the rate limit of every process for seconds, see
+        pause_rate_limit.  Permits in hand are dropped with the window.
+        """
+        pause_rate_limit(
+            self.redis_client, self.redis_key, self.rate_limit, self.time_limit, seconds
+        )
+        self.permits = 0
+
+    def give_back(self):
+        # Called with lock held
+        if self.permits:
+            return_permits(
+                self.redis_client, self.redis_key, self.permits, self.expires_at
+            )
+            self.permits = 0
+
+    def close(self):
+        with self.lock:
+            self.give_back()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,391 @@
+# ct_reload.py
+
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from .ct_compact import iter_segment_data
+from .ct_db import get_psycopg2_connection, create_load_watermarks_table
+from .ct_minio import OBJECT_LAYOUT, create_minio_client, get_legacy_object_names
+from .ct_minio import get_minio_object_data, get_object_basename
+from .ct_tl import transform_post_details
+
+
+### Reload of PostgreSQL from post details in MinIO
+
+# Tables are reloaded into TABLE + RELOAD_SUFFIX and the live rows they
+# replace are kept in TABLE + PREVIOUS_SUFFIX, until the next reload
+RELOAD_TABLES = ("accounts", "posts", "post_metrics")
+RELOAD_SUFFIX = "_reload"
+PREVIOUS_SUFFIX = "_previous"
+
+# MinIO client of each worker process, see init_reload_worker
+RELOAD_MINIO_CLIENT = None
+
+
+def get_reload_days(from_date, to_date):
+    """
+    Used by reload_post_details.
+
+    Return the 'YYYY/MM/DD' days from from_date to to_date inclusive, both
+    'YYYY-MM-DD' strings.
+    """
+    day = datetime.strptime(from_date, "%Y-%m-%d")
+    last_day = datetime.strptime(to_date, "%Y-%m-%d")
+    days = []
+    while day <= last_day:
+        days.append(day.strftime("%Y/%m/%d"))
+        day += timedelta(days=1)
+    return days
+
+
+def get_legacy_reload_object_names(minio_client, details_bucket, from_date, to_date):
+    """
+    Used by reload_post_details.
+
+    Return names of objects of the previous layout fetched from from_date to
+    to_date inclusive.
+    """
+    return [
+        object_name
+        for object_name in get_legacy_object_names(minio_client, details_bucket)
+        if from_date <= get_object_basename(object_name).split("_")[2][:10] <= to_date
+    ]
+
+
+def create_reload_tables():
+    """
+    Used by reload_post_details.
+
+    Create empty copies of the live tables, with their indexes and
+    constraints, to reload into.  Copies left by an earlier reload are dropped.
+    """
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                for table in RELOAD_TABLES:
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}{RELOAD_SUFFIX}")
+                    cursor.execute(
+                        f"CREATE TABLE {table}{RELOAD_SUFFIX} "
+                        f"(LIKE {table} INCLUDING ALL)"
+                    )
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+
+def bulk_insert_reload_rows(accounts_to_insert, posts_to_insert, post_metrics_to_insert):
+    """
+    Used by reload_work_unit.
+
+    Insert rows into the reload tables with multi-row INSERTs.  Rows of the
+    same key are fetched many times over, so conflicts are ignored as in
+    ct_tl.queries_for_insert.
+    """
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                execute_values(
+                    cursor,
+                    f"INSERT INTO accounts{RELOAD_SUFFIX} VALUES %s "
+                    "ON CONFLICT (account_id) DO NOTHING",
+                    accounts_to_insert,
+                    page_size=1000,
+                )
+                execute_values(
+                    cursor,
+                    f"INSERT INTO posts{RELOAD_SUFFIX} VALUES %s "
+                    "ON CONFLICT (platform_id) DO NOTHING",
+                    posts_to_insert,
+                    page_size=1000,
+                )
+                execute_values(
+                    cursor,
+                    f"INSERT INTO post_metrics{RELOAD_SUFFIX} VALUES %s "
+                    "ON CONFLICT (platform_id, as_of, score, metric_name, "
+                    "metric_value, metric_timestamp, metric_timestep) DO NOTHING",
+                    post_metrics_to_insert,
+                    page_size=1000,
+                )
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+
+def init_reload_worker():
+    """
+    Used by reload_post_details.
+
+    Create the MinIO client of a worker process.
+    """
+    global RELOAD_MINIO_CLIENT
+    RELOAD_MINIO_CLIENT = create_minio_client()
+
+
+def iter_work_unit_objects(minio_client, details_bucket, archive_bucket, work_unit):
+    """
+    Used by reload_work_unit.
+
+    Yield (object_name, raw bytes) of the post details of work_unit,
+    either ("day", 'YYYY/MM/DD') or ("objects", [object names]).  The
+    objects of a day are read from its compacted segment, if any, and from
+    its partition.  Tags are ignored.
+    """
+    kind, value = work_unit
+    if kind == "day":
+        yield from iter_segment_data(minio_client, archive_bucket, value)
+        object_names = [
+            obj.object_name
+            for obj in minio_client.list_objects(
+                details_bucket, prefix=f"{OBJECT_LAYOUT}/{value}/", recursive=True
+            )
+        ]
+    else:
+        object_names = value
+
+    for object_name in object_names:
+        yield object_name, get_minio_object_data(
+            object_name, details_bucket, minio_client
+        )
+
+
+def reload_work_unit(details_bucket, archive_bucket, work_unit, batch_size=500):
+    """
+    Used by reload_post_details.  Runs in a worker process.
+
+    Transform the post details of work_unit and insert them into the reload
+    tables in batches of batch_size objects.  Returns the number of objects.
+    """
+    accounts_to_insert, posts_to_insert, post_metrics_to_insert = [], [], []
+    batch_objects = 0
+    num_objects = 0
+
+    for object_name, post_details in iter_work_unit_objects(
+        RELOAD_MINIO_CLIENT, details_bucket, archive_bucket, work_unit
+    ):
+        accounts, posts, post_metrics = transform_post_details(
+            post_details, object_name
+        )
+        accounts_to_insert.extend(accounts)
+        posts_to_insert.extend(posts)
+        post_metrics_to_insert.extend(post_metrics)
+        batch_objects += 1
+
+        if batch_objects >= batch_size:
+            bulk_insert_reload_rows(
+                accounts_to_insert, posts_to_insert, post_metrics_to_insert
+            )
+            accounts_to_insert, posts_to_insert, post_metrics_to_insert = [], [], []
+            num_objects += batch_objects
+            batch_objects = 0
+
+    if batch_objects:
+        bulk_insert_reload_rows(
+            accounts_to_insert, posts_to_insert, post_metrics_to_insert
+        )
+        num_objects += batch_objects
+
+    return num_objects
+
+
+def get_reload_date_range(from_date, to_date):
+    """
+    Used by dedup_reload_post_metrics and apply_reload_tables.
+
+    Return the first and the day after the last reloaded day, as as_of is the
+    time of fetching and whole days are compared.
+    """
+    to_date_end = datetime.strptime(to_date, "%Y-%m-%d") + timedelta(days=1)
+    return from_date, to_date_end.strftime("%Y-%m-%d")
+
+
+def dedup_reload_post_metrics(from_date, to_date):
+    """
+    Used by reload_post_details.
+
+    Drop reloaded post_metrics rows that live loading would have skipped, see
+    ct_tl.filter_post_metrics: rows of a fetch with a metric_timestep below
+    the highest metric_timestep of earlier fetches of the post.  Earlier
+    fetches include those of the live tables before the reloaded dates.
+    Only the reload table is written to.
+    """
+    range_start, _ = get_reload_date_range(from_date, to_date)
+
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    DELETE FROM post_metrics{RELOAD_SUFFIX} reloaded
+                    USING (
+                        SELECT platform_id, as_of,
+                            MAX(MAX(metric_timestep)) OVER (
+                                PARTITION BY platform_id ORDER BY as_of
+                                ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                            ) AS watermark
+                        FROM (
+                            SELECT platform_id, as_of, metric_timestep
+                            FROM post_metrics{RELOAD_SUFFIX}
+                            UNION ALL
+                            SELECT platform_id, as_of, metric_timestep
+                            FROM post_metrics
+                            WHERE as_of < %s AND platform_id IN (
+                                SELECT platform_id FROM post_metrics{RELOAD_SUFFIX}
+                            )
+                        ) fetches
+                        GROUP BY platform_id, as_of
+                    ) watermarks
+                    WHERE reloaded.platform_id = watermarks.platform_id
+                        AND reloaded.as_of = watermarks.as_of
+                        AND reloaded.metric_timestep < watermarks.watermark
+                    """,
+                    (range_start,),
+                )
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+
+def get_table_columns(cursor, table):
+    """
+    Used by apply_reload_tables.
+
+    Return the column names of table in order.
+    """
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s "
+        "ORDER BY ordinal_position",
+        (table,),
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def apply_reload_tables(from_date, to_date):
+    """
+    Used by reload_post_details.
+
+    Replace the rows of the reloaded dates in the live tables with those of
+    the reload tables, in one transaction so readers see either all old or
+    all reloaded data.  post_metrics fetched in the reloaded dates are
+    deleted and reinserted, and reloaded accounts and posts overwrite the
+    live ones.  Work and row locks are bounded by the reloaded dates, so live
+    loading carries on.  Replaced rows are kept in TABLE + PREVIOUS_SUFFIX
+    until the next reload.
+    """
+    range_start, range_end = get_reload_date_range(from_date, to_date)
+    keys = {"accounts": "account_id", "posts": "platform_id"}
+
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                for table in RELOAD_TABLES:
+                    cursor.execute(f"DROP TABLE IF EXISTS {table}{PREVIOUS_SUFFIX}")
+                    cursor.execute(
+                        f"CREATE TABLE {table}{PREVIOUS_SUFFIX} "
+                        f"(LIKE {table} INCLUDING ALL)"
+                    )
+
+                for table, key in keys.items():
+                    updates = ", ".join(
+                        f"{column} = EXCLUDED.{column}"
+                        for column in get_table_columns(cursor, table)
+                        if column != key
+                    )
+                    cursor.execute(
+                        f"INSERT INTO {table}{PREVIOUS_SUFFIX} SELECT live.* "
+                        f"FROM {table} live JOIN {table}{RELOAD_SUFFIX} USING ({key})"
+                    )
+                    cursor.execute(
+                        f"INSERT INTO {table} SELECT * FROM {table}{RELOAD_SUFFIX} "
+                        f"ON CONFLICT ({key}) DO UPDATE SET {updates}"
+                    )
+
+                cursor.execute(
+                    "WITH replaced AS (DELETE FROM post_metrics "
+                    "WHERE as_of >= %s AND as_of < %s RETURNING *) "
+                    f"INSERT INTO post_metrics{PREVIOUS_SUFFIX} SELECT * FROM replaced",
+                    (range_start, range_end),
+                )
+                cursor.execute(
+                    f"INSERT INTO post_metrics SELECT * FROM post_metrics{RELOAD_SUFFIX} "
+                    "ON CONFLICT DO NOTHING"
+                )
+
+                for table in RELOAD_TABLES:
+                    cursor.execute(f"DROP TABLE {table}{RELOAD_SUFFIX}")
+
+                # Invalidate every cached report, see ct_reporting
+                create_load_watermarks_table(cursor)
+                cursor.execute("UPDATE load_watermarks SET loaded_at = now()")
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+
+def reload_post_details(
+    minio_client,
+    details_bucket,
+    archive_bucket,
+    from_date,
+    to_date,
+    workers=4,
+    apply=True,
+):
+    """
+    Used by ct_reload.
+
+    Reload post details fetched from from_date to to_date inclusive, both
+    'YYYY-MM-DD', into fresh copies of the tables and apply them to the live
+    tables.  Tags are ignored.  Days are transformed and inserted in parallel
+    by workers processes, and objects of the previous layout in chunks.  If
+    apply is False, the reload tables are left for inspection.
+    """
+    work_units = [("day", day) for day in get_reload_days(from_date, to_date)]
+    legacy_object_names = get_legacy_reload_object_names(
+        minio_client, details_bucket, from_date, to_date
+    )
+    for i in range(0, len(legacy_object_names), 500):
+        work_units.append(("objects", legacy_object_names[i : i + 500]))
+
+    create_reload_tables()
+
+    num_objects = 0
+    # Spawn rather than fork so no connection of this process is shared
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_reload_worker,
+    ) as executor:
+        futures = {
+            executor.submit(
+                reload_work_unit, details_bucket, archive_bucket, work_unit
+            ): work_unit
+            for work_unit in work_units
+        }
+        for future in as_completed(futures):
+            kind, value = futures[future]
+            label = value if kind == "day" else f"{len(value)} objects"
+            try:
+                unit_objects = future.result()
+            except BaseException as e:
+                # Workers sys.exit on errors like the rest of the loader
+                print(f"Reload of {label} failed: {e!r}")
+                print("Live tables were left unchanged.")
+                executor.shutdown(wait=False, cancel_futures=True)
+                sys.exit(1)
+            num_objects += unit_objects
+            print(f"Reloaded {unit_objects} objects of {label}.")
+
+    print(f"Reloaded {num_objects} objects in total.")
+
+    # Same rows as live loading would have kept
+    dedup_reload_post_metrics(from_date, to_date)
+
+    if apply:
+        apply_reload_tables(from_date, to_date)
+        print("Applied reloaded tables.")
@@ -0,0 +1,97 @@
+# ct_report_cache.py
+
+import hashlib
+import json
+import os
+import time
+
+
+### On-disk cache of generated reports
+#
+# Configured from the environment:
+# CT_REPORT_CACHE_DIR        directory of cached reports, shared by every user
+#                            who can write to it
+# CT_REPORT_CACHE_MAX_BYTES  least recently used reports are evicted beyond this
+# CT_REPORT_CACHE_TTL        seconds a report is reused for at most.  Windows
+#                            are relative to now, so a cached report drifts from
+#                            the current window as time passes.
+
+REPORT_CACHE_DIR = os.environ.get(
+    "CT_REPORT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "ct_reports")
+)
+REPORT_CACHE_MAX_BYTES = int(os.environ.get("CT_REPORT_CACHE_MAX_BYTES", 256 * 2**20))
+REPORT_CACHE_TTL = int(os.environ.get("CT_REPORT_CACHE_TTL", 600))
+
+
+def get_report_cache_key(version, start, end, load_watermark):
+    """
+    Used by ct_reporting.create_score_report.
+
+    Key a report by the version of its query and generation, its window, the
+    load watermark of the window and the current REPORT_CACHE_TTL period.
+    """
+    period = int(time.time() // REPORT_CACHE_TTL)
+    key_parts = [version, start, end, load_watermark, period]
+    return hashlib.sha256(json.dumps(key_parts).encode()).hexdigest()
+
+
+def get_report_cache_path(key):
+    return os.path.join(REPORT_CACHE_DIR, f"{key}.csv")
+
+
+def read_cached_report(key):
+    """
+    Used by ct_reporting.create_score_report.
+
+    Return the cached report of key as bytes, or None.
+    """
+    path = get_report_cache_path(key)
+    try:
+        with open(path, "rb") as report_file:
+            data = report_file.read()
+    except FileNotFoundError:
+        return None
+
+    # Mark as recently used for eviction
+    os.utime(path)
+    return data
+
+
+def write_cached_report(key, data):
+    """
+    Used by ct_reporting.create_score_report.
+
+    Cache report data under key, then evict least recently used reports
+    beyond REPORT_CACHE_MAX_BYTES.  The report is written to a temporary file
+    and renamed, so concurrent reports never read a partial file.
+    """
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = get_report_cache_path(key)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as report_file:
+        report_file.write(data)
+    os.replace(temporary_path, path)
+
+    evict_cached_reports()
+
+
+def evict_cached_reports():
+    """
+    Used by write_cached_report.
+    """
+    entries = []
+    for entry in os.scandir(REPORT_CACHE_DIR):
+        if entry.name.endswith(".csv"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= REPORT_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Evicted by a concurrent report
+            pass
+        total_bytes -= size
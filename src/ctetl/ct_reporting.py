@@ -1,14 +1,23 @@
 # ct_reporting.py
 
-from datetime import datetime
+import os
+import sys
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
 import pandas as pd
 
-from sqlalchemy import text
-
 from ctetl.ct_helpers import isoformat_to_seconds
+from ctetl.ct_profile import traced
+from ctetl.ct_report_cache import get_report_cache_key
+from ctetl.ct_report_cache import read_cached_report, write_cached_report
+
+# Increase when query_report_data_* or generate_report change their results,
+# so reports cached by earlier versions are not reused
+REPORT_QUERY_VERSION = 1
 
 
+@traced("query")
 def query_report_data_from_db(engine, start=96, end=72):
     """
     Used by ct_score_report
@@ -17,6 +26,8 @@ def query_report_data_from_db(engine, start=96, end=72):
     CrowdTangle timestamp data are always at UTC.
 
     """
+    # Imported here so reports from Parquet don't need SQLAlchemy
+    from sqlalchemy import text
 
     if start <= end:
         print("Start must be greater than end.")
@@ -43,75 +54,292 @@ def query_report_data_from_db(engine, start=96, end=72):
     with engine.connect() as con:
         result = con.execute(query)
         df = pd.DataFrame(result.fetchall(), columns=result.keys())
-    return df
+    return compact_report_dtypes(df)
 
 
-def fill_missing_timesteps(df, max_timesteps=51):
+def compact_report_dtypes(df):
     """
-    Used by ct_score_report and generate_report.
+    Used by query_report_data_from_db and query_report_data_from_parquet.
 
-    Used to forward fill missing timestep values from last for every post.
-    Logically this works as any changes in values will have a timestep entry.
+    Every post has a row per metric and timestep, so strings of accounts and
+    posts are repeated many times over.  Store them as categoricals and
+    downcast metric_timestep.
 
     """
+    return df.astype(
+        {
+            "account_name": "category",
+            "platform_id": "category",
+            "post_message": "category",
+            "post_url": "category",
+            "metric_timestep": "int16",
+        }
+    )
 
-    # Accumulate date in a list as it is cheaper than a DataFrame.
-    result_data = []
 
-    # Forward fill missing timestep values from last.
-    # Logically this works as any changes in values
-    # will have a timestep entry
+def query_report_load_watermark(engine, start=96, end=72):
+    """
+    Used by ct_score_report
 
-    for metric_timestep in range(max_timesteps):
-        if metric_timestep in df["metric_timestep"].values:
-            result_data.append(
-                df[df["metric_timestep"] == metric_timestep].iloc[0].to_dict()
-            )
-        else:
-            if result_data:
-                last_valid_values = result_data[-1].copy()
-                last_valid_values["metric_timestep"] = metric_timestep
-                result_data.append(last_valid_values)
+    Return the last time rows of posts posted between start and end hours ago
+    were loaded, see ct_db.create_load_watermarks_table, along with the
+    database.  Returns None if no loader recorded watermarks yet.
 
-    # finally create and return a DataFrame from the list of dictionaries
-    return pd.DataFrame(result_data)
+    """
+    from sqlalchemy import text
+    from sqlalchemy.exc import ProgrammingError
 
+    query = text(
+        f"""
+    SELECT MAX(loaded_at) FROM load_watermarks
+    WHERE posting_day BETWEEN (CURRENT_TIMESTAMP - interval '{start} hours')::date
+    AND (CURRENT_TIMESTAMP - interval '{end} hours')::date;
+    """
+    )
+    try:
+        with engine.connect() as con:
+            loaded_at = con.execute(query).scalar()
+    except ProgrammingError:
+        # load_watermarks doesn't exist yet
+        return None
+
+    if loaded_at is None:
+        return None
+    return f"{engine.url.render_as_string(hide_password=True)} {loaded_at.isoformat()}"
+
+
+def get_parquet_filesystem(dataset_path):
+    """
+    Used by query_report_data_from_parquet.
 
+    Return the pyarrow filesystem and root of dataset_path, a local directory
+    or s3://bucket/prefix in MinIO as written by ct_parquet.ParquetSink.
+    """
+    from pyarrow import fs
+
+    if not dataset_path.startswith("s3://"):
+        return fs.LocalFileSystem(), dataset_path
+
+    MINIO_HOST = os.environ.get("MINIO_HOST")
+    MINIO_ACCESS = os.environ.get("MINIO_ACCESS")
+    MINIO_SECRET = os.environ.get("MINIO_SECRET")
+    if any(P is None for P in (MINIO_HOST, MINIO_ACCESS, MINIO_SECRET)):
+        print(
+            "At least one of the MinIO parameters is empty.  Are they defined in the environment?"
+        )
+        sys.exit(1)
+
+    # Modify 'scheme' to your configuration, as for create_minio_client
+    filesystem = fs.S3FileSystem(
+        access_key=MINIO_ACCESS,
+        secret_key=MINIO_SECRET,
+        endpoint_override=MINIO_HOST,
+        scheme="http",
+    )
+    return filesystem, dataset_path[len("s3://") :].rstrip("/")
+
+
+@traced("query")
+def query_report_data_from_parquet(dataset_path, start=96, end=72):
+    """
+    Used by ct_score_report
+
+    Same as query_report_data_from_db but reading the Parquet copy written by
+    ct_transform_and_load --parquet, with pyarrow datasets.  Only the
+    posting_day partitions of the window are read, and filters on
+    posting_date and platform_id are pushed down to the Parquet row groups.
+
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    if start <= end:
+        print("Start must be greater than end.")
+        sys.exit(1)
+
+    filesystem, root = get_parquet_filesystem(dataset_path)
+    partitioning = ds.partitioning(
+        pa.schema([("posting_day", pa.string())]), flavor="hive"
+    )
+
+    def dataset(table):
+        return ds.dataset(
+            f"{root}/{table}",
+            format="parquet",
+            filesystem=filesystem,
+            partitioning=partitioning if table != "accounts" else None,
+        )
+
+    # posting_date is stored at UTC like in PostgreSQL
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    window_start = now - timedelta(hours=start)
+    window_end = now - timedelta(hours=end)
+
+    # Partition pruning by day, then row filtering by time
+    in_window_days = (ds.field("posting_day") >= f"{window_start:%Y-%m-%d}") & (
+        ds.field("posting_day") <= f"{window_end:%Y-%m-%d}"
+    )
+
+    posts = dataset("posts").to_table(
+        columns=["platform_id", "account_id", "post_message", "post_url", "posting_date"],
+        filter=in_window_days
+        & (ds.field("posting_date") >= pa.scalar(window_start, pa.timestamp("ns")))
+        & (ds.field("posting_date") <= pa.scalar(window_end, pa.timestamp("ns"))),
+    )
+    post_metrics = dataset("post_metrics").to_table(
+        columns=["platform_id", "as_of", "score", "metric_timestep"],
+        filter=in_window_days
+        & ds.field("platform_id").isin(pc.unique(posts["platform_id"])),
+    )
+    accounts = dataset("accounts").to_table(
+        columns=["account_id", "account_name"],
+        filter=ds.field("account_id").isin(pc.unique(posts["account_id"])),
+    )
+
+    # Accounts and posts may be written more than once, e.g. by a restarted loader
+    df = (
+        accounts.to_pandas()
+        .drop_duplicates("account_id")
+        .merge(posts.to_pandas().drop_duplicates("platform_id"), on="account_id")
+        .merge(post_metrics.to_pandas(), on="platform_id")
+    )
+
+    df["sgt_posting_date"] = df.pop("posting_date") + timedelta(hours=8)
+    df["sgt_as_of"] = df.pop("as_of") + timedelta(hours=8)
+
+    return compact_report_dtypes(
+        df[
+            [
+                "account_name",
+                "account_id",
+                "platform_id",
+                "post_message",
+                "post_url",
+                "sgt_posting_date",
+                "sgt_as_of",
+                "score",
+                "metric_timestep",
+            ]
+        ]
+    )
+
+
+@traced("report")
 def generate_report(df):
     """
     Used by ct_score_report.
 
     Generate a daily report of CrowdTangle scores from the supplied df.
 
+    Every post gets a row for each timestep from its first to max_timesteps,
+    with missing timesteps forward filled from the last.  Logically this
+    works as any changes in values will have a timestep entry.  Posts are in
+    the order they first appear in df.
+
     Timestep of 50 corresponds to an interval of between 2 days 18 hours
     and 3 days since the posting date.  Using 51 because of python counting.
 
     """
     max_timesteps = 51
 
-    # Accumulating data in a list as it is cheaper than a DataFrame
-    report_data = []
+    # First row of each timestep of each post
+    first_df = df[df["metric_timestep"] < max_timesteps].drop_duplicates(
+        ["platform_id", "metric_timestep"]
+    )
+    if first_df.empty:
+        return first_df.reset_index(drop=True)
+
+    # Index every timestep from the first of each post to max_timesteps
+    first_timesteps = first_df.groupby("platform_id", observed=True)[
+        "metric_timestep"
+    ].min()
+    platform_order = pd.unique(df["platform_id"])
+    first_timesteps = first_timesteps.reindex(
+        [platform_id for platform_id in platform_order if platform_id in first_timesteps]
+    )
+    counts = max_timesteps - first_timesteps.to_numpy()
+    platform_ids = first_timesteps.index.to_numpy().repeat(counts)
+    timesteps = np.concatenate(
+        [np.arange(first, max_timesteps) for first in first_timesteps.to_numpy()]
+    )
+    report_index = pd.MultiIndex.from_arrays(
+        [platform_ids, timesteps], names=["platform_id", "metric_timestep"]
+    )
+
+    report_df = (
+        first_df.set_index(["platform_id", "metric_timestep"])
+        .reindex(report_index)
+        .groupby(level="platform_id", sort=False)
+        .ffill()
+        .reset_index()
+    )
 
-    unique_platform_ids = df["platform_id"].unique()
+    # reindex introduces missing values, and so float or object columns,
+    # until they are forward filled
+    return report_df[df.columns].astype(df.dtypes.to_dict())
 
-    for platform_id in unique_platform_ids:
-        post_df = df[df["platform_id"] == platform_id]
-        report_data.extend(
-            fill_missing_timesteps(post_df, max_timesteps).to_dict(orient="records")
-        )
 
-    # Create a DataFrame from the list of dictionaries
-    report_df = pd.DataFrame(report_data)
-    report_df.reset_index(drop=True, inplace=True)
+def create_score_report(
+    query_report_data, start=96, end=72, query_load_watermark=None
+):
+    """
+    Used by ct_score_report and ct_daemon.
+
+    Query scores of posts posted between start and end hours ago, generate the
+    report and save it to a csv.  query_report_data is the data source, a
+    function of start and end like query_report_data_from_db with its engine
+    bound, or query_report_data_from_parquet with its dataset_path bound.
+
+    If query_load_watermark, a function of start and end like
+    query_report_load_watermark, is given, reports are cached by
+    ct_report_cache.  A cached report is reused until the loader loads rows
+    of the window again.
+
+    """
+    cache_key = None
+    if query_load_watermark is not None:
+        load_watermark = query_load_watermark(start=start, end=end)
+        if load_watermark is not None:
+            cache_key = get_report_cache_key(
+                REPORT_QUERY_VERSION, start, end, load_watermark
+            )
+            data = read_cached_report(cache_key)
+            if data is not None:
+                print("Using cached report.")
+                write_report_csv(data)
+                return
+
+    df = query_report_data(start=start, end=end)
+
+    # Need to drop duplicates since only querying for scores
+    df.drop_duplicates(inplace=True)
+
+    report_df = generate_report(df)
+    data = save_report_to_csv(report_df)
 
-    return report_df
+    if cache_key is not None:
+        write_cached_report(cache_key, data)
 
 
+@traced("save")
 def save_report_to_csv(report_df):
     """
     Used by ct_score_report.
 
-    Save the report to a csv.  Include timestamp of report generation
+    Save the report to a csv.  Returns the contents of the csv.
+
+    """
+    data = report_df.to_csv(index=False).encode("utf-8-sig")
+    write_report_csv(data)
+    return data
+
+
+def write_report_csv(data):
+    """
+    Used by create_score_report and save_report_to_csv.
+
+    Write report csv data.  Include timestamp of report generation
     in filename.
 
     """
@@ -119,4 +347,5 @@ def save_report_to_csv(report_df):
     now = datetime.now().replace(tzinfo=None)
     as_of = isoformat_to_seconds(now)
     filename = as_of.replace(":", "-") + "-ct_posts_score_report.csv"
-    report_df.to_csv(filename, index=False, encoding="utf-8-sig")
+    with open(filename, "wb") as report_file:
+        report_file.write(data)
@@ -0,0 +1,87 @@
+# ct_schema.py
+
+from datetime import datetime
+from typing import Optional
+
+import msgspec
+
+
+### Schema of CrowdTangle post details
+#
+# Only the fields loaded to PostgreSQL are declared, see
+# ct_tl.load_columns_to_extract.  Any other field of a payload is skipped by
+# the decoder without being parsed into Python objects, and declared fields
+# are type checked as they are decoded.  Fields are snake_case and renamed to
+# the camelCase of the API.
+
+
+class Account(msgspec.Struct, rename="camel", gc=False):
+    id: int
+    name: str
+    platform: str
+    platform_id: int
+    # Sent as null, or not at all, for some accounts, e.g. pages without a
+    # category.  Loaded as NULL.
+    handle: Optional[str] = None
+    url: Optional[str] = None
+    account_type: Optional[str] = None
+    page_admin_top_country: Optional[str] = None
+    page_description: Optional[str] = None
+    page_created_date: Optional[datetime] = None
+    page_category: Optional[str] = None
+    verified: Optional[bool] = None
+
+
+class HistoryEntry(msgspec.Struct, rename="camel", gc=False):
+    timestep: int
+    date: datetime
+    score: float
+    actual: dict[str, int] = {}
+    expected: dict[str, int] = {}
+
+
+class Post(msgspec.Struct, rename="camel", gc=False):
+    platform_id: str
+    date: datetime
+    subscriber_count: int
+    account: Account
+    # Sent as null, or not at all, depending on the post type.  Loaded as NULL.
+    platform: Optional[str] = None
+    type: Optional[str] = None
+    title: Optional[str] = None
+    caption: Optional[str] = None
+    description: Optional[str] = None
+    message: Optional[str] = None
+    expanded_links: Optional[list[dict[str, str]]] = None
+    link: Optional[str] = None
+    post_url: Optional[str] = None
+    history: list[HistoryEntry] = []
+
+
+class PostDetailsResult(msgspec.Struct, gc=False):
+    posts: list[Post]
+
+
+class PostDetails(msgspec.Struct, gc=False):
+    result: PostDetailsResult
+
+
+# The metrics of a history entry, in the order of their metric rows
+HISTORY_METRICS = ("actual", "expected")
+
+POST_DETAILS_DECODER = msgspec.json.Decoder(PostDetails)
+
+
+def decode_post_details(post_details):
+    """
+    Used by ct_tl.transform_post_details.
+
+    Return post_details as a PostDetails.  post_details is either the raw
+    JSON of a post details object or response, or the same already parsed
+    with json.loads.  Raises msgspec.ValidationError if a declared field is
+    missing or of the wrong type, or msgspec.DecodeError if the JSON is
+    malformed.
+    """
+    if isinstance(post_details, (bytes, bytearray, memoryview, str)):
+        return POST_DETAILS_DECODER.decode(post_details)
+    return msgspec.convert(post_details, PostDetails)
@@ -0,0 +1,122 @@
+# ct_shard.py
+
+import random
+import zlib
+
+from .ct_minio import get_object_basename
+from .ct_redis import acquire_lease, release_lease, LeaseRenewer
+from .ct_tl import load_detail_objects, MetricWatermarksCache
+
+
+### Sharded loading of post details across nodes
+
+
+def get_object_shard(object_name, num_shards):
+    """
+    Used by group_objects_by_shard.
+
+    Assign a post details object to one of num_shards shards by its
+    platformId, so all details of a post are loaded by the same worker.
+    crc32 is used rather than hash() as it is the same on every node and run.
+    """
+    # Object names are platformId_asof_.txt and platformIds contain one "_".
+    # See ct_extract.get_details_object_name.
+    platform_id = "_".join(get_object_basename(object_name).split("_")[:2])
+    return zlib.crc32(platform_id.encode()) % num_shards
+
+
+def group_objects_by_shard(object_names, num_shards):
+    """
+    Used by load_detail_shards.
+
+    Returns {shard: [object names]} of the non-empty shards.
+    """
+    shards = {}
+    for object_name in object_names:
+        shards.setdefault(get_object_shard(object_name, num_shards), []).append(
+            object_name
+        )
+    return shards
+
+
+def get_shard_lease_key(details_bucket, shard, num_shards):
+    """
+    Used by load_detail_shards.
+
+    The number of shards is part of the key so workers started with different
+    --shards never treat differently split shards as the same.
+    """
+    return f"ct-load-lease:{details_bucket}:{num_shards}:{shard}"
+
+
+def load_detail_shards(
+    minio_client,
+    redis_client,
+    details_bucket,
+    tags,
+    detail_object_names,
+    num_shards,
+    owner,
+    lease_ttl_ms=60000,
+    batch_size=50,
+    known_accounts=None,
+    known_posts=None,
+    parquet_sink=None,
+):
+    """
+    Used by ct_transform_and_load.
+
+    Split detail_object_names into num_shards shards and load every shard for
+    which a lease can be acquired from Redis.  Shards leased by other workers
+    are skipped; those workers load them.  Leases are renewed while a shard
+    is loaded and released when it is done.
+
+    If a lease is lost, e.g. because Redis was unreachable for longer than
+    lease_ttl_ms, loading of the shard stops after the current batch.  Objects
+    are tagged only after their batch is committed and tagged objects are
+    skipped, so a batch loaded twice in that case is not duplicated.
+
+    Returns the number of shards loaded.
+    """
+    shards = group_objects_by_shard(detail_object_names, num_shards)
+
+    # Visit shards in random order so that workers started together do not
+    # all contend for the same shard first
+    shard_order = list(shards)
+    random.shuffle(shard_order)
+
+    # Posts are never split between shards, so watermarks advanced by this
+    # worker are not advanced by others at the same time
+    metric_watermarks = MetricWatermarksCache()
+    loaded_shards = 0
+
+    for shard in shard_order:
+        lease_key = get_shard_lease_key(details_bucket, shard, num_shards)
+        if not acquire_lease(redis_client, lease_key, owner, lease_ttl_ms):
+            print(f"Shard {shard} is leased by another worker, skipping.")
+            continue
+
+        shard_object_names = shards[shard]
+        try:
+            with LeaseRenewer(redis_client, lease_key, owner, lease_ttl_ms) as renewer:
+                for i in range(0, len(shard_object_names), batch_size):
+                    if renewer.lost.is_set():
+                        print(f"Lost lease on shard {shard}, stopping.")
+                        break
+                    load_detail_objects(
+                        minio_client,
+                        details_bucket,
+                        tags,
+                        shard_object_names[i : i + batch_size],
+                        batch_size,
+                        metric_watermarks,
+                        known_accounts,
+                        known_posts,
+                        parquet_sink,
+                    )
+                else:
+                    loaded_shards += 1
+        finally:
+            release_lease(redis_client, lease_key, owner)
+
+    return loaded_shards
@@ -0,0 +1,186 @@
+# ct_synthetic.py
+
+import random
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+
+### Synthetic CrowdTangle payloads for load testing and benchmarks
+
+
+def make_account(account_index):
+    """
+    Used by make_post.
+
+    Return an account object.  The same account_index always gives the same account.
+    """
+    return {
+        "id": 1000 + account_index,
+        "name": f"Account {account_index}",
+        "handle": f"account{account_index}",
+        "profileImage": f"https://example.com/account{account_index}.jpg",
+        "subscriberCount": 10000 + account_index * 100,
+        "url": f"https://www.facebook.com/account{account_index}",
+        "platform": "Facebook",
+        "platformId": 1000 + account_index,
+        "accountType": "facebook_page",
+        "pageAdminTopCountry": "SG",
+        "pageDescription": f"Description of account {account_index}",
+        "pageCreatedDate": "2010-01-01 00:00:00",
+        "pageCategory": "NEWS_SITE",
+        "verified": True,
+    }
+
+
+def make_history(posting_date, history_length, rng):
+    """
+    Used by make_post.
+
+    Return history_length history entries starting at posting_date.
+    """
+    history = []
+    likes = shares = comments = 0
+    for timestep in range(history_length):
+        likes += rng.randint(0, 50)
+        shares += rng.randint(0, 10)
+        comments += rng.randint(0, 20)
+        history.append(
+            {
+                "timestep": timestep,
+                "date": str(posting_date + timedelta(hours=timestep)),
+                "score": round(rng.uniform(0.1, 5.0), 2),
+                "actual": {
+                    "likeCount": likes,
+                    "shareCount": shares,
+                    "commentCount": comments,
+                },
+                "expected": {
+                    "likeCount": likes // 2 + timestep,
+                    "shareCount": shares // 2 + timestep,
+                    "commentCount": comments // 2 + timestep,
+                },
+            }
+        )
+    # CrowdTangle returns the most recent timestep first
+    history.reverse()
+    return history
+
+
+def make_post(posting_date, post_index, account_index, history_length=0):
+    """
+    Used by make_posts_response and make_post_details_response.
+
+    Return a post object.  The post is determined by its arguments alone, so a
+    post in a /posts response has the same details as the post returned for its
+    platformId.  history is only included if history_length > 0.
+    """
+    account = make_account(account_index)
+    rng = random.Random(f"{posting_date.isoformat()}-{post_index}")
+    # platformId encodes everything needed to rebuild the post, see
+    # make_post_details_response
+    timestamp = int(posting_date.replace(tzinfo=timezone.utc).timestamp())
+    post_id = timestamp * 1000 + post_index
+
+    post = {
+        "platformId": f"{account['platformId']}_{post_id}",
+        "platform": "Facebook",
+        "date": str(posting_date),
+        "updated": str(posting_date + timedelta(hours=history_length)),
+        "type": rng.choice(["link", "photo", "status", "native_video"]),
+        "title": f"Title of post {post_id}",
+        "caption": "example.com",
+        "description": "Description " * rng.randint(1, 20),
+        "message": "Message " * rng.randint(1, 50),
+        "expandedLinks": [
+            {
+                "original": f"https://example.com/{post_id}",
+                "expanded": f"https://example.com/{post_id}",
+            }
+        ],
+        "link": f"https://example.com/{post_id}",
+        "postUrl": f"https://www.facebook.com/{account['handle']}/posts/{post_id}",
+        "subscriberCount": account["subscriberCount"],
+        "score": round(rng.uniform(0.1, 5.0), 2),
+        "account": account,
+    }
+    if history_length > 0:
+        post["history"] = make_history(posting_date, history_length, rng)
+
+    return post
+
+
+def get_posting_dates(start, end, posts_per_hour):
+    """
+    Used by make_posts_response.
+
+    Return (posting_date, post_index) of every post in [start, end), newest
+    first as when sorting by date.
+    """
+    posting_dates = []
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        for post_index in range(posts_per_hour):
+            posting_date = hour + timedelta(seconds=post_index * 3600 // posts_per_hour)
+            if start <= posting_date < end:
+                posting_dates.append((posting_date, post_index))
+        hour += timedelta(hours=1)
+    posting_dates.reverse()
+    return posting_dates
+
+
+def make_posts_response(
+    base_url, token, start, end, count=100, offset=0, posts_per_hour=100, accounts=50
+):
+    """
+    Used by ct_mock_api.
+
+    Return a /posts response for posts dated in [start, end).  If more than count
+    posts match, pagination.nextPage holds the URL of the next page.
+    posts_per_hour must be below 1000.
+    """
+    posting_dates = get_posting_dates(start, end, posts_per_hour)
+    page = posting_dates[offset : offset + count]
+
+    result = {
+        "posts": [
+            make_post(posting_date, post_index, post_index % accounts)
+            for posting_date, post_index in page
+        ],
+        "pagination": {},
+    }
+    if offset + count < len(posting_dates):
+        query = urlencode(
+            {
+                "token": token,
+                "sortBy": "date",
+                "endDate": end.isoformat(timespec="seconds"),
+                "startDate": start.isoformat(timespec="seconds"),
+                "count": count,
+                "offset": offset + count,
+            }
+        )
+        result["pagination"]["nextPage"] = f"{base_url}/posts?{query}"
+
+    return {"status": 200, "result": result}
+
+
+def make_post_details_response(platform_id, history_length=51):
+    """
+    Used by ct_mock_api.
+
+    Return a /post/{platform_id}?includeHistory=True response.  platform_id must
+    be one returned by make_posts_response.  Returns None otherwise.
+    """
+    try:
+        account_platform_id, post_id = (int(part) for part in platform_id.split("_"))
+    except ValueError:
+        return None
+
+    posting_date = datetime.fromtimestamp(post_id // 1000, timezone.utc).replace(
+        tzinfo=None
+    )
+    post = make_post(
+        posting_date, post_id % 1000, account_platform_id - 1000, history_length
+    )
+
+    return {"status": 200, "result": {"posts": [post]}}
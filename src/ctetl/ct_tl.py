@@ -1,12 +1,24 @@
 # ct_tl
 
-import pandas as pd
-
+import msgspec
 import psycopg2
+from psycopg2.extras import execute_values
 
+import queue
 import sys
+import threading
+import time
+from datetime import datetime
+from collections import OrderedDict
+from urllib.parse import unquote_plus
 
-from .ct_helpers import load_db_credentials
+from . import ct_metrics
+from .ct_db import get_psycopg2_connection, create_load_watermarks_table
+from .ct_profile import span, traced
+from .ct_minio import get_minio_object_data, get_minio_object_names
+from .ct_minio import get_object_basename
+from .ct_minio import BackgroundUploader
+from .ct_schema import HISTORY_METRICS, decode_post_details
 
 
 def load_columns_to_extract():
@@ -116,194 +128,714 @@ def queries_for_insert():
     return ACCOUNTS_INSERT_QUERY, POSTS_INSERT_QUERY, POST_METRICS_INSERT_QUERY
 
 
-def recast_accounts(accounts_df):
+def get_post_metric_rows(post, as_of):
+    """
+    Used by transform_post_details.
+
+    Return a row for every metric of every history entry of post, a
+    ct_schema.Post.  Metrics are named after the metric group and the metric,
+    e.g. 'actual.likeCount', and the rows of a metric are kept together.
+    Every row of post shares the same platform_id, as_of, metric_name and
+    metric_timestamp objects, which bounds the memory of rows waiting in
+    batches for insert.
+    """
+    metric_names = {}
+    for entry in post.history:
+        for metric_group in HISTORY_METRICS:
+            for metric in getattr(entry, metric_group):
+                metric_names.setdefault(
+                    (metric_group, metric), f"{metric_group}.{metric}"
+                )
+
+    post_metric_rows = []
+    for (metric_group, metric), metric_name in metric_names.items():
+        for entry in post.history:
+            metric_value = getattr(entry, metric_group).get(metric)
+            if metric_value is None:
+                continue
+            post_metric_rows.append(
+                (
+                    post.platform_id,
+                    as_of,
+                    entry.score,
+                    metric_name,
+                    metric_value,
+                    entry.date,
+                    entry.timestep,
+                )
+            )
+
+    return post_metric_rows
+
+
+@traced("transform")
+def transform_post_details(post_details, detail_object_name):
     """
     Used by ct_transform_and_load.
 
-    Recast dtypes prior to uploading to PostgreSQL.
-    """
-
-    recast_accounts_df = accounts_df.astype(
-        {
-            "account_id": "int64",
-            "account_name": "string",
-            "account_handle": "string",
-            "account_url": "string",
-            "account_platform": "string",
-            "account_platform_id": "int64",
-            "account_type": "string",
-            "account_page_admin_top_country": "string",
-            "account_page_description": "string",
-            "account_page_created_date": "datetime64[ns]",
-            "account_page_category": "string",
-        }
-    )
+    Transform post details data in preparation for uploading to PostgreSQL.
+    post_details is the raw JSON of a post details object, or the same
+    already parsed with json.loads.  Only the fields declared in ct_schema are
+    decoded, and rows are built from them in the column order of
+    load_columns_to_extract.  Exits if post_details does not match the schema.
+
+    """
+    try:
+        with span("decode"):
+            details = decode_post_details(post_details)
+    except msgspec.DecodeError as e:
+        # Also catches msgspec.ValidationError, a subclass
+        print(f"Invalid post details in {detail_object_name}: {e}")
+        sys.exit(1)
 
-    recast_accounts_df["account_verified"] = (
-        accounts_df["account_verified"]
-        .map({"False": False, "True": True})
-        .astype("bool")
+    as_of = datetime.fromisoformat(
+        get_object_basename(detail_object_name).split("_")[2]
     )
 
-    return recast_accounts_df
+    accounts_to_insert = []
+    posts_to_insert = []
+    post_metrics_to_insert = []
+    for post in details.result.posts:
+        account = post.account
+        accounts_to_insert.append(
+            (
+                account.id,
+                account.name,
+                account.handle,
+                account.url,
+                account.platform,
+                account.platform_id,
+                account.account_type,
+                account.page_admin_top_country,
+                account.page_description,
+                account.page_created_date,
+                account.page_category,
+                account.verified,
+            )
+        )
+        posts_to_insert.append(
+            (
+                post.platform_id,
+                post.platform,
+                post.date,
+                post.type,
+                post.title,
+                post.caption,
+                post.description,
+                post.message,
+                # Stored as the text of the list of links
+                "" if post.expanded_links is None else str(post.expanded_links),
+                post.link,
+                post.post_url,
+                post.subscriber_count,
+                account.id,
+            )
+        )
+        post_metrics_to_insert.extend(get_post_metric_rows(post, as_of))
 
+    print(detail_object_name)
+    return accounts_to_insert, posts_to_insert, post_metrics_to_insert
+
+
+# Set once load_watermarks is known to exist, see insert_to_postgres
+LOAD_WATERMARKS_CREATED = False
 
-def recast_posts(posts_df):
+
+@traced("insert")
+def insert_to_postgres(
+    accounts_insert_query,
+    posts_insert_query,
+    post_metrics_insert_query,
+    accounts_to_insert,
+    posts_to_insert,
+    post_metrics_to_insert,
+    posting_days=(),
+):
     """
     Used by ct_transform_and_load.
 
-    Recast dtypes prior to uploading to PostgreSQL.
-    """
-
-    recast_posts_df = posts_df.astype(
-        {
-            "platform_id": "string",
-            "platform": "string",
-            "posting_date": "datetime64[ns]",
-            "post_type": "string",
-            "title": "string",
-            "caption": "string",
-            "description": "string",
-            "post_message": "string",
-            "expanded_links": "string",
-            "post_link": "string",
-            "post_url": "string",
-            "subscriber_count": "int64",
-            "account_id": "int64",
-        }
-    )
+    Upload transformed data to PostgreSQL.  The load watermarks of
+    posting_days, the days posts of the rows were posted, are advanced in
+    the same transaction.
 
-    return recast_posts_df
+    """
+    global LOAD_WATERMARKS_CREATED
 
+    start = time.perf_counter()
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                # Insert records
+                cursor.executemany(accounts_insert_query, accounts_to_insert)
+                cursor.executemany(posts_insert_query, posts_to_insert)
+                cursor.executemany(post_metrics_insert_query, post_metrics_to_insert)
 
-def recast_post_metrics(post_metrics_df):
+                if posting_days:
+                    if not LOAD_WATERMARKS_CREATED:
+                        create_load_watermarks_table(cursor)
+                        LOAD_WATERMARKS_CREATED = True
+                    execute_values(
+                        cursor,
+                        "INSERT INTO load_watermarks VALUES %s ON CONFLICT (posting_day) "
+                        "DO UPDATE SET loaded_at = EXCLUDED.loaded_at",
+                        [(posting_day,) for posting_day in sorted(posting_days)],
+                        template="(%s, now())",
+                    )
+
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        ct_metrics.increment("ct_postgres_errors_total")
+        sys.exit(1)
+
+    # Leaving the connection block commits, so this includes commit time
+    ct_metrics.observe("ct_postgres_insert_seconds", time.perf_counter() - start)
+    for table, rows in (
+        ("accounts", accounts_to_insert),
+        ("posts", posts_to_insert),
+        ("post_metrics", post_metrics_to_insert),
+    ):
+        ct_metrics.increment("ct_postgres_rows_total", len(rows), table=table)
+
+
+@traced("query_watermarks")
+def query_metric_watermarks(platform_ids):
+    """
+    Used by flush_detail_objects.
+
+    Return {platform_id: highest metric_timestep stored} for platform_ids.
+    Posts with no stored metrics are not included.
+
+    """
+    if not platform_ids:
+        return {}
+
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT platform_id, MAX(metric_timestep) FROM post_metrics "
+                    "WHERE platform_id = ANY(%s) GROUP BY platform_id",
+                    (list(platform_ids),),
+                )
+                return dict(cursor.fetchall())
+
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+
+class KnownKeysCache:
+    """
+    Bounded LRU set of keys already persisted to PostgreSQL, e.g. account_ids.
+    Used by the loader to skip rows that would be discarded by ON CONFLICT.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.keys:
+                self.keys.move_to_end(key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.keys[key] = None
+                self.keys.move_to_end(key)
+            while len(self.keys) > self.maxsize:
+                self.keys.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            hit_rate = self.hits / lookups if lookups else 0.0
+            return {
+                "size": len(self.keys),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": hit_rate,
+            }
+
+
+class MetricWatermarksCache:
+    """
+    Bounded LRU map of platform_id to the highest metric_timestep loaded to
+    PostgreSQL, see filter_post_metrics.  Kept for the lifetime of long-running
+    loaders, so posts evicted are looked up again with query_metric_watermarks.
+    Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.watermarks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, platform_id):
+        with self.lock:
+            return platform_id in self.watermarks
+
+    def __len__(self):
+        with self.lock:
+            return len(self.watermarks)
+
+    def get(self, platform_id, default=None):
+        with self.lock:
+            if platform_id not in self.watermarks:
+                return default
+            self.watermarks.move_to_end(platform_id)
+            return self.watermarks[platform_id]
+
+    def setdefault(self, platform_id, default):
+        with self.lock:
+            if platform_id not in self.watermarks:
+                self.set_watermark(platform_id, default)
+            return self.watermarks[platform_id]
+
+    def update(self, watermarks):
+        with self.lock:
+            for platform_id, metric_timestep in watermarks.items():
+                self.set_watermark(platform_id, metric_timestep)
+
+    def set_watermark(self, platform_id, metric_timestep):
+        # Callers hold self.lock
+        self.watermarks[platform_id] = metric_timestep
+        self.watermarks.move_to_end(platform_id)
+        while len(self.watermarks) > self.maxsize:
+            self.watermarks.popitem(last=False)
+
+
+def create_known_keys_caches(maxsize=100000):
     """
     Used by ct_transform_and_load.
 
-    Recast dtypes prior to uploading to PostgreSQL.
+    Create caches of account_ids and platform_ids already in PostgreSQL,
+    warmed with up to maxsize accounts and the maxsize most recent posts.
+
     """
+    known_accounts = KnownKeysCache(maxsize)
+    known_posts = KnownKeysCache(maxsize)
 
-    recast_post_metrics_df = post_metrics_df.astype(
-        {
-            "platform_id": "string",
-            "as_of": "datetime64[ns]",
-            "score": "float64",
-            "metric_name": "string",
-            "metric_value": "int64",
-            "metric_timestamp": "datetime64[ns]",
-            "metric_timestep": "int64",
-        }
-    )
+    try:
+        with get_psycopg2_connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT account_id FROM accounts LIMIT %s", (maxsize,))
+                known_accounts.add(*(row[0] for row in cursor.fetchall()))
+                # Oldest first so the most recent posts are the last evicted
+                cursor.execute(
+                    "SELECT platform_id FROM (SELECT platform_id, posting_date FROM posts "
+                    "ORDER BY posting_date DESC LIMIT %s) recent ORDER BY posting_date",
+                    (maxsize,),
+                )
+                known_posts.add(*(row[0] for row in cursor.fetchall()))
+
+    except psycopg2.DatabaseError as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
 
-    return recast_post_metrics_df
+    return known_accounts, known_posts
 
 
-def transform_post_details(minio_response_js, detail_object_name):
+def print_known_keys_stats(known_accounts, known_posts):
     """
     Used by ct_transform_and_load.
 
-    Transform post details data in preparation for uploading to PostgreSQL.
+    Print hit/miss statistics of the known accounts and posts caches.
 
     """
-    accounts_cols, posts_cols, post_metrics_cols = load_columns_to_extract()
-    (
-        accounts_cols_remap,
-        posts_cols_remap,
-        post_metrics_cols_remap,
-    ) = load_column_remaps()
-
-    # Create intermediary df to make accounts_df and posts_df from posts object
-    pa_df = pd.json_normalize(minio_response_js, record_path=["result", "posts"])
-
-    # Create accounts_df
-    accounts_df = pa_df[accounts_cols].rename(columns=accounts_cols_remap)
-    
-    # Have to find the intersection of columns in pa_df and posts_cols
-    # if an attempt to extract columns in posts_cols not present in pa_df is made
-    # a KeyError will be raised
-    present_post_columns = list(set(pa_df.columns).intersection(posts_cols))
-    
-    # Extract present columns from pa_df
-    posts_df = pa_df[present_post_columns]
-    
-    # Create any missing columns from post_cols and fill with empty value.  Rename
-    posts_df = posts_df.reindex(columns=posts_cols, fill_value='').rename(columns=posts_cols_remap)
-
-    # Create post_metrics_df from history object
-    history_df = pd.json_normalize(
-        minio_response_js, record_path=["result", "posts", "history"]
-    )
+    for name, known_keys in (("accounts", known_accounts), ("posts", known_posts)):
+        stats = known_keys.stats()
+        print(
+            f"Known {name} cache: {stats['size']} keys, {stats['hits']} hits, "
+            f"{stats['misses']} misses, {stats['hit_rate']:.1%} hit rate"
+        )
 
-    # Melt/unpivot the metrics and metric values to two columns
-    melted_df = pd.melt(
-        history_df,
-        id_vars=["timestep", "date", "score"],
-        var_name="metric_name",
-        value_name="metric_value",
-    )
 
-    # Include other data for referencing
-    melted_df["platform_id"] = pa_df.platformId[0]
-    melted_df["as_of"] = detail_object_name.split("_")[2]
+def filter_known_rows(rows_to_insert, known_keys):
+    """
+    Used by flush_detail_objects.
+
+    Drop rows whose key (first column) is in known_keys, and repeats of a key
+    within rows_to_insert.
+
+    Returns the kept rows.
+
+    """
+    kept_rows = []
+    seen = set()
+
+    for row in rows_to_insert:
+        if row[0] in seen or row[0] in known_keys:
+            continue
+        seen.add(row[0])
+        kept_rows.append(row)
+
+    return kept_rows
+
+
+def filter_post_metrics(post_metrics_to_insert, metric_watermarks):
+    """
+    Used by flush_detail_objects.
+
+    Every post details payload carries the full history of the post, so most
+    metric rows were already loaded from an earlier fetch.  Keep only rows with
+    a metric_timestep at or above the post's watermark in metric_watermarks.
+    The watermark timestep is kept as it may still be in progress, with values
+    that change between fetches.  Of the rows of each (platform_id,
+    metric_name, metric_timestep), only the last is kept, in case the same post
+    was fetched more than once in a batch.
+
+    Returns the kept rows and {platform_id: highest metric_timestep kept}.
+
+    """
+    kept_rows = []
+    kept_watermarks = {}
+    seen = set()
+
+    # Walk backwards so the last fetch of a repeated row is the one kept
+    for row in reversed(post_metrics_to_insert):
+        platform_id, metric_name, metric_timestep = row[0], row[3], row[6]
+        if metric_timestep < metric_watermarks.get(platform_id, -1):
+            continue
+        if (platform_id, metric_name, metric_timestep) in seen:
+            continue
+        seen.add((platform_id, metric_name, metric_timestep))
+        kept_rows.append(row)
+        kept_watermarks[platform_id] = max(
+            metric_timestep, kept_watermarks.get(platform_id, -1)
+        )
+
+    kept_rows.reverse()
+    return kept_rows, kept_watermarks
+
+
+def load_detail_objects(
+    minio_client,
+    details_bucket,
+    tags,
+    detail_object_names,
+    batch_size=50,
+    metric_watermarks=None,
+    known_accounts=None,
+    known_posts=None,
+    parquet_sink=None,
+):
+    """
+    Used by ct_transform_and_load.
 
-    # Rearrange columns and amend column names, filter out rows on platform_id that was expressed as a metric
-    post_metrics_df = melted_df[post_metrics_cols].rename(
-        columns=post_metrics_cols_remap
+    Transform untagged detail objects and load them to PostgreSQL in batches
+    of batch_size objects.  Objects are tagged only after their batch is
+    committed so a failed batch is retried on the next run.
+
+    metric_watermarks, a MetricWatermarksCache, maps platform_id to the
+    highest metric_timestep loaded and is updated in place.  Pass the same
+    cache to later calls to avoid querying PostgreSQL for posts already seen.  Likewise known_accounts and
+    known_posts are KnownKeysCache instances of rows already persisted, see
+    create_known_keys_caches.  Without them every row is sent to PostgreSQL.
+
+    If parquet_sink (a ct_parquet.ParquetSink) is given, loaded rows are also
+    written to it.
+
+    """
+    details_batcher = PostDetailsBatcher(
+        minio_client,
+        details_bucket,
+        tags,
+        batch_size,
+        metric_watermarks,
+        known_accounts,
+        known_posts,
+        parquet_sink=parquet_sink,
     )
-    condition = post_metrics_df["metric_name"] == "platform_id"
-    post_metrics_filtered_df = post_metrics_df[~condition]
 
-    # Recast to correct dtypes
-    recast_accounts_df = recast_accounts(accounts_df)
-    recast_posts_df = recast_posts(posts_df)
-    recast_post_metrics_df = recast_post_metrics(post_metrics_filtered_df)
+    for detail_object_name in detail_object_names:
+        tagged = minio_client.get_object_tags(details_bucket, detail_object_name)
+        if tagged:
+            continue
 
-    # Convert DataFrames to a list of dictionaries
-    accounts_to_insert = [
-        tuple(row) for row in recast_accounts_df.itertuples(index=False, name=None)
-    ]
-    posts_to_insert = [
-        tuple(row) for row in recast_posts_df.itertuples(index=False, name=None)
-    ]
-    post_metrics_to_insert = [
-        tuple(row) for row in recast_post_metrics_df.itertuples(index=False, name=None)
-    ]
-    
-    print(detail_object_name)
-    return accounts_to_insert, posts_to_insert, post_metrics_to_insert
+        # Decoded by transform_post_details, see ct_schema
+        post_details = get_minio_object_data(
+            detail_object_name, details_bucket, minio_client
+        )
+        details_batcher.add(post_details, detail_object_name)
 
+    details_batcher.close()
 
-def insert_to_postgres(
-    accounts_insert_query,
-    posts_insert_query,
-    post_metrics_insert_query,
+
+class PostDetailsBatcher:
+    """
+    Transform post details as they are added and load them to PostgreSQL in
+    batches of batch_size posts.  Objects in details_bucket are tagged once
+    their batch is committed.  See load_detail_objects for the other arguments.
+
+    Post details that are not yet in MinIO can be archived through the batcher
+    by passing the request response to add.  They are uploaded in the
+    background by uploader, a ct_minio.BackgroundUploader, or one of the
+    batcher's own if None, and waited on before their objects are tagged.
+    """
+
+    def __init__(
+        self,
+        minio_client,
+        details_bucket,
+        tags,
+        batch_size=50,
+        metric_watermarks=None,
+        known_accounts=None,
+        known_posts=None,
+        uploader=None,
+        parquet_sink=None,
+    ):
+        self.minio_client = minio_client
+        self.details_bucket = details_bucket
+        self.tags = tags
+        self.batch_size = batch_size
+        self.metric_watermarks = (
+            MetricWatermarksCache() if metric_watermarks is None else metric_watermarks
+        )
+        self.known_accounts = (
+            KnownKeysCache(0) if known_accounts is None else known_accounts
+        )
+        self.known_posts = KnownKeysCache(0) if known_posts is None else known_posts
+        # An uploader of the batcher's own is closed with it
+        self.own_uploader = uploader is None
+        self.uploader = BackgroundUploader(minio_client) if uploader is None else uploader
+        self.parquet_sink = parquet_sink
+        self.reset_batch()
+
+    def reset_batch(self):
+        self.accounts_to_insert = []
+        self.posts_to_insert = []
+        self.post_metrics_to_insert = []
+        self.batch_object_names = []
+
+    def add(self, post_details, detail_object_name, request_response=None):
+        """
+        Transform post_details, raw or parsed JSON, and add it to the batch.  If request_response
+        is given, it is uploaded to details_bucket as detail_object_name.
+        """
+        if request_response is not None:
+            self.uploader.put(
+                self.details_bucket, detail_object_name, request_response.content
+            )
+
+        accounts, posts, post_metrics = transform_post_details(
+            post_details, detail_object_name
+        )
+        self.accounts_to_insert.extend(accounts)
+        self.posts_to_insert.extend(posts)
+        self.post_metrics_to_insert.extend(post_metrics)
+        self.batch_object_names.append(detail_object_name)
+
+        if len(self.batch_object_names) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Load and tag the current batch, if any.
+        """
+        if not self.batch_object_names:
+            return
+
+        flush_detail_objects(
+            self.minio_client,
+            self.details_bucket,
+            self.tags,
+            self.batch_object_names,
+            self.accounts_to_insert,
+            self.posts_to_insert,
+            self.post_metrics_to_insert,
+            self.metric_watermarks,
+            self.known_accounts,
+            self.known_posts,
+            self.uploader,
+            self.parquet_sink,
+        )
+        self.reset_batch()
+
+    def close(self):
+        """
+        Flush the last batch and wait for all uploads.
+        """
+        self.flush()
+        if self.own_uploader:
+            self.uploader.close()
+
+
+@traced("flush")
+def flush_detail_objects(
+    minio_client,
+    details_bucket,
+    tags,
+    batch_object_names,
     accounts_to_insert,
     posts_to_insert,
     post_metrics_to_insert,
+    metric_watermarks,
+    known_accounts,
+    known_posts,
+    uploader=None,
+    parquet_sink=None,
 ):
     """
-    Used by ct_transform_and_load.
+    Used by PostDetailsBatcher.
 
-    Upload transformed data to PostgreSQL.
+    Insert one batch of transformed rows, then tag the objects they came from
+    once uploads pending in uploader, if given, are done.  Rows already
+    loaded are dropped before insert, see filter_known_rows and
+    filter_post_metrics.  parquet_sink is given every row of the batch, as rows
+    already in PostgreSQL may not be in Parquet yet, and drops repeats itself.
 
     """
+    # posting_date is the third column of posts.  Taken before filtering
+    # as posts already loaded still have new metrics.
+    posting_dates = {row[0]: row[2] for row in posts_to_insert}
+    batch_rows = (accounts_to_insert, posts_to_insert, post_metrics_to_insert)
 
-    PGUSER, PGPASSWD, PGHOST, PGPORT, PGDB = load_db_credentials()
+    accounts_to_insert = filter_known_rows(accounts_to_insert, known_accounts)
+    posts_to_insert = filter_known_rows(posts_to_insert, known_posts)
 
-    try:
-        with psycopg2.connect(
-            database=PGDB,
-            user=PGUSER,
-            password=PGPASSWD,
-            host=PGHOST,
-            port=PGPORT,
-        ) as connection:
-            with connection.cursor() as cursor:
-                # Insert records
-                cursor.executemany(accounts_insert_query, accounts_to_insert)
-                cursor.executemany(posts_insert_query, posts_to_insert)
-                cursor.executemany(post_metrics_insert_query, post_metrics_to_insert)
+    # Fall back to PostgreSQL for posts not seen by this process
+    unseen_platform_ids = {
+        row[0] for row in post_metrics_to_insert if row[0] not in metric_watermarks
+    }
+    metric_watermarks.update(query_metric_watermarks(unseen_platform_ids))
+    for platform_id in unseen_platform_ids:
+        metric_watermarks.setdefault(platform_id, -1)
 
-    except psycopg2.DatabaseError as e:
-        print(f"Database error: {e}")
-        sys.exit(1)
+    post_metrics_to_insert, kept_watermarks = filter_post_metrics(
+        post_metrics_to_insert, metric_watermarks
+    )
+
+    insert_to_postgres(
+        *queries_for_insert(),
+        accounts_to_insert,
+        posts_to_insert,
+        post_metrics_to_insert,
+        {posting_date.date() for posting_date in posting_dates.values()},
+    )
+
+    # Advance watermarks and caches only once the rows are committed
+    metric_watermarks.update(kept_watermarks)
+    known_accounts.add(*(row[0] for row in accounts_to_insert))
+    known_posts.add(*(row[0] for row in posts_to_insert))
+
+    if parquet_sink is not None:
+        parquet_sink.add(*batch_rows, posting_dates)
+
+    # Objects can only be tagged once they exist.  wait exits if an upload
+    # failed, leaving the batch untagged.
+    if uploader is not None:
+        uploader.wait()
+
+    # Tag the objects to prevent reprocessing
+    with span("tag", objects=len(batch_object_names)):
+        for detail_object_name in batch_object_names:
+            minio_client.set_object_tags(details_bucket, detail_object_name, tags)
+
+
+def listen_for_detail_objects(minio_client, details_bucket, object_name_queue):
+    """
+    Used by listen_and_load.
+
+    Put the name of every object created in details_bucket on object_name_queue.
+    Reconnects if the notification stream drops.  Runs until the process exits.
+
+    """
+    while True:
+        try:
+            with minio_client.listen_bucket_notification(
+                details_bucket, events=["s3:ObjectCreated:*"]
+            ) as events:
+                for event in events:
+                    for record in event.get("Records", []):
+                        # Object keys are URL encoded in notifications
+                        object_name_queue.put(
+                            unquote_plus(record["s3"]["object"]["key"])
+                        )
+        except Exception as e:
+            print(f"Bucket notification error, reconnecting: {e}")
+            time.sleep(5)
+
+
+def listen_and_load(
+    minio_client,
+    details_bucket,
+    tags,
+    batch_size=50,
+    batch_wait=5,
+    sweep_interval=3600,
+    parquet_sink=None,
+):
+    """
+    Used by ct_transform_and_load.
+
+    Long-running mode.  Transform and load detail objects as soon as MinIO
+    notifies that they were created.  A batch is loaded once it holds
+    batch_size objects or no new object arrived for batch_wait seconds.
+
+    Notifications are not delivered while disconnected, so a reconciliation
+    sweep over the whole bucket runs at startup and every sweep_interval seconds.
+    parquet_sink is as for load_detail_objects.
+
+    """
+    object_name_queue = queue.Queue()
+    listener = threading.Thread(
+        target=listen_for_detail_objects,
+        args=(minio_client, details_bucket, object_name_queue),
+        daemon=True,
+    )
+    listener.start()
+
+    next_sweep = time.monotonic()
+    detail_object_names = []
+
+    # Kept for the lifetime of the process to skip redundant queries and inserts
+    metric_watermarks = MetricWatermarksCache()
+    known_accounts, known_posts = create_known_keys_caches()
+
+    while True:
+        if time.monotonic() >= next_sweep:
+            load_detail_objects(
+                minio_client,
+                details_bucket,
+                tags,
+                get_minio_object_names(minio_client, details_bucket),
+                batch_size,
+                metric_watermarks,
+                known_accounts,
+                known_posts,
+                parquet_sink,
+            )
+            next_sweep = time.monotonic() + sweep_interval
+            print_known_keys_stats(known_accounts, known_posts)
+
+        try:
+            detail_object_names.append(object_name_queue.get(timeout=batch_wait))
+            if len(detail_object_names) < batch_size:
+                continue
+        except queue.Empty:
+            pass
+
+        if detail_object_names:
+            load_detail_objects(
+                minio_client,
+                details_bucket,
+                tags,
+                detail_object_names,
+                batch_size,
+                metric_watermarks,
+                known_accounts,
+                known_posts,
+                parquet_sink,
+            )
+            detail_object_names = []
@@ -0,0 +1,278 @@
+# ct_web.py
+
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from . import ct_metrics
+from .ct_profile import traced
+
+
+#### Web functions
+
+# Shared by every request of the process, see get_http_session
+HTTP_SESSION = None
+
+
+def get_http_session():
+    """
+    Used by request_with_backoff.
+
+    Return the process-wide requests session, creating it on first use.
+    Reusing the session keeps connections to the API alive between requests.
+    """
+    global HTTP_SESSION
+
+    if HTTP_SESSION is None:
+        session = requests.Session()
+        # 429 is not retried here but by ct_extract.request_when_healthy, so
+        # every process sharing the rate limiter is paused
+        retries = Retry(
+            total=5,
+            backoff_factor=2,
+            status_forcelist=[500, 502, 503, 504],
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        HTTP_SESSION = session
+
+    return HTTP_SESSION
+
+
+#### Endpoint health
+
+# Outcomes of failed requests, see EndpointHealth.record_failure
+THROTTLED = "throttled"
+UNAVAILABLE = "unavailable"
+REJECTED = "rejected"
+
+# {endpoint: EndpointHealth} of every endpoint requested by the process
+ENDPOINT_HEALTH = {}
+ENDPOINT_HEALTH_LOCK = threading.Lock()
+
+
+class EndpointHealth:
+    """
+    Health of an API endpoint as seen by the requests of this process.
+
+    After failure_threshold consecutive failures of an unavailable endpoint,
+    after the retries of get_http_session, the circuit breaker opens: no
+    requests are sent for open_seconds.  Then a single trial request is let
+    through, which closes the circuit if it succeeds or opens it again if not.
+    Throttled (429) and rejected (other 4xx) requests don't count towards the
+    circuit, as the endpoint is up.
+    """
+
+    def __init__(self, endpoint, failure_threshold=3, open_seconds=300):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = None
+        self.trial_in_flight = False
+        self.last_failure = None
+        self.retry_after = None
+
+    def wait_seconds(self):
+        """
+        Return the seconds until a request may be sent to the endpoint, 0 if
+        one may be sent now.  While half open, only the first caller gets 0.
+        """
+        with self.lock:
+            if self.open_until is None:
+                return 0
+            wait_seconds = self.open_until - time.monotonic()
+            if wait_seconds > 0:
+                return wait_seconds
+            if self.trial_in_flight:
+                # Check again once the trial request had time to finish
+                return 1
+            self.trial_in_flight = True
+            return 0
+
+    def record_success(self):
+        with self.lock:
+            if self.open_until is not None:
+                print(f"Endpoint {self.endpoint} is healthy again, closing circuit.")
+            self.consecutive_failures = 0
+            self.open_until = None
+            self.trial_in_flight = False
+            self.last_failure = None
+            self.retry_after = None
+
+    def record_failure(self, outcome, retry_after=None):
+        """
+        Record a failed request.  outcome is THROTTLED, UNAVAILABLE or
+        REJECTED, and retry_after the seconds to wait given by the server.
+        """
+        with self.lock:
+            self.last_failure = outcome
+            self.retry_after = retry_after
+            self.trial_in_flight = False
+            if outcome != UNAVAILABLE:
+                return
+
+            self.consecutive_failures += 1
+            if (
+                self.open_until is not None
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                open_seconds = max(self.open_seconds, retry_after or 0)
+                self.open_until = time.monotonic() + open_seconds
+                print(
+                    f"Endpoint {self.endpoint} unavailable after "
+                    f"{self.consecutive_failures} failures, opening circuit "
+                    f"for {open_seconds:.0f}s."
+                )
+                ct_metrics.increment(
+                    "ct_http_circuit_opened_total", endpoint=self.endpoint
+                )
+
+    def status(self):
+        """
+        Return 'closed', 'open' or 'half_open'.
+        """
+        with self.lock:
+            if self.open_until is None:
+                return "closed"
+            if self.open_until > time.monotonic():
+                return "open"
+            return "half_open"
+
+
+def get_endpoint(url):
+    """
+    Used by request_with_backoff and get_endpoint_health.
+
+    Return the endpoint of url, e.g. "posts" or "post".  Label by endpoint,
+    never by the URL as it holds the API key.
+    """
+    return urlparse(url).path.strip("/").split("/")[0]
+
+
+def get_endpoint_health(url):
+    """
+    Used by request_with_backoff and ct_extract.
+
+    Return the EndpointHealth of the endpoint of url, creating it on first use.
+    """
+    endpoint = get_endpoint(url)
+    with ENDPOINT_HEALTH_LOCK:
+        if endpoint not in ENDPOINT_HEALTH:
+            ENDPOINT_HEALTH[endpoint] = EndpointHealth(endpoint)
+        return ENDPOINT_HEALTH[endpoint]
+
+
+def get_endpoint_health_report():
+    """
+    Return {endpoint: (circuit status, consecutive failures, last failure)}
+    of every endpoint requested by the process.
+    """
+    with ENDPOINT_HEALTH_LOCK:
+        endpoint_healths = list(ENDPOINT_HEALTH.values())
+    return {
+        health.endpoint: (
+            health.status(),
+            health.consecutive_failures,
+            health.last_failure,
+        )
+        for health in endpoint_healths
+    }
+
+
+def get_retry_after(response):
+    """
+    Used by request_with_backoff.
+
+    Return the seconds to wait of the Retry-After header of response, given
+    in seconds or as an HTTP date, or None if there is none.
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+@traced("fetch")
+def request_with_backoff(url, headers=None):
+    """
+    Used by ct_posts_to_minio and ct_post_details_to_minio.
+
+    Retries requests a total=total times, sleeping between retries
+    for backoff_factor**retry number.  If status not in status_forcelist
+    is received, request will not be retried.
+
+    Returns response if successful.
+
+    Prints error message and returns None if response is not successful.
+    The outcome is recorded in the EndpointHealth of url, which tells apart
+    throttled (429, with the Retry-After of the server), unavailable and
+    rejected requests.
+
+    """
+
+    session = get_http_session()
+
+    endpoint = get_endpoint(url)
+    health = get_endpoint_health(url)
+    start = time.perf_counter()
+
+    try:
+        response = session.get(url, headers=headers)
+        record_request_metrics(endpoint, start, response)
+        response.raise_for_status()
+        health.record_success()
+        return response
+    except requests.exceptions.RequestException as e:
+        print(f"Requests error after retrying.  Error: {e}")
+        response = getattr(e, "response", None)
+        if response is None:
+            record_request_metrics(endpoint, start, None)
+            health.record_failure(UNAVAILABLE)
+        elif response.status_code == 429:
+            ct_metrics.increment("ct_http_throttled_total", endpoint=endpoint)
+            health.record_failure(THROTTLED, get_retry_after(response))
+        elif response.status_code >= 500:
+            health.record_failure(UNAVAILABLE, get_retry_after(response))
+        else:
+            health.record_failure(REJECTED)
+        return None
+
+
+def record_request_metrics(endpoint, start, response):
+    """
+    Used by request_with_backoff.
+
+    Record latency, final status and number of retries of a request.
+    response is None if no response was received.
+    """
+    if not ct_metrics.METRICS_ENABLED:
+        return
+
+    status = "error" if response is None else str(response.status_code)
+    ct_metrics.observe(
+        "ct_http_request_seconds", time.perf_counter() - start, endpoint=endpoint
+    )
+    ct_metrics.increment("ct_http_requests_total", endpoint=endpoint, status=status)
+
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    if retries is not None and retries.history:
+        ct_metrics.increment(
+            "ct_http_retries_total", len(retries.history), endpoint=endpoint
+        )
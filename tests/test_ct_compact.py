@@ -0,0 +1,243 @@
+import pytest
+
+import gzip
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from unittest.mock import MagicMock, patch
+
+from minio.error import S3Error
+
+from ctetl.ct_compact import compact_day, iter_segment_objects
+from ctetl.ct_compact import read_segment_object, read_segment_index
+
+
+class FakeMinio:
+    """
+    Buckets held in dicts, with the MinIO client methods used by ct_compact.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.tags = {}
+
+    def list_objects(self, bucket, prefix="", recursive=False):
+        return [
+            MagicMock(object_name=name, is_dir=False)
+            for (object_bucket, name) in sorted(self.objects)
+            if object_bucket == bucket and name.startswith(prefix)
+        ]
+
+    def get_object_tags(self, bucket, object_name):
+        return self.tags.get((bucket, object_name))
+
+    def get_object(self, bucket, object_name, offset=0, length=0):
+        if (bucket, object_name) not in self.objects:
+            raise S3Error(None, "NoSuchKey", "", "", "", "")
+        data = self.objects[(bucket, object_name)]
+        end = offset + length if length else len(data)
+        response = MagicMock(data=data[offset:end])
+        response.read = io.BytesIO(data[offset:end]).read
+        response.__enter__.return_value = response
+        return response
+
+    def put_object(self, bucket, object_name, data, length, content_type=None):
+        self.objects[(bucket, object_name)] = data.read(length)
+
+    def remove_object(self, bucket, object_name):
+        del self.objects[(bucket, object_name)]
+
+    def remove_objects(self, bucket, delete_objects):
+        for delete_object in delete_objects:
+            del self.objects[(bucket, delete_object.name)]
+        return []
+
+
+def add_details(minio_client, object_name, tagged=True):
+    js = {"result": {"posts": [{"platformId": object_name}]}}
+    minio_client.objects[("ct-post-details", object_name)] = json.dumps(js).encode()
+    if tagged:
+        minio_client.tags[("ct-post-details", object_name)] = {"processed": "true"}
+    return js
+
+
+@pytest.fixture
+def minio_client():
+    return FakeMinio()
+
+
+def test_compact_day_packs_and_removes_originals(minio_client):
+    expected = {
+        name: add_details(minio_client, name)
+        for name in [
+            "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt",
+            "v2/2023/12/13/06/1000_2_2023-12-13T06:00:00_.txt",
+        ]
+    }
+    add_details(minio_client, "v2/2023/12/14/05/1000_3_2023-12-14T05:00:00_.txt")
+
+    removed = compact_day(
+        minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13"
+    )
+
+    assert removed == 2
+    remaining = [name for bucket, name in minio_client.objects if bucket == "ct-post-details"]
+    assert remaining == ["v2/2023/12/14/05/1000_3_2023-12-14T05:00:00_.txt"]
+
+    segment_objects = dict(
+        iter_segment_objects(minio_client, "ct-post-details-archive", "2023/12/13")
+    )
+    assert segment_objects == expected
+
+    name = "v2/2023/12/13/06/1000_2_2023-12-13T06:00:00_.txt"
+    assert (
+        read_segment_object(minio_client, "ct-post-details-archive", "2023/12/13", name)
+        == expected[name]
+    )
+
+
+def test_compact_day_skips_day_with_unprocessed_objects(minio_client):
+    add_details(minio_client, "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt")
+    add_details(
+        minio_client, "v2/2023/12/13/06/1000_2_2023-12-13T06:00:00_.txt", tagged=False
+    )
+
+    removed = compact_day(
+        minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13"
+    )
+
+    assert removed == 0
+    assert len(minio_client.objects) == 2
+
+
+def test_compact_day_keeps_earlier_segment(minio_client):
+    add_details(minio_client, "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt")
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+
+    # An object of the same day saved after the first compaction
+    add_details(minio_client, "v2/2023/12/13/23/1000_2_2023-12-13T23:59:00_.txt")
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+
+    segment_objects = dict(
+        iter_segment_objects(minio_client, "ct-post-details-archive", "2023/12/13")
+    )
+    assert len(segment_objects) == 2
+
+
+def test_compact_day_streams_objects_into_segment(minio_client):
+    first = "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt"
+    add_details(minio_client, first)
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+    second = "v2/2023/12/13/06/1000_2_2023-12-13T06:00:00_.txt"
+    add_details(minio_client, second)
+
+    events = []
+    get_object = minio_client.get_object
+    compress = gzip.compress
+
+    def logged_get_object(bucket, object_name, **kwargs):
+        if object_name in (first, second) or kwargs:
+            events.append("get")
+        return get_object(bucket, object_name, **kwargs)
+
+    def logged_compress(data, **kwargs):
+        events.append("compress")
+        return compress(data, **kwargs)
+
+    minio_client.get_object = logged_get_object
+    with patch("ctetl.ct_compact.gzip.compress", logged_compress):
+        compact_day(
+            minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13"
+        )
+
+    # Each object is compressed before the next one is read
+    assert events == ["get", "compress", "get", "compress"]
+
+
+def get_archive_names(minio_client):
+    return sorted(
+        name
+        for bucket, name in minio_client.objects
+        if bucket == "ct-post-details-archive"
+    )
+
+
+def test_compact_day_replaces_segment_after_publishing_index(minio_client):
+    add_details(minio_client, "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt")
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+    first_segment = read_segment_index(
+        minio_client, "ct-post-details-archive", "2023/12/13"
+    )["segment"]
+
+    add_details(minio_client, "v2/2023/12/13/23/1000_2_2023-12-13T23:59:00_.txt")
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+    second_segment = read_segment_index(
+        minio_client, "ct-post-details-archive", "2023/12/13"
+    )["segment"]
+
+    # The superseded segment is removed, only the index and new segment remain
+    assert first_segment != second_segment
+    assert get_archive_names(minio_client) == [
+        second_segment,
+        "segments/2023/12/13.index.json",
+    ]
+
+
+def test_compact_day_interrupted_before_index_keeps_previous_segment(minio_client):
+    first = "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt"
+    expected = {first: add_details(minio_client, first)}
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+
+    # Crash after the new segment is saved, before its index is
+    second = "v2/2023/12/13/23/1000_2_2023-12-13T23:59:00_.txt"
+    expected[second] = add_details(minio_client, second)
+    put_object = minio_client.put_object
+
+    def crash_on_index(bucket, object_name, data, length, content_type=None):
+        if object_name.endswith(".index.json"):
+            raise ConnectionError("crashed")
+        put_object(bucket, object_name, data, length, content_type)
+
+    minio_client.put_object = crash_on_index
+    with pytest.raises(ConnectionError):
+        compact_day(
+            minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13"
+        )
+
+    # The previous index still reads its own segment
+    assert dict(
+        iter_segment_objects(minio_client, "ct-post-details-archive", "2023/12/13")
+    ) == {first: expected[first]}
+
+    # And the next compaction keeps every object
+    minio_client.put_object = put_object
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+    assert (
+        dict(iter_segment_objects(minio_client, "ct-post-details-archive", "2023/12/13"))
+        == expected
+    )
+    assert len(get_archive_names(minio_client)) == 2
+
+
+def test_segments_without_a_named_segment_are_still_read(minio_client):
+    name = "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt"
+    expected = add_details(minio_client, name)
+    compact_day(minio_client, "ct-post-details", "ct-post-details-archive", "2023/12/13")
+
+    # Rewrite as the previous layout: segments/DAY.gz and no segment in the index
+    index = read_segment_index(minio_client, "ct-post-details-archive", "2023/12/13")
+    minio_client.objects[("ct-post-details-archive", "segments/2023/12/13.gz")] = (
+        minio_client.objects.pop(("ct-post-details-archive", index.pop("segment")))
+    )
+    minio_client.objects[
+        ("ct-post-details-archive", "segments/2023/12/13.index.json")
+    ] = json.dumps(index).encode()
+
+    assert (
+        read_segment_object(minio_client, "ct-post-details-archive", "2023/12/13", name)
+        == expected
+    )
@@ -0,0 +1,61 @@
+import pytest
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from unittest.mock import MagicMock, patch
+
+from ctetl import ct_daemon
+from ctetl.ct_daemon import DaemonState, run_stage, run_daemon, run_details_stage
+
+
+@pytest.fixture
+def state():
+    return DaemonState({}, "key", MagicMock(), MagicMock(), MagicMock())
+
+
+def test_run_stage_survives_sys_exit(state, capsys):
+    def stage(state, stop_event):
+        sys.exit(1)
+
+    run_stage("extract", stage, state, threading.Event())
+
+    assert "Stage extract exited with code 1" in capsys.readouterr().out
+
+
+def test_run_daemon_runs_stages_until_stopped(state, monkeypatch):
+    stop_event = threading.Event()
+    calls = []
+
+    def stage(state, stop_event):
+        calls.append(1)
+        if len(calls) == 3:
+            stop_event.set()
+
+    monkeypatch.setitem(ct_daemon.STAGES, "extract", stage)
+    run_daemon(state, {"extract": 0}, stop_event)
+
+    assert len(calls) == 3
+
+
+@patch("ctetl.ct_daemon.process_post_object")
+@patch("ctetl.ct_daemon.get_minio_object_names")
+def test_details_stage_skips_processed_objects(
+    mock_get_names, mock_process, state
+):
+    mock_get_names.return_value = ["a.txt", "b.txt"]
+
+    run_details_stage(state, threading.Event())
+    run_details_stage(state, threading.Event())
+
+    assert mock_process.call_count == 2
+    assert state.processed_post_objects == {"a.txt", "b.txt"}
+
+    # Remembered objects are forgotten after reset_interval
+    state.next_reset = 0
+    run_details_stage(state, threading.Event())
+
+    assert mock_process.call_count == 4
@@ -0,0 +1,266 @@
+import os
+import sys
+
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, Mock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from ctetl.ct_extract import request_when_healthy
+from ctetl.ct_extract import get_fetch_priority, PostDetailsScheduler
+from ctetl.ct_extract import process_post_objects, get_and_save_post_details
+from ctetl.ct_extract import get_and_save_ct_post_aggregates
+from ctetl.ct_web import THROTTLED, UNAVAILABLE, REJECTED, EndpointHealth
+
+
+URL = "http://example.com/post/1_2?token=key"
+
+
+def fail_then_respond(health, outcome, failures, response=None, retry_after=None):
+    # Fail failures times like request_with_backoff, then return response
+    calls = []
+
+    def request(url, headers):
+        calls.append(url)
+        if len(calls) <= failures:
+            health.record_failure(outcome, retry_after)
+            return None
+        return response
+
+    return request
+
+
+@patch("ctetl.ct_extract.wait_for_rate_limit")
+@patch("ctetl.ct_extract.get_endpoint_health")
+@patch("ctetl.ct_extract.request_with_backoff")
+def test_request_when_healthy_pauses_rate_limiter_when_throttled(
+    mock_request, mock_get_health, mock_wait, capsys
+):
+    health = EndpointHealth("post")
+    mock_get_health.return_value = health
+    response = Mock()
+    mock_request.side_effect = fail_then_respond(health, THROTTLED, 1, response, 45)
+    rate_limiter = MagicMock()
+
+    assert request_when_healthy(URL, {}, None, "key", rate_limiter) is response
+
+    rate_limiter.pause.assert_called_once_with(45)
+    assert mock_wait.call_count == 2
+
+
+@patch("ctetl.ct_extract.wait_for_rate_limit")
+@patch("ctetl.ct_extract.get_endpoint_health")
+@patch("ctetl.ct_extract.request_with_backoff")
+def test_request_when_healthy_returns_none_when_rejected(
+    mock_request, mock_get_health, mock_wait
+):
+    health = EndpointHealth("post")
+    mock_get_health.return_value = health
+    mock_request.side_effect = fail_then_respond(health, REJECTED, 1)
+
+    assert request_when_healthy(URL, {}, None, "key", MagicMock()) is None
+    assert mock_request.call_count == 1
+
+
+@patch("ctetl.ct_extract.time.sleep")
+@patch("ctetl.ct_extract.wait_for_rate_limit")
+@patch("ctetl.ct_extract.get_endpoint_health")
+@patch("ctetl.ct_extract.request_with_backoff")
+def test_request_when_healthy_pauses_while_circuit_open(
+    mock_request, mock_get_health, mock_wait, mock_sleep, capsys
+):
+    health = EndpointHealth("post", failure_threshold=2, open_seconds=300)
+    mock_get_health.return_value = health
+    mock_request.side_effect = fail_then_respond(health, UNAVAILABLE, 10)
+
+    # Gives up once paused for longer than max_pause_seconds
+    assert request_when_healthy(URL, {}, None, "key", max_pause_seconds=500) is None
+
+    assert mock_request.call_count == 2
+    assert mock_sleep.call_count == 2
+    assert "unavailable, pausing requests" in capsys.readouterr().out
+
+
+WINDOW_START = datetime(2023, 12, 10)
+WINDOW_END = datetime(2023, 12, 11)
+
+# Posting dates: after the window, in it twice, and before it
+POSTING_DATES = {
+    "after": datetime(2023, 12, 12),
+    "late": datetime(2023, 12, 10, 20),
+    "early": datetime(2023, 12, 10, 4),
+    "before": datetime(2023, 12, 9),
+}
+
+
+def get_fetch_order(schedule):
+    return sorted(
+        POSTING_DATES,
+        key=lambda name: get_fetch_priority(
+            schedule, POSTING_DATES[name], WINDOW_START, WINDOW_END
+        ),
+    )
+
+
+def test_get_fetch_priority_fifo_keeps_listing_order():
+    assert get_fetch_order("fifo") == ["after", "late", "early", "before"]
+
+
+def test_get_fetch_priority_freshest():
+    dates = sorted(POSTING_DATES.values())
+    assert sorted(
+        dates,
+        key=lambda date: get_fetch_priority("freshest", date, WINDOW_START, WINDOW_END),
+    ) == dates[::-1]
+
+
+def test_get_fetch_priority_report_window():
+    assert get_fetch_order("report-window") == ["early", "late", "after", "before"]
+
+
+def make_posts(*hours_ago):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        {"platformId": f"1_{hours}", "date": str(now - timedelta(hours=hours))}
+        for hours in hours_ago
+    ]
+
+
+def test_post_details_scheduler_pops_in_priority_order_across_objects():
+    scheduler = PostDetailsScheduler("report-window", 96, 72)
+    scheduler.add("a", make_posts(10, 80))
+    scheduler.add("b", make_posts(90, 100))
+
+    assert len(scheduler) == 4
+    assert [scheduler.pop() for _ in range(4)] == [
+        ("1_90", "b"),
+        ("1_80", "a"),
+        ("1_10", "a"),
+        ("1_100", "b"),
+    ]
+
+
+def test_post_details_scheduler_done_once_all_posts_fetched():
+    scheduler = PostDetailsScheduler("fifo")
+    scheduler.add("a", make_posts(1, 2))
+
+    assert scheduler.done("a") is False
+    assert scheduler.done("a") is True
+    assert scheduler.remaining_posts == {}
+
+
+@patch("ctetl.ct_extract.fetch_and_upload_post_details")
+@patch("ctetl.ct_extract.get_minio_response_js")
+def test_process_post_objects_tags_each_object_after_its_posts(
+    mock_get_js, mock_fetch
+):
+    bundles = {
+        "a": {"result": {"posts": make_posts(10, 80)}},
+        "b": {"result": {"posts": make_posts(90)}},
+        "empty": {"result": {"posts": []}},
+    }
+    mock_get_js.side_effect = lambda name, bucket, client: bundles[name]
+    minio_client = MagicMock()
+    minio_client.get_object_tags.side_effect = lambda bucket, name: (
+        {"processed": "true"} if name == "tagged" else None
+    )
+    details_batcher = Mock()
+    events = []
+    mock_fetch.side_effect = lambda *args: events.append(("fetch", args[5]))
+    details_batcher.flush.side_effect = lambda: events.append(("flush",))
+    minio_client.set_object_tags.side_effect = lambda bucket, name, tags: (
+        events.append(("tag", name))
+    )
+
+    process_post_objects(
+        "tags",
+        {},
+        "key",
+        minio_client,
+        "ct-posts",
+        "ct-post-details",
+        ["a", "tagged", "b", "empty"],
+        PostDetailsScheduler("report-window", 96, 72),
+        details_batcher,
+        rate_limiter=Mock(),
+    )
+
+    assert events == [
+        ("tag", "empty"),
+        ("fetch", "1_90"),
+        ("flush",),
+        ("tag", "b"),
+        ("fetch", "1_80"),
+        ("fetch", "1_10"),
+        ("flush",),
+        ("tag", "a"),
+    ]
+
+
+def record_uploads(events):
+    uploader = Mock()
+    uploader.put.side_effect = lambda bucket, name, data: events.append(("put", data))
+    uploader.wait.side_effect = lambda: events.append(("wait",))
+    return uploader
+
+
+@patch("ctetl.ct_extract.request_when_healthy")
+def test_get_and_save_ct_post_aggregates_saves_pages_in_order(mock_request):
+    mock_request.return_value = Mock(content=b"page")
+    events = []
+
+    get_and_save_ct_post_aggregates(
+        URL,
+        {},
+        Mock(),
+        "ct-posts",
+        "2023-12-13T05:00:00",
+        "2023-12-10T06:00:00",
+        "2023-12-10T05:00:00",
+        2,
+        None,
+        "key",
+        rate_limiter=Mock(),
+        uploader=record_uploads(events),
+    )
+
+    # The previous page is saved before this one is queued
+    assert events == [("wait",), ("put", b"page")]
+
+
+@patch("ctetl.ct_extract.request_when_healthy")
+def test_get_and_save_post_details_tags_after_uploads_are_saved(mock_request):
+    mock_request.return_value = Mock(content=b"details")
+    events = []
+    minio_client = Mock()
+    minio_client.set_object_tags.side_effect = lambda bucket, name, tags: (
+        events.append(("tag", name))
+    )
+
+    get_and_save_post_details(
+        "tags",
+        0,
+        {},
+        "key",
+        minio_client,
+        "ct-posts",
+        "ct-post-details",
+        "posts.txt",
+        {
+            "result": {
+                "posts": [
+                    {"platformId": "1_1", "account": {"platformId": 1}},
+                    {"platformId": "1_2", "account": {"platformId": 1}},
+                ]
+            }
+        },
+        rate_limiter=Mock(),
+        uploader=record_uploads(events),
+    )
+
+    assert events == [
+        ("put", b"details"),
+        ("put", b"details"),
+        ("wait",),
+        ("tag", "posts.txt"),
+    ]
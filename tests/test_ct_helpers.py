@@ -1,8 +1,10 @@
 import pytest
 
+import argparse
 import json
 import os
 import sys
+import threading
 
 from datetime import datetime
 import time
@@ -20,18 +22,32 @@ from unittest.mock import Mock
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
 
 from ctetl.ct_helpers import get_request_parameters
-from ctetl.ct_helpers import create_redis_client
+from ctetl.ct_helpers import get_api_base_url
+from ctetl.ct_redis import create_redis_client
+from ctetl.ct_redis import create_redis_consumer_group
+from ctetl.ct_redis import publish_platform_ids
+from ctetl.ct_redis import read_platform_ids
+from ctetl.ct_redis import reclaim_platform_ids
+from ctetl.ct_redis import acknowledge_platform_id
 from ctetl.ct_helpers import load_db_credentials
-from ctetl.ct_helpers import create_minio_client
-from ctetl.ct_helpers import check_minio_buckets
-from ctetl.ct_helpers import create_minio_tags
-from ctetl.ct_helpers import get_minio_object_names
-from ctetl.ct_helpers import get_minio_response_js
-from ctetl.ct_helpers import request_with_backoff
-from ctetl.ct_helpers import allow_request
+from ctetl.ct_minio import create_minio_client
+from ctetl.ct_minio import check_minio_buckets
+from ctetl.ct_minio import create_minio_tags
+from ctetl.ct_minio import get_minio_object_names, add_since_hours_argument
+from ctetl.ct_minio import get_partitioned_object_name, get_object_basename
+from ctetl.ct_minio import get_latest_object_name
+from ctetl.ct_minio import get_minio_response_js
+from ctetl.ct_web import request_with_backoff
+from ctetl.ct_web import EndpointHealth, get_endpoint_health, get_retry_after
+from ctetl.ct_web import get_http_session, THROTTLED, UNAVAILABLE, REJECTED
+from ctetl.ct_redis import allow_request
+from ctetl.ct_redis import PermitLease
 from ctetl.ct_helpers import isoformat_to_seconds
-from ctetl.ct_helpers import create_sqlalchemy_engine
-from ctetl.ct_helpers import minio_put_text_object
+from ctetl.ct_helpers import get_paused_window
+from ctetl.ct_db import create_sqlalchemy_engine
+from ctetl.ct_db import create_psycopg2_connection
+from ctetl.ct_db import SQLSlidingWindowRateLimiter
+from ctetl.ct_minio import minio_put_text_object, BackgroundUploader
 
 
 class MockMinioResponse:
@@ -59,6 +75,7 @@ class MockMinioClient:
 class MockRequestResponse:
     def __init__(self, text):
         self.text = text
+        self.content = text.encode("utf-8")
 
 
 class MockS3Error(S3Error):
@@ -114,6 +131,18 @@ def test_get_request_parameters_with_empty_api_key(monkeypatch, capsys):
     assert "CT_KEY is empty.  Is it defined in the environment?" in captured.out
 
 
+def test_get_api_base_url_default(monkeypatch):
+    monkeypatch.delenv("CT_API_URL", raising=False)
+
+    assert get_api_base_url() == "https://api.crowdtangle.com"
+
+
+def test_get_api_base_url_from_environment(monkeypatch):
+    monkeypatch.setenv("CT_API_URL", "http://localhost:8080/")
+
+    assert get_api_base_url() == "http://localhost:8080"
+
+
 def test_load_db_credentials(monkeypatch, capsys):
     # Set environment variables for testing
     monkeypatch.setenv("PGUSER", "test_user")
@@ -200,6 +229,115 @@ def test_create_redis_client_exception_handling(monkeypatch):
     assert redis_client is None
 
 
+def test_create_redis_consumer_group_existing_group():
+    # BUSYGROUP is raised when the group already exists and should be ignored
+    redis_client = MagicMock()
+    redis_client.xgroup_create.side_effect = redis.exceptions.ResponseError(
+        "BUSYGROUP Consumer Group name already exists"
+    )
+
+    create_redis_consumer_group(redis_client, "stream", "group")
+
+    redis_client.xgroup_create.assert_called_once_with(
+        "stream", "group", id="0", mkstream=True
+    )
+
+
+def test_create_redis_consumer_group_other_error():
+    redis_client = MagicMock()
+    redis_client.xgroup_create.side_effect = redis.exceptions.ResponseError(
+        "WRONGTYPE Operation against a key holding the wrong kind of value"
+    )
+
+    with pytest.raises(redis.exceptions.ResponseError):
+        create_redis_consumer_group(redis_client, "stream", "group")
+
+
+def test_publish_platform_ids():
+    redis_client = MagicMock()
+    pipe = redis_client.pipeline.return_value
+
+    publish_platform_ids(redis_client, "stream", ["1_2", "3_4"], maxlen=100)
+
+    assert pipe.xadd.call_args_list == [
+        call("stream", {"platform_id": "1_2"}, maxlen=100, approximate=True),
+        call("stream", {"platform_id": "3_4"}, maxlen=100, approximate=True),
+    ]
+    pipe.execute.assert_called_once()
+
+
+def test_read_platform_ids():
+    redis_client = MagicMock()
+    redis_client.xreadgroup.return_value = [
+        [b"stream", [(b"1-0", {b"platform_id": b"1_2"})]]
+    ]
+
+    entries = read_platform_ids(redis_client, "stream", "group", "consumer")
+
+    assert entries == [(b"1-0", "1_2")]
+    redis_client.xreadgroup.assert_called_once_with(
+        "group", "consumer", {"stream": ">"}, count=10, block=5000
+    )
+
+
+def test_read_platform_ids_timeout():
+    # xreadgroup returns None when block times out
+    redis_client = MagicMock()
+    redis_client.xreadgroup.return_value = None
+
+    assert read_platform_ids(redis_client, "stream", "group", "consumer") == []
+
+
+def test_reclaim_platform_ids():
+    redis_client = MagicMock()
+    redis_client.xautoclaim.return_value = [
+        b"0-0",
+        [(b"1-0", {b"platform_id": b"1_2"}), (b"2-0", None)],
+        [],
+    ]
+
+    entries = reclaim_platform_ids(redis_client, "stream", "group", "consumer", 1000)
+
+    # Entries deleted from the stream while pending have no fields, and are
+    # acknowledged so they are not claimed again
+    assert entries == [(b"1-0", "1_2")]
+    redis_client.xack.assert_called_once_with("stream", "group", b"2-0")
+    redis_client.xautoclaim.assert_called_once_with(
+        "stream", "group", "consumer", min_idle_time=1000, start_id="0-0", count=10
+    )
+
+
+def test_reclaim_platform_ids_follows_cursor():
+    redis_client = MagicMock()
+    redis_client.xautoclaim.side_effect = [
+        [b"5-0", [], []],
+        [b"9-0", [(b"6-0", {b"platform_id": b"1_2"})], []],
+        [b"0-0", [(b"9-0", {b"platform_id": b"3_4"})], []],
+    ]
+
+    entries = reclaim_platform_ids(
+        redis_client, "stream", "group", "consumer", 1000, count=5
+    )
+
+    # Idle entries past the first page of pending entries are claimed too
+    assert entries == [(b"6-0", "1_2"), (b"9-0", "3_4")]
+    assert [
+        (c.kwargs["start_id"], c.kwargs["count"])
+        for c in redis_client.xautoclaim.call_args_list
+    ] == [("0-0", 5), (b"5-0", 5), (b"9-0", 4)]
+
+
+def test_acknowledge_platform_id():
+    redis_client = MagicMock()
+    pipe = redis_client.pipeline.return_value
+
+    acknowledge_platform_id(redis_client, "stream", "group", b"1-0")
+
+    pipe.xack.assert_called_once_with("stream", "group", b"1-0")
+    pipe.xdel.assert_called_once_with("stream", b"1-0")
+    pipe.execute.assert_called_once()
+
+
 ### MinIO functions
 
 
@@ -326,13 +464,65 @@ def test_get_minio_object_names():
     object_names = get_minio_object_names(minio_client, bucket)
 
     # Check if the list_objects method was called with the correct bucket
-    minio_client.list_objects.assert_called_once_with(bucket)
+    # recursively, to include objects in partitions
+    minio_client.list_objects.assert_called_once_with(bucket, recursive=True)
 
     # Check if the returned object_names match the object_names from the mock objects
     assert object_names == ["object1", "object2", "object3"]
 
 
-@patch("ctetl.ct_helpers.json.loads")
+def test_since_hours_defaults_to_whole_bucket():
+    # Untagged objects in old partitions must still be listed by default
+    parser = argparse.ArgumentParser()
+    add_since_hours_argument(parser)
+    minio_client = MagicMock()
+
+    get_minio_object_names(minio_client, "bucket", parser.parse_args([]).since_hours)
+
+    minio_client.list_objects.assert_called_once_with("bucket", recursive=True)
+
+
+def test_get_partitioned_object_name():
+    object_name = get_partitioned_object_name(
+        "1000_1_2023-12-13T05:04:03_.txt", "2023-12-13T05:04:03"
+    )
+
+    assert object_name == "v2/2023/12/13/05/1000_1_2023-12-13T05:04:03_.txt"
+    assert get_object_basename(object_name) == "1000_1_2023-12-13T05:04:03_.txt"
+
+
+def test_get_latest_object_name_walks_latest_partitions():
+    listings = {
+        "v2/": ["v2/2023/", "v2/2024/"],
+        "v2/2024/": ["v2/2024/01/", "v2/2024/02/"],
+        "v2/2024/02/": ["v2/2024/02/09/", "v2/2024/02/10/"],
+        "v2/2024/02/10/": ["v2/2024/02/10/03/", "v2/2024/02/10/04/"],
+        "v2/2024/02/10/04/": ["v2/2024/02/10/04/a_2.txt", "v2/2024/02/10/04/a_1.txt"],
+    }
+    minio_client = MagicMock()
+    minio_client.list_objects.side_effect = lambda bucket, prefix=None: [
+        MagicMock(object_name=name, is_dir=name.endswith("/"))
+        for name in listings.get(prefix, [])
+    ]
+
+    assert get_latest_object_name(minio_client, "ct-posts") == "v2/2024/02/10/04/a_2.txt"
+
+
+def test_get_latest_object_name_falls_back_to_legacy_objects():
+    minio_client = MagicMock()
+    minio_client.list_objects.side_effect = lambda bucket, prefix=None: (
+        []
+        if prefix
+        else [
+            MagicMock(object_name="b_2.txt", is_dir=False),
+            MagicMock(object_name="b_1.txt", is_dir=False),
+        ]
+    )
+
+    assert get_latest_object_name(minio_client, "ct-posts") == "b_2.txt"
+
+
+@patch("ctetl.ct_minio.json.loads")
 def test_get_minio_response_js(mock_json_loads):
     # Arrange
     object_name = "mock_object"
@@ -385,18 +575,18 @@ def test_minio_put_text_object_success(minio_client):
     # Test the successful case of putting a text object
     bucket = "test_bucket"
     object_name = "test_object.txt"
-    request_response = Mock(text="Hello, World!")
+    request_response = Mock(content=b"Hello, World!")
 
-    with patch("ctetl.ct_helpers.io.BytesIO") as mock_bytesio:
+    with patch("ctetl.ct_minio.io.BytesIO") as mock_bytesio:
         minio_put_text_object(minio_client, bucket, object_name, request_response)
 
-    # Assertions
-    mock_bytesio.assert_called_once_with(request_response.text.encode("utf-8"))
+    # Assertions: the body is saved as received, not re-encoded from text
+    mock_bytesio.assert_called_once_with(request_response.content)
     minio_client.put_object.assert_called_once_with(
         bucket_name=bucket,
         object_name=object_name,
         data=mock_bytesio(),
-        length=len(mock_bytesio()),
+        length=len(request_response.content),
         content_type="text/plain",
     )
     
@@ -429,12 +619,89 @@ def test_minio_put_text_object_s3_error_handling():
         minio_put_text_object(minio_client, bucket, object_name, request_response)
 
     
+def make_s3_error():
+    return MockS3Error(
+        code="MockErrorCode",
+        message="Mock S3 Error",
+        resource="mock_resource",
+        request_id="mock_request_id",
+        host_id="mock_host_id",
+        response="mock_response",
+        bucket_name="mock_bucket_name",
+        object_name="mock_object_name",
+    )
+
+
+def test_background_uploader_puts_bytes_as_received(minio_client):
+    with BackgroundUploader(minio_client, workers=2) as uploader:
+        uploader.put("bucket", "a.txt", b"payload a")
+        uploader.put("bucket", "b.txt", b"payload b")
+        uploader.wait()
+        assert minio_client.put_object.call_count == 2
+
+    uploaded = {
+        c.kwargs["object_name"]: c.kwargs["data"].getvalue()
+        for c in minio_client.put_object.call_args_list
+    }
+    assert uploaded == {"a.txt": b"payload a", "b.txt": b"payload b"}
+
+
+def test_background_uploader_retries_failed_uploads(minio_client, capsys):
+    minio_client.put_object.side_effect = [make_s3_error(), None]
+
+    uploader = BackgroundUploader(minio_client, backoff_seconds=0)
+    uploader.put("bucket", "a.txt", b"payload")
+    uploader.close()
+
+    assert minio_client.put_object.call_count == 2
+    assert "retrying" in capsys.readouterr().out
+
+
+def test_background_uploader_exits_once_retries_are_exhausted(minio_client, capsys):
+    minio_client.put_object.side_effect = make_s3_error()
+
+    uploader = BackgroundUploader(minio_client, workers=1, retries=1, backoff_seconds=0)
+    uploader.put("bucket", "a.txt", b"payload")
+    with pytest.raises(SystemExit) as exc_info:
+        uploader.wait()
+    assert exc_info.value.code == 1
+    assert minio_client.put_object.call_count == 2
+
+    # Ready for new uploads after the failure is reported
+    minio_client.put_object.side_effect = None
+    uploader.put("bucket", "b.txt", b"payload")
+    uploader.close()
+    assert minio_client.put_object.call_count == 3
+
+
+def test_background_uploader_skips_uploads_after_a_failure(minio_client, capsys):
+    queued = threading.Event()
+
+    def fail_once_queued(**kwargs):
+        queued.wait(5)
+        raise make_s3_error()
+
+    minio_client.put_object.side_effect = fail_once_queued
+
+    uploader = BackgroundUploader(minio_client, workers=1, retries=0)
+    uploader.put("bucket", "a.txt", b"payload")
+    uploader.put("bucket", "b.txt", b"payload")
+    queued.set()
+    with pytest.raises(SystemExit):
+        uploader.close()
+
+    # b.txt was queued behind the failed upload and never sent
+    assert minio_client.put_object.call_count == 1
+
+
 #### Web functions
 
 
 @pytest.fixture
 def mock_session(mocker):
-    return mocker.patch("ctetl.ct_helpers.requests.Session", autospec=True)
+    # Make sure request_with_backoff creates a new session from the mock
+    mocker.patch("ctetl.ct_web.HTTP_SESSION", None)
+    return mocker.patch("ctetl.ct_web.requests.Session", autospec=True)
 
 
 def test_request_with_backoff_successful(mock_session):
@@ -454,6 +721,14 @@ def test_request_with_backoff_successful(mock_session):
     assert result == mock_response
 
 
+def test_request_with_backoff_reuses_session(mock_session):
+    request_with_backoff("http://example.com/posts")
+    request_with_backoff("http://example.com/post/1_2")
+
+    mock_session.assert_called_once()
+    assert mock_session.return_value.get.call_count == 2
+
+
 def test_request_with_backoff_unsuccessful(mock_session, capsys):
     # Set up the mock session to raise a RequestException
     mock_session.return_value.get.side_effect = requests.exceptions.RequestException(
@@ -475,6 +750,80 @@ def test_request_with_backoff_unsuccessful(mock_session, capsys):
     assert "Requests error after retrying.  Error: Mock error" in captured.out
 
 
+def test_get_http_session_retries_https(mocker):
+    mocker.patch("ctetl.ct_web.HTTP_SESSION", None)
+
+    session = get_http_session()
+
+    adapter = session.get_adapter("https://api.crowdtangle.com/posts")
+    assert adapter is session.get_adapter("http://127.0.0.1:8080/posts")
+    assert adapter.max_retries.total == 5
+    # 429 is left to the caller
+    assert not adapter.max_retries.is_retry("GET", 429, has_retry_after=True)
+
+
+def http_error_response(status_code, headers=None):
+    response = Mock(status_code=status_code, headers=headers or {})
+    response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+        f"{status_code} Error", response=response
+    )
+    return response
+
+
+@pytest.mark.parametrize(
+    "status_code, outcome", [(429, THROTTLED), (503, UNAVAILABLE), (404, REJECTED)]
+)
+def test_request_with_backoff_records_endpoint_health(
+    mock_session, mocker, status_code, outcome
+):
+    mocker.patch.dict("ctetl.ct_web.ENDPOINT_HEALTH", clear=True)
+    mock_session.return_value.get.return_value = http_error_response(
+        status_code, {"Retry-After": "30"}
+    )
+
+    assert request_with_backoff("http://example.com/post/1_2") is None
+
+    health = get_endpoint_health("http://example.com/post/1_3")
+    assert health.last_failure == outcome
+    if outcome == THROTTLED:
+        assert health.retry_after == 30
+
+
+def test_get_retry_after_http_date():
+    retry_at = time.strftime(
+        "%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 120)
+    )
+
+    assert 110 < get_retry_after(Mock(headers={"Retry-After": retry_at})) <= 120
+    assert get_retry_after(Mock(headers={})) is None
+
+
+@patch("ctetl.ct_web.time.monotonic")
+def test_endpoint_health_circuit_breaker(mock_monotonic, capsys):
+    mock_monotonic.return_value = 1000.0
+    health = EndpointHealth("post", failure_threshold=2, open_seconds=300)
+
+    health.record_failure(THROTTLED)
+    health.record_failure(UNAVAILABLE)
+    assert health.wait_seconds() == 0
+    health.record_failure(UNAVAILABLE)
+    assert health.status() == "open"
+    assert health.wait_seconds() == 300
+
+    # Half open, a single trial request is let through
+    mock_monotonic.return_value = 1300.0
+    assert health.wait_seconds() == 0
+    assert health.wait_seconds() > 0
+    health.record_failure(UNAVAILABLE)
+    assert health.status() == "open"
+
+    mock_monotonic.return_value = 1600.0
+    assert health.wait_seconds() == 0
+    health.record_success()
+    assert health.status() == "closed"
+    assert health.wait_seconds() == 0
+
+
 @pytest.fixture
 def redis_client():
     # Create and return a Redis client instance
@@ -482,9 +831,9 @@ def redis_client():
     yield client
 
 
-@patch('ctetl.ct_helpers.redis.StrictRedis.lrange')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpop')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpush')
+@patch('ctetl.ct_redis.redis.StrictRedis.lrange')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpop')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpush')
 @patch('time.sleep')
 def test_allow_request_allowed(mock_sleep, mock_rpush, mock_rpop, mock_lrange, redis_client):
     # Test when the request is allowed
@@ -506,9 +855,9 @@ def test_allow_request_allowed(mock_sleep, mock_rpush, mock_rpop, mock_lrange, r
     assert not mock_sleep.called  # Ensure time.sleep is not called
 
 
-@patch('ctetl.ct_helpers.redis.StrictRedis.lrange')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpop')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpush')
+@patch('ctetl.ct_redis.redis.StrictRedis.lrange')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpop')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpush')
 @patch('time.sleep')
 def test_allow_request_denied(mock_sleep, mock_rpush, mock_rpop, mock_lrange, redis_client):
     # Test when the request is denied due to rate_limit being reached
@@ -530,8 +879,8 @@ def test_allow_request_denied(mock_sleep, mock_rpush, mock_rpop, mock_lrange, re
     assert mock_sleep.called  # Ensure time.sleep is called
 
 
-@patch('ctetl.ct_helpers.redis.StrictRedis.lrange')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpush')
+@patch('ctetl.ct_redis.redis.StrictRedis.lrange')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpush')
 def test_allow_request_empty_timestamps(mock_rpush, mock_lrange, redis_client):
     # Test when the request is allowed even with empty timestamps
     redis_key = "test_key"
@@ -548,8 +897,8 @@ def test_allow_request_empty_timestamps(mock_rpush, mock_lrange, redis_client):
     mock_rpush.assert_called_once_with(redis_key, int(time.time()))
 
 
-@patch('ctetl.ct_helpers.redis.StrictRedis.lrange')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpush')
+@patch('ctetl.ct_redis.redis.StrictRedis.lrange')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpush')
 def test_allow_request_less_than_rate_limit(mock_rpush, mock_lrange, redis_client):
     # Test when timestamps less than rate_limit
     redis_key = "test_key"
@@ -568,9 +917,9 @@ def test_allow_request_less_than_rate_limit(mock_rpush, mock_lrange, redis_clien
     mock_rpush.assert_called_once_with(redis_key, int(time.time()))
 
 
-@patch('ctetl.ct_helpers.redis.StrictRedis.lrange')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpop')
-@patch('ctetl.ct_helpers.redis.StrictRedis.rpush')
+@patch('ctetl.ct_redis.redis.StrictRedis.lrange')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpop')
+@patch('ctetl.ct_redis.redis.StrictRedis.rpush')
 @patch('time.sleep')
 def test_allow_request_more_than_rate_limit(mock_sleep, mock_rpush, mock_rpop, mock_lrange, redis_client):
     # Test when timestamps more than rate_limit
@@ -594,6 +943,65 @@ def test_allow_request_more_than_rate_limit(mock_sleep, mock_rpush, mock_rpop, m
     assert result is True
 
 
+def test_permit_lease_hands_out_permits_locally():
+    redis_client = MagicMock()
+    redis_client.eval.return_value = [3, b"0"]
+
+    permit_lease = PermitLease(redis_client, "test_key", 6, 60, batch_size=3)
+    for _ in range(4):
+        permit_lease.acquire()
+
+    # One lease of 3 permits, then a second lease for the fourth request
+    assert redis_client.eval.call_count == 2
+    assert redis_client.eval.call_args.args[1:3] == (1, "test_key")
+    assert permit_lease.permits == 2
+
+
+@patch("ctetl.ct_redis.time.sleep")
+def test_permit_lease_sleeps_until_permit_free(mock_sleep):
+    redis_client = MagicMock()
+    redis_client.eval.side_effect = [[0, b"12.5"], [1, b"0"]]
+
+    PermitLease(redis_client, "test_key", 6, 60).acquire()
+
+    mock_sleep.assert_called_once_with(12.5)
+    assert redis_client.eval.call_count == 2
+
+
+def test_permit_lease_gives_back_unused_permits():
+    redis_client = MagicMock()
+    redis_client.eval.return_value = [3, b"0"]
+
+    with PermitLease(redis_client, "test_key", 6, 60, batch_size=3) as permit_lease:
+        permit_lease.acquire()
+        expires_at = permit_lease.expires_at
+
+    redis_client.lrem.assert_called_once_with("test_key", -2, expires_at)
+    assert permit_lease.permits == 0
+
+
+@patch("ctetl.ct_redis.time.time")
+def test_permit_lease_gives_back_expired_permits(mock_time):
+    redis_client = MagicMock()
+    redis_client.eval.return_value = [3, b"0"]
+    mock_time.return_value = 1000.0
+
+    permit_lease = PermitLease(redis_client, "test_key", 6, 60, lease_seconds=5)
+    permit_lease.acquire()
+    mock_time.return_value = 1006.0
+    permit_lease.acquire()
+
+    redis_client.lrem.assert_called_once_with("test_key", -2, 1005.0)
+    assert permit_lease.expires_at == 1011.0
+
+
+def test_get_paused_window():
+    window = get_paused_window(1000.0, 6, 60, 30, 2)
+
+    # Requests leave the window 30 seconds from now, then every 20 seconds
+    assert [t + 60 for t in window] == [1030.0, 1050.0, 1070.0, 1090.0, 1110.0, 1130.0]
+
+
 ### Formatting functions
 
 
@@ -632,12 +1040,12 @@ def test_isoformat_to_seconds_with_mixed_objects():
 
 @pytest.fixture
 def mock_load_db_credentials(mocker):
-    return mocker.patch("ctetl.ct_helpers.load_db_credentials")
+    return mocker.patch("ctetl.ct_db.load_db_credentials")
 
 
 @pytest.fixture
 def mock_create_engine(mocker):
-    return mocker.patch("ctetl.ct_helpers.create_engine")
+    return mocker.patch("sqlalchemy.create_engine")
 
 
 def test_create_sqlalchemy_engine(mock_load_db_credentials, mock_create_engine):
@@ -669,3 +1077,84 @@ def test_create_sqlalchemy_engine(mock_load_db_credentials, mock_create_engine):
 
     # Check that the result is the mock engine
     assert result == mock_engine
+
+
+def test_create_psycopg2_connection(mock_load_db_credentials, mocker):
+    mock_load_db_credentials.return_value = (
+        "test_user",
+        "test_passwd",
+        "localhost",
+        "5432",
+        "test_db",
+    )
+    mock_connect = mocker.patch("ctetl.ct_db.psycopg2.connect")
+
+    result = create_psycopg2_connection()
+
+    mock_connect.assert_called_once_with(
+        database="test_db",
+        user="test_user",
+        password="test_passwd",
+        host="localhost",
+        port="5432",
+    )
+    assert result == mock_connect.return_value
+
+
+### Rate limiting in PostgreSQL
+
+
+def sql_rate_limiter(window, now):
+    # Rate limiter of 3 requests in 60 seconds, whose row holds window at now
+    connection = MagicMock()
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (window, now)
+    with patch("ctetl.ct_db.create_psycopg2_connection", return_value=connection):
+        return SQLSlidingWindowRateLimiter(3, 60, key="test_key"), cursor
+
+
+def test_sql_rate_limiter_takes_free_request():
+    rate_limiter, cursor = sql_rate_limiter([900.0, 950.0, 960.0], 1000.0)
+
+    assert rate_limiter.try_acquire() == 0
+    # Requests older than the window are pruned
+    cursor.execute.assert_called_with(
+        "UPDATE rate_limit_windows SET timestamps = %s WHERE key = %s",
+        ([950.0, 960.0, 1000.0], "test_key"),
+    )
+
+
+def test_sql_rate_limiter_returns_exact_wait():
+    rate_limiter, cursor = sql_rate_limiter([990.0, 950.0, 960.0], 1000.0)
+
+    # The oldest request of the window leaves it at 1010
+    assert rate_limiter.try_acquire() == 10.0
+    assert not rate_limiter.is_allowed()
+    assert cursor.execute.call_args.args[0].startswith("SELECT")
+
+
+@patch("ctetl.ct_db.time.sleep")
+def test_sql_rate_limiter_acquire_sleeps_exact_wait(mock_sleep):
+    rate_limiter, cursor = sql_rate_limiter([], 1000.0)
+    cursor.fetchone.side_effect = [([950.0, 960.0, 990.0], 1000.0), ([960.0, 990.0], 1010.0)]
+
+    rate_limiter.acquire()
+
+    mock_sleep.assert_called_once_with(10.0)
+
+
+### Backwards compatibility
+
+
+def test_moved_functions_importable_from_ct_helpers():
+    from ctetl import ct_helpers, ct_minio, ct_redis
+
+    assert ct_helpers.create_minio_client is ct_minio.create_minio_client
+    assert ct_helpers.allow_request is ct_redis.allow_request
+
+
+def test_ct_helpers_unknown_attribute():
+    from ctetl import ct_helpers
+
+    with pytest.raises(AttributeError):
+        ct_helpers.not_a_function
@@ -0,0 +1,105 @@
+import pytest
+
+import os
+import sys
+
+from unittest.mock import MagicMock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from ctetl import ct_metrics
+
+
+@pytest.fixture
+def metrics_enabled(monkeypatch):
+    # Enable collection with empty registries and no outputs
+    monkeypatch.setattr(ct_metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(ct_metrics, "METRICS_STATSD", None)
+    monkeypatch.setattr(ct_metrics, "counters", {})
+    monkeypatch.setattr(ct_metrics, "histograms", {})
+
+
+def test_metrics_disabled_records_nothing(monkeypatch):
+    monkeypatch.setattr(ct_metrics, "METRICS_ENABLED", False)
+    monkeypatch.setattr(ct_metrics, "counters", {})
+    monkeypatch.setattr(ct_metrics, "histograms", {})
+
+    ct_metrics.increment("ct_test_total")
+    ct_metrics.observe("ct_test_seconds", 1.0)
+
+    assert ct_metrics.counters == {}
+    assert ct_metrics.histograms == {}
+
+
+def test_format_prometheus_text_counter(metrics_enabled):
+    ct_metrics.increment("ct_rows_total", 3, table="posts")
+    ct_metrics.increment("ct_rows_total", 2, table="posts")
+    ct_metrics.increment("ct_rows_total", 1, table="accounts")
+
+    text = ct_metrics.format_prometheus_text()
+
+    assert text == (
+        "# TYPE ct_rows_total counter\n"
+        'ct_rows_total{table="accounts"} 1\n'
+        'ct_rows_total{table="posts"} 5\n'
+    )
+
+
+def test_format_prometheus_text_histogram(metrics_enabled):
+    ct_metrics.observe("ct_request_seconds", 0.2, endpoint="post")
+    ct_metrics.observe("ct_request_seconds", 3, endpoint="post")
+
+    lines = ct_metrics.format_prometheus_text().splitlines()
+
+    assert lines[0] == "# TYPE ct_request_seconds histogram"
+    assert 'ct_request_seconds_bucket{endpoint="post",le="0.1"} 0' in lines
+    assert 'ct_request_seconds_bucket{endpoint="post",le="0.25"} 1' in lines
+    assert 'ct_request_seconds_bucket{endpoint="post",le="5"} 2' in lines
+    assert 'ct_request_seconds_bucket{endpoint="post",le="+Inf"} 2' in lines
+    assert 'ct_request_seconds_sum{endpoint="post"} 3.2' in lines
+    assert 'ct_request_seconds_count{endpoint="post"} 2' in lines
+
+
+def test_send_statsd(metrics_enabled, monkeypatch):
+    mock_socket = MagicMock()
+    monkeypatch.setattr(ct_metrics, "METRICS_STATSD", "localhost:8125")
+    monkeypatch.setattr(ct_metrics, "statsd_socket", mock_socket)
+    monkeypatch.setattr(ct_metrics, "statsd_address", ("localhost", 8125))
+
+    ct_metrics.observe("ct_request_seconds", 0.25, endpoint="post")
+
+    mock_socket.sendto.assert_called_once_with(
+        b"ct_request_seconds:250|ms|#endpoint:post", ("localhost", 8125)
+    )
+
+
+def test_write_metrics_textfile(metrics_enabled, monkeypatch, tmp_path):
+    monkeypatch.setattr(ct_metrics, "METRICS_TEXTFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(ct_metrics, "METRICS_PUSHGATEWAY", None)
+    monkeypatch.setattr(ct_metrics.sys, "argv", ["/opt/ct_transform_and_load.py"])
+    ct_metrics.increment("ct_rows_total")
+
+    ct_metrics.write_metrics()
+
+    assert (tmp_path / "ct_transform_and_load.prom").read_text() == (
+        "# TYPE ct_rows_total counter\nct_rows_total 1\n"
+    )
+
+
+def test_start_metrics_flush_writes_while_running(metrics_enabled, monkeypatch, tmp_path):
+    monkeypatch.setattr(ct_metrics, "METRICS_TEXTFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(ct_metrics, "METRICS_PUSHGATEWAY", None)
+    monkeypatch.setattr(ct_metrics.sys, "argv", ["/opt/ct_daemon.py"])
+    ct_metrics.increment("ct_rows_total")
+
+    stop_event = ct_metrics.start_metrics_flush(interval=0.01)
+    try:
+        path = tmp_path / "ct_daemon.prom"
+        for _ in range(500):
+            if path.exists():
+                break
+            stop_event.wait(0.01)
+    finally:
+        stop_event.set()
+
+    assert path.read_text() == "# TYPE ct_rows_total counter\nct_rows_total 1\n"
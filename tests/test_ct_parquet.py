@@ -0,0 +1,176 @@
+import pytest
+
+import os
+import sys
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+pytest.importorskip("pyarrow")
+
+import pyarrow.dataset
+import pyarrow.parquet
+
+from ctetl.ct_parquet import ParquetSink
+from ctetl.ct_reporting import query_report_data_from_parquet
+from ctetl.ct_synthetic import make_post_details_response
+from ctetl.ct_tl import transform_post_details, flush_detail_objects
+from ctetl.ct_tl import KnownKeysCache
+
+
+def transformed_rows(platform_ids):
+    accounts, posts, post_metrics = [], [], []
+    for platform_id in platform_ids:
+        rows = transform_post_details(
+            make_post_details_response(platform_id, history_length=3),
+            f"{platform_id}_2023-12-16T05:00:00_.txt",
+        )
+        accounts.extend(rows[0])
+        posts.extend(rows[1])
+        post_metrics.extend(rows[2])
+    return accounts, posts, post_metrics
+
+
+def test_parquet_sink_writes_hive_partitions(tmp_path):
+    # Posted 2023-12-13 and 2023-12-14 (milliseconds since the epoch)
+    accounts, posts, post_metrics = transformed_rows(
+        ["1000_1702443600000", "1001_1702530000000"]
+    )
+    posting_dates = {row[0]: row[2] for row in posts}
+
+    sink = ParquetSink(str(tmp_path))
+    sink.add(accounts, posts, post_metrics, posting_dates)
+    # Nothing written until the buffers are flushed
+    assert not list(tmp_path.iterdir())
+    sink.close()
+
+    assert sorted(os.listdir(tmp_path / "posts")) == [
+        "posting_day=2023-12-13",
+        "posting_day=2023-12-14",
+    ]
+    post_metrics_table = pyarrow.dataset.dataset(
+        tmp_path / "post_metrics", partitioning="hive"
+    ).to_table()
+    assert post_metrics_table.num_rows == len(post_metrics)
+    assert "posting_day" in post_metrics_table.column_names
+    assert pyarrow.dataset.dataset(tmp_path / "accounts").count_rows() == 2
+
+
+def test_parquet_sink_writes_full_row_groups(tmp_path):
+    accounts, posts, post_metrics = transformed_rows(["1000_1702443600000"])
+    posting_dates = {row[0]: row[2] for row in posts}
+
+    sink = ParquetSink(str(tmp_path), row_group_size=len(post_metrics))
+    sink.add(accounts, posts, post_metrics, posting_dates)
+
+    # post_metrics reached row_group_size and were written without a flush
+    assert os.listdir(tmp_path) == ["post_metrics"]
+
+
+def test_report_data_from_parquet_reads_only_window(tmp_path):
+    now_ms = int(datetime.now(timezone.utc).timestamp()) * 1000
+    in_window = f"1000_{now_ms - 80 * 3600 * 1000}"
+    too_recent = f"1001_{now_ms - 10 * 3600 * 1000}"
+    accounts, posts, post_metrics = transformed_rows([in_window, too_recent])
+
+    sink = ParquetSink(str(tmp_path))
+    sink.add(accounts, posts, post_metrics, {row[0]: row[2] for row in posts})
+    sink.close()
+
+    df = query_report_data_from_parquet(str(tmp_path), start=96, end=72)
+
+    assert set(df["platform_id"]) == {in_window}
+    assert list(df.columns) == [
+        "account_name",
+        "account_id",
+        "platform_id",
+        "post_message",
+        "post_url",
+        "sgt_posting_date",
+        "sgt_as_of",
+        "score",
+        "metric_timestep",
+    ]
+
+
+def test_parquet_sink_skips_rows_already_written(tmp_path):
+    accounts, posts, post_metrics = transformed_rows(["1000_1702443600000"])
+    posting_dates = {row[0]: row[2] for row in posts}
+
+    sink = ParquetSink(str(tmp_path))
+    sink.add(accounts, posts, post_metrics, posting_dates)
+    sink.add(accounts, posts, post_metrics, posting_dates)
+    sink.close()
+
+    for table, rows in (
+        ("accounts", accounts),
+        ("posts", posts),
+        ("post_metrics", post_metrics),
+    ):
+        assert pyarrow.dataset.dataset(tmp_path / table).count_rows() == len(rows)
+
+
+def test_parquet_sink_files_share_schema(tmp_path):
+    accounts, posts, post_metrics = transformed_rows(
+        ["1000_1702443600000", "1001_1702530000000"]
+    )
+    posting_dates = {row[0]: row[2] for row in posts}
+    # The page category of the second account is null, as sent by the API
+    accounts[1] = accounts[1][:10] + (None,) + accounts[1][11:]
+
+    sink = ParquetSink(str(tmp_path))
+    sink.add(accounts[:1], posts[:1], [], posting_dates)
+    sink.flush()
+    sink.add(accounts[1:], posts[1:], post_metrics, posting_dates)
+    sink.close()
+
+    for table in ("accounts", "posts"):
+        schemas = {
+            pyarrow.parquet.read_schema(path)
+            for path in (tmp_path / table).rglob("*.parquet")
+        }
+        assert len(schemas) == 1
+    assert pyarrow.dataset.dataset(tmp_path / "accounts").to_table()[
+        "account_page_category"
+    ].type == pyarrow.string()
+
+
+@patch("ctetl.ct_tl.query_metric_watermarks", return_value={})
+@patch("ctetl.ct_tl.insert_to_postgres")
+def test_rows_already_in_postgres_still_reach_parquet_report(
+    mock_insert, mock_query, tmp_path
+):
+    now_ms = int(datetime.now(timezone.utc).timestamp()) * 1000
+    platform_id = f"1000_{now_ms - 80 * 3600 * 1000}"
+    accounts, posts, post_metrics = transformed_rows([platform_id])
+
+    # Everything was loaded to PostgreSQL by an earlier run without --parquet
+    known_accounts, known_posts = KnownKeysCache(10), KnownKeysCache(10)
+    known_accounts.add(accounts[0][0])
+    known_posts.add(platform_id)
+    metric_watermarks = {platform_id: max(row[6] for row in post_metrics)}
+
+    sink = ParquetSink(str(tmp_path))
+    flush_detail_objects(
+        MagicMock(),
+        "bucket",
+        "tags",
+        [f"{platform_id}_2023-12-16T05:00:00_.txt"],
+        accounts,
+        posts,
+        post_metrics,
+        metric_watermarks,
+        known_accounts,
+        known_posts,
+        parquet_sink=sink,
+    )
+    sink.close()
+
+    # Only the latest timestep is sent to PostgreSQL again
+    latest_timestep = metric_watermarks.get(platform_id)
+    assert mock_insert.call_args.args[3:5] == ([], [])
+    assert {row[6] for row in mock_insert.call_args.args[5]} == {latest_timestep}
+    df = query_report_data_from_parquet(str(tmp_path), start=96, end=72)
+    assert set(df["platform_id"]) == {platform_id}
+    assert len(df) == len(post_metrics)
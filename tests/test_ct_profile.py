@@ -0,0 +1,61 @@
+import pytest
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from ctetl import ct_profile
+from ctetl.ct_profile import span, traced, profile_run
+
+
+def test_span_disabled_is_no_op(capsys):
+    assert span("fetch") is ct_profile.NULL_SPAN
+
+    with span("fetch"):
+        pass
+
+    assert capsys.readouterr().err == ""
+
+
+def test_spans_nest_and_log_json(monkeypatch, capsys):
+    monkeypatch.setattr(ct_profile, "SPANS_ENABLED", True)
+
+    @traced("insert")
+    def insert():
+        pass
+
+    with span("flush", objects=2):
+        insert()
+
+    records = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+
+    assert [record["path"] for record in records] == ["flush/insert", "flush"]
+    assert records[1]["objects"] == 2
+    assert all(record["duration_ms"] >= 0 for record in records)
+
+
+def test_span_records_error(monkeypatch, capsys):
+    monkeypatch.setattr(ct_profile, "SPANS_ENABLED", True)
+
+    with pytest.raises(SystemExit):
+        with span("fetch"):
+            sys.exit(1)
+
+    assert json.loads(capsys.readouterr().err)["error"] == "SystemExit"
+
+
+def test_profile_run_saves_artifacts(monkeypatch, tmp_path, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["/opt/ct_score_report.py"])
+
+    with profile_run("all"):
+        with span("report"):
+            pass
+
+    suffixes = sorted(path.name.split("-ct_score_report")[1] for path in tmp_path.iterdir())
+    assert suffixes == ["-memory.txt", ".prof", ".tracemalloc"]
+    assert "run/report" in capsys.readouterr().err
+    # Spans are switched off again after the run
+    assert span("report") is ct_profile.NULL_SPAN
@@ -0,0 +1,82 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from unittest.mock import MagicMock, patch
+
+from ctetl.ct_reload import get_reload_days, get_legacy_reload_object_names
+from ctetl.ct_reload import iter_work_unit_objects, apply_reload_tables
+
+
+def test_get_reload_days_is_inclusive():
+    assert get_reload_days("2023-12-30", "2024-01-02") == [
+        "2023/12/30",
+        "2023/12/31",
+        "2024/01/01",
+        "2024/01/02",
+    ]
+
+
+@patch("ctetl.ct_reload.get_legacy_object_names")
+def test_get_legacy_reload_object_names_filters_by_fetch_date(mock_get_names):
+    mock_get_names.return_value = [
+        "1000_1_2023-12-12T23:59:59_.txt",
+        "1000_1_2023-12-13T00:00:00_.txt",
+        "1000_2_2023-12-14T23:59:59_.txt",
+        "1000_2_2023-12-15T00:00:00_.txt",
+    ]
+
+    object_names = get_legacy_reload_object_names(
+        MagicMock(), "ct-post-details", "2023-12-13", "2023-12-14"
+    )
+
+    assert object_names == [
+        "1000_1_2023-12-13T00:00:00_.txt",
+        "1000_2_2023-12-14T23:59:59_.txt",
+    ]
+
+
+@patch("ctetl.ct_reload.get_minio_object_data")
+@patch("ctetl.ct_reload.iter_segment_data")
+def test_day_work_unit_reads_segment_and_partition(mock_iter_segment, mock_get_data):
+    mock_iter_segment.return_value = iter([("compacted", b'{"a": 1}')])
+    mock_get_data.return_value = b'{"b": 2}'
+    minio_client = MagicMock()
+    minio_client.list_objects.return_value = [MagicMock(object_name="partitioned")]
+
+    objects = list(
+        iter_work_unit_objects(
+            minio_client, "ct-post-details", "ct-post-details-archive", ("day", "2023/12/13")
+        )
+    )
+
+    assert objects == [("compacted", b'{"a": 1}'), ("partitioned", b'{"b": 2}')]
+    minio_client.list_objects.assert_called_once_with(
+        "ct-post-details", prefix="v2/2023/12/13/", recursive=True
+    )
+
+
+@patch("ctetl.ct_reload.get_psycopg2_connection")
+def test_apply_reload_tables_replaces_reloaded_dates_only(mock_connection):
+    cursor = (
+        mock_connection.return_value.__enter__.return_value.cursor.return_value
+    ).__enter__.return_value
+    cursor.fetchall.return_value = [("platform_id",), ("account_id",)]
+
+    apply_reload_tables("2024-01-01", "2024-01-02")
+
+    statements = [call.args[0] for call in cursor.execute.call_args_list]
+    assert not any("LOCK" in statement for statement in statements)
+    assert not any("RENAME" in statement for statement in statements)
+    delete_call = next(
+        call
+        for call in cursor.execute.call_args_list
+        if call.args[0].startswith("WITH replaced AS (DELETE FROM post_metrics")
+    )
+    assert delete_call.args[1] == ("2024-01-01", "2024-01-03")
+    assert (
+        "INSERT INTO posts SELECT * FROM posts_reload "
+        "ON CONFLICT (platform_id) DO UPDATE SET account_id = EXCLUDED.account_id"
+    ) in statements
+    assert statements[-1] == "UPDATE load_watermarks SET loaded_at = now()"
@@ -0,0 +1,77 @@
+import pytest
+
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from unittest.mock import MagicMock
+
+import pandas as pd
+
+from ctetl import ct_report_cache
+from ctetl.ct_report_cache import write_cached_report, read_cached_report
+from ctetl.ct_reporting import create_score_report
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # Reports are written to the current directory
+    monkeypatch.chdir(tmp_path)
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(ct_report_cache, "REPORT_CACHE_DIR", str(cache_dir))
+    return cache_dir
+
+
+def report_data():
+    return pd.DataFrame(
+        {
+            "platform_id": ["1_2"] * 2,
+            "score": [1.0, 2.0],
+            "metric_timestep": [0, 1],
+        }
+    )
+
+
+def test_repeat_report_is_served_from_cache(cache_dir):
+    query_report_data = MagicMock(side_effect=lambda start, end: report_data())
+    load_watermark = MagicMock(return_value="db 2023-12-13T05:00:00")
+
+    create_score_report(query_report_data, query_load_watermark=load_watermark)
+    create_score_report(query_report_data, query_load_watermark=load_watermark)
+
+    assert query_report_data.call_count == 1
+    reports = [path for path in os.listdir(cache_dir.parent) if path.endswith(".csv")]
+    assert reports
+    with open(cache_dir.parent / reports[0], "rb") as report_file:
+        assert report_file.read().decode("utf-8-sig").startswith("platform_id,score")
+
+    # A load into the window invalidates the cached report
+    load_watermark.return_value = "db 2023-12-13T05:05:00"
+    create_score_report(query_report_data, query_load_watermark=load_watermark)
+
+    assert query_report_data.call_count == 2
+
+
+def test_report_without_watermark_is_not_cached(cache_dir):
+    query_report_data = MagicMock(side_effect=lambda start, end: report_data())
+
+    create_score_report(query_report_data, query_load_watermark=lambda start, end: None)
+    create_score_report(query_report_data)
+
+    assert query_report_data.call_count == 2
+    assert not cache_dir.exists()
+
+
+def test_least_recently_used_reports_are_evicted(cache_dir, monkeypatch):
+    monkeypatch.setattr(ct_report_cache, "REPORT_CACHE_MAX_BYTES", 25)
+
+    write_cached_report("a", b"x" * 10)
+    write_cached_report("b", b"x" * 10)
+    os.utime(cache_dir / "b.csv", (0, 0))
+    # a is now more recently used than b
+    write_cached_report("c", b"x" * 10)
+
+    assert read_cached_report("b") is None
+    assert read_cached_report("a") is not None
+    assert read_cached_report("c") is not None
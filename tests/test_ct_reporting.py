@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+import pandas as pd
+
+from ctetl.ct_reporting import compact_report_dtypes, generate_report
+
+
+def report_rows(platform_id, timesteps):
+    return [
+        {
+            "account_name": "account",
+            "account_id": 1000,
+            "platform_id": platform_id,
+            "post_message": "message",
+            "post_url": "url",
+            "sgt_posting_date": pd.Timestamp("2023-12-13 13:00"),
+            "sgt_as_of": pd.Timestamp("2023-12-16 13:00"),
+            "score": float(timestep),
+            "metric_timestep": timestep,
+        }
+        for timestep in timesteps
+    ]
+
+
+def test_generate_report_forward_fills_missing_timesteps():
+    df = compact_report_dtypes(
+        pd.DataFrame(report_rows("1000_2", [3, 5, 60]) + report_rows("1000_1", [0]))
+    )
+
+    report_df = generate_report(df)
+
+    # Posts in order of appearance, from their first timestep to 50
+    assert list(report_df.columns) == list(df.columns)
+    assert len(report_df) == (51 - 3) + 51
+    post_df = report_df[report_df["platform_id"] == "1000_2"]
+    assert post_df["metric_timestep"].tolist() == list(range(3, 51))
+    assert post_df["score"].tolist() == [3.0, 3.0] + [5.0] * 46
+    assert report_df["platform_id"].iloc[0] == "1000_2"
+    assert report_df["account_id"].dtype == "int64"
+
+
+def test_generate_report_keeps_first_row_of_repeated_timestep():
+    rows = report_rows("1000_1", [0, 0])
+    rows[1]["score"] = 9.0
+    df = compact_report_dtypes(pd.DataFrame(rows))
+
+    report_df = generate_report(df)
+
+    assert report_df["score"].unique().tolist() == [0.0]
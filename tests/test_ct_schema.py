@@ -0,0 +1,72 @@
+import pytest
+
+import json
+import os
+import sys
+from datetime import datetime
+
+import msgspec
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from ctetl.ct_schema import decode_post_details
+from ctetl.ct_synthetic import make_post_details_response
+
+
+PLATFORM_ID = "1000_1702184400000"
+
+
+def test_decode_post_details_declared_fields_only():
+    details = make_post_details_response(PLATFORM_ID, history_length=2)
+
+    post = decode_post_details(json.dumps(details).encode()).result.posts[0]
+
+    assert post.platform_id == PLATFORM_ID
+    assert post.date == datetime(2023, 12, 10, 5)
+    assert post.account.verified is True
+    assert post.history[0].actual["likeCount"] >= 0
+    # Fields not loaded to PostgreSQL are skipped
+    assert not hasattr(post, "score")
+    assert not hasattr(post.account, "profile_image")
+
+
+def test_decode_post_details_parsed_json_same_as_raw():
+    details = make_post_details_response(PLATFORM_ID, history_length=2)
+
+    assert decode_post_details(details) == decode_post_details(json.dumps(details))
+
+
+def test_decode_post_details_optional_fields_default():
+    details = make_post_details_response(PLATFORM_ID)
+    del details["result"]["posts"][0]["title"]
+    del details["result"]["posts"][0]["expandedLinks"]
+
+    post = decode_post_details(details).result.posts[0]
+
+    assert post.title is None
+    assert post.expanded_links is None
+
+
+def test_decode_post_details_null_or_missing_account_fields():
+    details = make_post_details_response(PLATFORM_ID)
+    account = details["result"]["posts"][0]["account"]
+    account["pageAdminTopCountry"] = None
+    del account["pageDescription"]
+    del account["pageCategory"]
+    details["result"]["posts"][0]["message"] = None
+
+    post = decode_post_details(json.dumps(details)).result.posts[0]
+
+    assert post.account.page_admin_top_country is None
+    assert post.account.page_description is None
+    assert post.account.page_category is None
+    assert post.account.name == account["name"]
+    assert post.message is None
+
+
+def test_decode_post_details_validates_types():
+    details = make_post_details_response(PLATFORM_ID)
+    details["result"]["posts"][0]["account"]["verified"] = "yes"
+
+    with pytest.raises(msgspec.ValidationError, match="verified"):
+        decode_post_details(json.dumps(details))
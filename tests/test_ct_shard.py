@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from unittest.mock import MagicMock, patch
+
+from ctetl.ct_shard import get_object_shard, group_objects_by_shard
+from ctetl.ct_shard import load_detail_shards
+
+
+def test_details_of_a_post_share_a_shard():
+    first = get_object_shard("1000_1702184400000_2023-12-13T05:00:00_.txt", 8)
+    second = get_object_shard("1000_1702184400000_2023-12-14T05:00:00_.txt", 8)
+
+    assert first == second
+    assert 0 <= first < 8
+
+
+def test_group_objects_by_shard_covers_every_object():
+    object_names = [f"1000_{i}_2023-12-13T05:00:00_.txt" for i in range(100)]
+
+    shards = group_objects_by_shard(object_names, 4)
+
+    assert sorted(sum(shards.values(), [])) == sorted(object_names)
+    assert len(shards) == 4
+
+
+@patch("ctetl.ct_shard.load_detail_objects")
+@patch("ctetl.ct_shard.release_lease")
+@patch("ctetl.ct_shard.acquire_lease")
+def test_load_detail_shards_skips_leased_shards(
+    mock_acquire, mock_release, mock_load
+):
+    object_names = [f"1000_{i}_2023-12-13T05:00:00_.txt" for i in range(100)]
+    shards = group_objects_by_shard(object_names, 4)
+    # Every shard but shard 0 is leased by another worker
+    mock_acquire.side_effect = lambda client, key, owner, ttl: key.endswith(":0")
+
+    loaded_shards = load_detail_shards(
+        MagicMock(), MagicMock(), "ct-post-details", {}, object_names, 4, "worker"
+    )
+
+    assert loaded_shards == 1
+    loaded_names = sum((call.args[3] for call in mock_load.call_args_list), [])
+    assert loaded_names == shards[0]
+    mock_release.assert_called_once()
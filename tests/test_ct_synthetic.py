@@ -0,0 +1,71 @@
+import os
+import sys
+
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from ctetl.ct_synthetic import make_posts_response
+from ctetl.ct_synthetic import make_post_details_response
+from ctetl.ct_tl import load_columns_to_extract
+from ctetl.ct_tl import transform_post_details
+
+
+START = datetime(2023, 12, 10, 5)
+END = datetime(2023, 12, 10, 7)
+
+
+def test_make_posts_response_paginates():
+    first_page = make_posts_response("http://mock", "key", START, END, count=150)
+    next_page = first_page["result"]["pagination"]["nextPage"]
+
+    assert len(first_page["result"]["posts"]) == 150
+    assert next_page.startswith("http://mock/posts?token=key")
+    assert "offset=150" in next_page
+
+    last_page = make_posts_response("http://mock", "key", START, END, count=150, offset=150)
+
+    assert len(last_page["result"]["posts"]) == 50
+    assert "nextPage" not in last_page["result"]["pagination"]
+
+
+def test_make_posts_response_is_deterministic_and_sorted():
+    posts = make_posts_response("", "", START, END)["result"]["posts"]
+
+    assert posts == make_posts_response("", "", START, END)["result"]["posts"]
+    assert [post["date"] for post in posts] == sorted(
+        (post["date"] for post in posts), reverse=True
+    )
+    assert all(START <= datetime.fromisoformat(post["date"]) < END for post in posts)
+
+
+def test_make_post_details_response_matches_posts_response():
+    post = make_posts_response("", "", START, END)["result"]["posts"][7]
+
+    details = make_post_details_response(post["platformId"], history_length=5)
+    detailed_post = details["result"]["posts"][0]
+
+    assert len(detailed_post.pop("history")) == 5
+    # updated depends on the history length
+    detailed_post.pop("updated")
+    post.pop("updated")
+    assert detailed_post == post
+
+
+def test_make_post_details_response_unknown_platform_id():
+    assert make_post_details_response("not_a_platform_id") is None
+
+
+def test_post_details_response_has_columns_to_extract(capsys):
+    post = make_posts_response("", "", START, END)["result"]["posts"][0]
+    details = make_post_details_response(post["platformId"], history_length=3)
+
+    accounts_cols, posts_cols, _ = load_columns_to_extract()
+    accounts, posts, post_metrics = transform_post_details(
+        details, f"{post['platformId']}_2023-12-13T05:00:00_.txt"
+    )
+
+    assert len(accounts[0]) == len(accounts_cols)
+    assert len(posts[0]) == len(posts_cols)
+    # 3 timesteps of 6 metrics
+    assert len(post_metrics) == 18
@@ -0,0 +1,265 @@
+import pytest
+
+import json
+import os
+import sys
+from datetime import date, datetime
+
+from unittest.mock import MagicMock, call, patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../src")))
+
+from ctetl.ct_tl import filter_post_metrics
+from ctetl.ct_tl import flush_detail_objects
+from ctetl.ct_tl import KnownKeysCache, MetricWatermarksCache
+from ctetl.ct_tl import filter_known_rows
+from ctetl.ct_tl import PostDetailsBatcher
+from ctetl.ct_tl import transform_post_details
+from ctetl.ct_synthetic import make_post_details_response
+
+
+def metric_row(platform_id, metric_name, metric_timestep, as_of="2023-12-13T05:00:00"):
+    # Same column order as transform_post_details output
+    return (platform_id, as_of, 1.0, metric_name, 10, None, metric_timestep)
+
+
+### Delta loading of post_metrics
+
+
+def post_row(platform_id):
+    # Columns of posts up to posting_date, see ct_tl.load_columns_to_extract
+    return (platform_id, "Facebook", datetime(2023, 12, 13, 5))
+
+
+def test_filter_post_metrics_drops_loaded_timesteps():
+    rows = [metric_row("1_2", "likeCount", ts) for ts in range(5)]
+
+    kept_rows, kept_watermarks = filter_post_metrics(rows, {"1_2": 2})
+
+    # The watermark timestep may still be in progress and is reloaded
+    assert [row[6] for row in kept_rows] == [2, 3, 4]
+    assert kept_watermarks == {"1_2": 4}
+
+
+def test_filter_post_metrics_unknown_post_keeps_everything():
+    rows = [metric_row("1_2", "likeCount", ts) for ts in range(3)]
+
+    kept_rows, kept_watermarks = filter_post_metrics(rows, {})
+
+    assert kept_rows == rows
+    assert kept_watermarks == {"1_2": 2}
+
+
+def test_filter_post_metrics_keeps_last_fetch_in_batch():
+    # The same post fetched twice in one batch has a different as_of
+    first = [metric_row("1_2", "likeCount", ts, "first") for ts in range(3)]
+    second = [metric_row("1_2", "likeCount", ts, "second") for ts in range(2)]
+
+    kept_rows, _ = filter_post_metrics(first + second, {})
+
+    assert kept_rows == [first[2]] + second
+
+
+def test_filter_post_metrics_refetch_keeps_latest_timestep():
+    rows = [metric_row("1_2", "likeCount", ts, "later") for ts in range(3)]
+
+    kept_rows, kept_watermarks = filter_post_metrics(rows, {"1_2": 2})
+
+    # Values of the latest timestep are updated rather than frozen
+    assert kept_rows == [rows[2]]
+    assert kept_watermarks == {"1_2": 2}
+
+
+def test_metric_watermarks_cache_evicts_least_recently_used():
+    metric_watermarks = MetricWatermarksCache(maxsize=2)
+    metric_watermarks.update({"1_1": 3, "1_2": 5})
+    assert metric_watermarks.get("1_1") == 3
+
+    metric_watermarks.setdefault("1_3", -1)
+
+    assert "1_2" not in metric_watermarks
+    assert metric_watermarks.get("1_1", -1) == 3
+    assert metric_watermarks.get("1_3") == -1
+    assert len(metric_watermarks) == 2
+
+
+@patch("ctetl.ct_tl.insert_to_postgres")
+@patch("ctetl.ct_tl.query_metric_watermarks")
+def test_flush_detail_objects_uses_db_fallback(mock_query, mock_insert):
+    minio_client = MagicMock()
+    mock_query.return_value = {"3_4": 0}
+    metric_watermarks = {"1_2": 1}
+    rows = [metric_row(pid, "likeCount", ts) for pid in ("1_2", "3_4") for ts in range(3)]
+
+    flush_detail_objects(
+        minio_client,
+        "bucket",
+        "tags",
+        ["a", "b"],
+        [],
+        [],
+        rows,
+        metric_watermarks,
+        KnownKeysCache(0),
+        KnownKeysCache(0),
+    )
+
+    # Only the post missing from memory is looked up
+    mock_query.assert_called_once_with({"3_4"})
+    inserted = mock_insert.call_args.args[5]
+    assert [(row[0], row[6]) for row in inserted] == [
+        ("1_2", 1),
+        ("1_2", 2),
+        ("3_4", 0),
+        ("3_4", 1),
+        ("3_4", 2),
+    ]
+    assert metric_watermarks == {"1_2": 2, "3_4": 2}
+    assert minio_client.set_object_tags.call_args_list == [
+        call("bucket", "a", "tags"),
+        call("bucket", "b", "tags"),
+    ]
+
+
+### Known accounts and posts cache
+
+
+def test_known_keys_cache_evicts_least_recently_used():
+    known_keys = KnownKeysCache(2)
+    known_keys.add("a", "b")
+
+    # Looking up "a" makes "b" the least recently used
+    assert "a" in known_keys
+    known_keys.add("c")
+
+    assert "b" not in known_keys
+    assert "a" in known_keys
+    assert "c" in known_keys
+    assert known_keys.stats() == {"size": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_known_keys_cache_zero_size_never_hits():
+    known_keys = KnownKeysCache(0)
+    known_keys.add("a")
+
+    assert "a" not in known_keys
+
+
+def test_filter_known_rows():
+    known_keys = KnownKeysCache(10)
+    known_keys.add(1)
+    rows = [(1, "known"), (2, "new"), (2, "repeat"), (3, "new")]
+
+    assert filter_known_rows(rows, known_keys) == [(2, "new"), (3, "new")]
+
+
+@patch("ctetl.ct_tl.insert_to_postgres")
+@patch("ctetl.ct_tl.query_metric_watermarks", return_value={})
+def test_flush_detail_objects_skips_known_rows(mock_query, mock_insert):
+    known_accounts = KnownKeysCache(10)
+    known_posts = KnownKeysCache(10)
+    known_accounts.add(1)
+
+    flush_detail_objects(
+        MagicMock(),
+        "bucket",
+        "tags",
+        ["a"],
+        [(1, "known account"), (2, "new account")],
+        [post_row("1_2")],
+        [],
+        {},
+        known_accounts,
+        known_posts,
+    )
+
+    assert mock_insert.call_args.args[3] == [(2, "new account")]
+    assert mock_insert.call_args.args[4] == [post_row("1_2")]
+    # The load watermark of the posting day of the batch is advanced
+    assert mock_insert.call_args.args[6] == {date(2023, 12, 13)}
+    # Inserted rows are remembered for the next batch
+    assert 2 in known_accounts
+    assert "1_2" in known_posts
+
+
+### Write-through loading of fetched post details
+
+
+@patch("ctetl.ct_tl.query_metric_watermarks", return_value={})
+@patch("ctetl.ct_tl.insert_to_postgres")
+@patch("ctetl.ct_tl.transform_post_details")
+def test_post_details_batcher_uploads_then_tags(mock_transform, mock_insert, mock_query):
+    minio_client = MagicMock()
+    mock_transform.side_effect = lambda js, name: ([], [post_row(name)], [])
+
+    details_batcher = PostDetailsBatcher(minio_client, "bucket", "tags", batch_size=2)
+    details_batcher.add({}, "a", MagicMock(content=b"payload a"))
+    details_batcher.add({}, "b", MagicMock(content=b"payload b"))
+    details_batcher.add({}, "c")
+    details_batcher.close()
+
+    # Two batches: a full one and the remainder flushed on close
+    assert mock_insert.call_count == 2
+    assert mock_insert.call_args_list[0].args[4] == [post_row("a"), post_row("b")]
+    # Only objects handed over with a response are uploaded, every object is tagged
+    assert minio_client.put_object.call_count == 2
+    assert minio_client.set_object_tags.call_args_list == [
+        call("bucket", "a", "tags"),
+        call("bucket", "b", "tags"),
+        call("bucket", "c", "tags"),
+    ]
+
+
+@patch("ctetl.ct_tl.query_metric_watermarks", return_value={})
+@patch("ctetl.ct_tl.insert_to_postgres")
+@patch("ctetl.ct_tl.transform_post_details")
+def test_post_details_batcher_uploads_through_given_uploader(
+    mock_transform, mock_insert, mock_query
+):
+    minio_client = MagicMock()
+    uploader = MagicMock()
+    mock_transform.side_effect = lambda js, name: ([], [post_row(name)], [])
+
+    details_batcher = PostDetailsBatcher(
+        minio_client, "bucket", "tags", batch_size=1, uploader=uploader
+    )
+    details_batcher.add({}, "a", MagicMock(content=b"payload a"))
+    details_batcher.close()
+
+    uploader.put.assert_called_once_with("bucket", "a", b"payload a")
+    # Uploads are waited on before tagging, the caller closes its uploader
+    uploader.wait.assert_called_once()
+    uploader.close.assert_not_called()
+    minio_client.put_object.assert_not_called()
+
+
+### Transform
+
+
+def test_transform_post_details_shares_row_values(capsys):
+    details = make_post_details_response("1000_1702184400000", history_length=3)
+
+    _, _, post_metrics = transform_post_details(
+        json.dumps(details).encode(), "v2/2023/12/13/05/1000_1_2023-12-13T05:00:00_.txt"
+    )
+
+    # Rows of a metric are kept together
+    assert [row[3] for row in post_metrics[:4]] == ["actual.likeCount"] * 3 + [
+        "actual.shareCount"
+    ]
+    assert post_metrics[0][1] == datetime(2023, 12, 13, 5)
+    # Metric rows share their repeated values
+    assert post_metrics[0][0] is post_metrics[3][0]
+    assert post_metrics[0][1] is post_metrics[3][1]
+    assert post_metrics[0][3] is post_metrics[1][3]
+    assert post_metrics[0][5] is post_metrics[3][5]
+
+
+def test_transform_post_details_exits_on_invalid_details(capsys):
+    details = make_post_details_response("1000_1702184400000", history_length=3)
+    details["result"]["posts"][0]["subscriberCount"] = "many"
+
+    with pytest.raises(SystemExit):
+        transform_post_details(details, "1000_1_2023-12-13T05:00:00_.txt")
+
+    assert "subscriberCount" in capsys.readouterr().out
@@ -0,0 +1,51 @@
+import pytest
+
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../src"))
+
+# Entry script: (cap on cumulative import time in seconds, packages it must not import)
+# Caps are a few times the import time measured on a typical node so that only
+# real regressions, such as a backend imported by the wrong script, fail.
+ENTRY_POINTS = {
+    "ct_bundled_posts_to_minio": (1.5, {"pandas", "sqlalchemy", "psycopg2"}),
+    "ct_post_details_to_minio": (1.5, {"pandas", "sqlalchemy", "psycopg2"}),
+    "ct_post_details_from_stream": (1.5, {"pandas", "sqlalchemy", "psycopg2"}),
+    "ct_transform_and_load": (2.5, {"redis", "requests", "sqlalchemy"}),
+    "ct_score_report": (2.5, {"minio", "redis", "requests"}),
+}
+
+
+def import_times(module):
+    """
+    Import module in a fresh interpreter with -X importtime.
+    Returns {imported module: cumulative microseconds}.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("entry_point", ENTRY_POINTS)
+def test_entry_point_import_time(entry_point):
+    cap_seconds, forbidden_packages = ENTRY_POINTS[entry_point]
+
+    times = import_times(entry_point)
+
+    imported_packages = {name.split(".")[0] for name in times}
+    assert imported_packages.isdisjoint(forbidden_packages)
+    assert times[entry_point] / 1e6 < cap_seconds